@@ -1,3 +1,14 @@
 from core import *
 from paginator import *
 from tvrh import *
+from spool import *
+from buffer import *
+from fingerprint import *
+from sharding import *
+from reindex import *
+from scan import *
+from streaming import *
+from realtime import *
+from doccache import *
+from prefetch import *
+from membership import *
@@ -0,0 +1,292 @@
+import threading
+
+from solr.core import UpdateOps, Updater, _commit_query
+
+__all__ = ['UpdateBuffer']
+
+
+_SET_OPS = (None, UpdateOps.SET)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def _merge_op(old, new):
+    """
+    Combine two operations on one field, each an ``(op, value)`` pair
+    with `op` one of the `UpdateOps` values (or ``None`` for a plain
+    value), into one with the same effect.  Returns ``None`` if they
+    can't be combined.
+    """
+    old_op, old_value = old
+    new_op, new_value = new
+    if new_op in _SET_OPS:
+        return new
+    if new_op == UpdateOps.INC:
+        if old_op in _SET_OPS or old_op == UpdateOps.INC:
+            if (isinstance(old_value, (int, long, float))
+                    and not isinstance(old_value, bool)
+                    and isinstance(new_value, (int, long, float))):
+                return old_op, old_value + new_value
+    elif new_op == UpdateOps.ADD:
+        if old_op in _SET_OPS or old_op == UpdateOps.ADD:
+            return old_op, _as_list(old_value) + _as_list(new_value)
+    return None
+
+
+class _Pending(object):
+    # The outstanding changes to one document: an optional delete,
+    # followed by an optional full document, followed by atomic updates
+    # (each a dict mapping field names to (op, value) pairs).
+    __slots__ = ('delete', 'doc', 'updates')
+
+    def __init__(self):
+        self.delete = False
+        self.doc = None
+        self.updates = []
+
+
+class UpdateBuffer(object):
+    """
+    Buffer of updates which coalesces changes to the same document.
+
+    Changes are collected until `flush` is called, or until `max_docs`
+    documents have pending changes.  Within the buffer:
+
+    * a document added again replaces the earlier version (and any
+      pending atomic updates or delete);
+    * atomic updates are merged into a pending full document, or into
+      the previous atomic update of the document, where the operations
+      allow it (``set`` values replace earlier ones, ``inc`` deltas are
+      summed, ``add`` values are appended);
+    * a delete cancels any pending add or update of the document.
+
+    Documents are identified by their `unique_key` field.
+
+    For example:
+    >>> buf = solr.UpdateBuffer(conn)
+    >>> buf.add({'id': 1, 'price': 10, 'views': 0})
+    >>> views = buf.updater(views=solr.UpdateOps.INC)
+    >>> views.add({'id': 1, 'views': 1})
+    >>> views.add({'id': 1, 'views': 2})
+    >>> buf.flush(commit=True)
+
+    sends a single document with ``views`` set to 3.
+    """
+
+    def __init__(self, conn, unique_key='id', max_docs=1000):
+        self.conn = conn
+        self.unique_key = unique_key
+        self.max_docs = max_docs
+        self.received = 0
+        self.sent = 0
+        self._pending = {}
+        self._order = []
+        self._updaters = {}
+        self._lock = threading.RLock()
+
+    @property
+    def coalesced(self):
+        """Number of changes absorbed by other changes."""
+        return self.received - self.sent - len(self)
+
+    def __len__(self):
+        """Number of documents with pending changes."""
+        return len(self._order)
+
+    def add(self, doc):
+        """Buffer the addition of a full document."""
+        self._lock.acquire()
+        try:
+            state = self._state(doc[self.unique_key])
+            state.delete = False
+            state.doc = dict(doc)
+            state.updates = []
+        finally:
+            self._lock.release()
+        self._check_full()
+
+    def add_many(self, docs):
+        """Buffer the addition of several full documents."""
+        for doc in docs:
+            self.add(doc)
+
+    def update(self, field_ops, doc):
+        """
+        Buffer an atomic update of `doc`, where `field_ops` maps field
+        names to `UpdateOps` values as for `Solr.updater`.
+        """
+        changes = {}
+        for field, value in doc.items():
+            if field != self.unique_key:
+                changes[field] = (field_ops.get(field), value)
+        self._lock.acquire()
+        try:
+            self._update(self._state(doc[self.unique_key]), changes)
+        finally:
+            self._lock.release()
+        self._check_full()
+
+    def updater(self, **field_ops):
+        """
+        Return an object with `add` and `add_many` methods buffering
+        atomic updates, like `Solr.updater`.
+        """
+        return _BufferedUpdater(self, field_ops)
+
+    def delete(self, id=None, ids=None):
+        """Buffer the deletion of documents by id."""
+        ids = list(ids or ())
+        if id is not None:
+            ids.insert(0, id)
+        self._lock.acquire()
+        try:
+            for id in ids:
+                state = self._state(id)
+                state.delete = True
+                state.doc = None
+                state.updates = []
+        finally:
+            self._lock.release()
+        self._check_full()
+
+    def flush(self, **commit_args):
+        """
+        Send the pending changes: one request deleting documents, and
+        one adding and updating documents.
+
+        Supports commit-control arguments; the commit is collapsed into
+        the last request.
+        """
+        query, scheduler = _commit_query(self.conn, commit_args, strict=True)
+        self._lock.acquire()
+        try:
+            pending, order = self._pending, self._order
+            self._pending, self._order = {}, []
+        finally:
+            self._lock.release()
+
+        try:
+            deletes = []
+            adds = [u'<add>']
+            sent = 0
+            updater = Updater(self.conn)
+            for key in order:
+                state = pending[key]
+                if state.delete:
+                    deletes.append(key)
+                    sent += 1
+                if state.doc is not None:
+                    updater._doc_xml(adds, state.doc)
+                    sent += 1
+                for changes in state.updates:
+                    self._serialize_update(adds, key, changes)
+                    sent += 1
+            adds.append(u'</add>')
+
+            requests = []
+            if deletes:
+                requests.append(self.conn._delete(ids=deletes))
+            if len(adds) > 2:
+                requests.append(u''.join(adds))
+            data = None
+            for i, content in enumerate(requests):
+                last = i == len(requests) - 1
+                data = self.conn._update(content, last and query or None)
+        except:
+            # Keep the changes, so that they are sent by the next flush.
+            self._lock.acquire()
+            try:
+                self._restore(pending, order)
+            finally:
+                self._lock.release()
+            raise
+        self.sent += sent
+        if requests and scheduler is not None:
+            scheduler.schedule()
+        return data
+
+    def _restore(self, pending, order):
+        # Put back the changes `pending` (in `order`) taken by a flush
+        # which failed, with the changes buffered since applied on top.
+        # The caller holds the lock.
+        for key in self._order:
+            state = self._pending[key]
+            old = pending.get(key)
+            if old is None:
+                pending[key] = state
+                order.append(key)
+            elif state.delete or state.doc is not None:
+                pending[key] = state
+            else:
+                for changes in state.updates:
+                    self._update(old, changes)
+        self._pending, self._order = pending, order
+
+    def _state(self, key):
+        self.received += 1
+        state = self._pending.get(key)
+        if state is None:
+            state = self._pending[key] = _Pending()
+            self._order.append(key)
+        return state
+
+    def _check_full(self):
+        if self.max_docs is not None and len(self) >= self.max_docs:
+            self.flush()
+
+    def _update(self, state, changes):
+        if state.doc is not None and not state.updates:
+            merged = self._merge(
+                dict([(k, (None, v)) for k, v in state.doc.items()]),
+                changes)
+            if merged is not None and not [
+                    op for op, value in merged.values()
+                    if op not in _SET_OPS]:
+                state.doc = dict([(k, v) for k, (op, v) in merged.items()])
+                return
+        elif state.updates:
+            merged = self._merge(state.updates[-1], changes)
+            if merged is not None:
+                state.updates[-1] = merged
+                return
+        state.updates.append(changes)
+
+    def _merge(self, old, new):
+        merged = dict(old)
+        for field, change in new.items():
+            if field in merged:
+                change = _merge_op(merged[field], change)
+                if change is None:
+                    return None
+            merged[field] = change
+        return merged
+
+    def _serialize_update(self, lst, key, changes):
+        ops = tuple(sorted([(field, op) for field, (op, value)
+                            in changes.items() if op]))
+        updater = self._updaters.get(ops)
+        if updater is None:
+            updater = self._updaters[ops] = Updater(self.conn, dict(ops))
+        doc = dict([(field, value) for field, (op, value) in changes.items()])
+        doc[self.unique_key] = key
+        updater._doc_xml(lst, doc)
+
+
+class _BufferedUpdater(object):
+
+    def __init__(self, buffer, field_ops):
+        self.buffer = buffer
+        self.field_ops = field_ops
+
+    def add(self, doc):
+        self.buffer.update(self.field_ops, doc)
+
+    def add_many(self, docs):
+        for doc in docs:
+            self.buffer.update(self.field_ops, doc)
@@ -239,7 +239,11 @@ Enter a raw query, without processing the returned HTML contents.
     >>> print c.raw_query(q='id:[* TO *]', wt='python', rows='10')
 
 """
+import os
 import sys
+import copy
+import mmap
+import select
 import socket
 import httplib
 import urlparse
@@ -247,6 +251,10 @@ import codecs
 import urllib
 import datetime
 import logging
+import threading
+import time
+import itertools
+from collections import deque, namedtuple, OrderedDict
 from StringIO import StringIO
 from xml.sax import make_parser
 from xml.sax.handler import ContentHandler
@@ -256,8 +264,10 @@ from util import MultiDict
 
 __version__ = "0.9.5"
 
-__all__ = ['SolrException', 'Solr', 'SolrConnection',
-           'Response', 'SearchHandler']
+__all__ = ['SolrException', 'SolrBatchException', 'Solr', 'SolrConnection',
+           'Response', 'SearchHandler', 'UpdateOps', 'CommitScheduler',
+           'AdaptiveBatchSize', 'ConnectionPool', 'PreparedQuery',
+           'CountCache']
 
 _python_version = sys.version_info[0]+(sys.version_info[1]/10.0)
 
@@ -296,35 +306,70 @@ class SolrException(Exception):
         return 'HTTP code=%s, reason=%s' % (self.httpcode, self.reason)
 
 
+class SolrBatchException(SolrException):
+    """Raised when Solr rejected some documents of a batch.
+
+    The remaining documents of the batch have been added.
+    """
+
+    failures = ()
+    """List of ``(document, exception)`` pairs for the rejected documents."""
+
+    def __init__(self, failures):
+        SolrException.__init__(
+            self, 400, "%d document(s) rejected" % len(failures))
+        self.failures = failures
+
+
 # Decorator (used below)
 
+def _commit_query(self, kw, strict=False):
+    """
+    Remove the commit-control arguments from `kw`, returning the update
+    query parameters they call for and the commit scheduler, if the
+    commit is to be deferred.  If `strict` is true, `kw` may not hold
+    any other arguments.
+    """
+    commit = kw.pop("commit", False)
+    optimize = kw.pop("optimize", False)
+    query = {}
+    scheduler = None
+    if commit or optimize:
+        if optimize:
+            query["optimize"] = "true"
+        elif self.commits is not None:
+            scheduler = self.commits
+            query.update(scheduler.request_params())
+        elif commit:
+            query["commit"] = "true"
+        wait_searcher = kw.pop("wait_searcher", True)
+        wait_flush = kw.pop("wait_flush", True)
+        if not wait_searcher:
+            query["waitSearcher"] = "false"
+        if not wait_flush:
+            query["waitFlush"] = "false"
+            query["waitSearcher"] = "false"
+    elif "wait_flush" in kw:
+        raise TypeError(
+            "wait_flush cannot be specified without commit or optimize")
+    elif "wait_searcher" in kw:
+        raise TypeError(
+            "wait_searcher cannot be specified without commit or optimize")
+    if strict and kw:
+        raise TypeError("unexpected keyword arguments: %s" % ", ".join(kw))
+    return query, scheduler
+
+
 def committing(function=None):
 
     def wrapper(self, *args, **kw):
-        commit = kw.pop("commit", False)
-        optimize = kw.pop("optimize", False)
-        query = {}
-        if commit or optimize:
-            if optimize:
-                query["optimize"] = "true"
-            elif commit:
-                query["commit"] = "true"
-            wait_searcher = kw.pop("wait_searcher", True)
-            wait_flush = kw.pop("wait_flush", True)
-            if not wait_searcher:
-                query["waitSearcher"] = "false"
-            if not wait_flush:
-                query["waitFlush"] = "false"
-                query["waitSearcher"] = "false"
-        elif "wait_flush" in kw:
-            raise TypeError(
-                "wait_flush cannot be specified without commit or optimize")
-        elif "wait_searcher" in kw:
-            raise TypeError(
-                "wait_searcher cannot be specified without commit or optimize")
+        query, scheduler = _commit_query(self, kw)
         content = function(self, *args, **kw)
         if content:
-            return self._update(content, query)
+            data = self._update(content, query)
+            if scheduler is not None:
+                scheduler.schedule()
+            return data
         # If there's nothing to do (no content), should we issue a
         # commit/optimize if those are requested by the options?
 
@@ -348,7 +393,11 @@ class Solr:
                  http_pass=None,
                  post_headers={},
                  max_retries=3,
-                 debug=False):
+                 debug=False,
+                 commit_interval=None,
+                 commit_mode="within",
+                 fingerprints=None,
+                 pool_size=4):
 
         """
             url -- URI pointing to the Solr instance. Examples:
@@ -372,6 +421,19 @@ class Solr:
             http_user, http_pass -- If given, include HTTP Basic authentication 
                 in all request headers.
 
+            commit_interval, commit_mode -- If `commit_interval` is given,
+                commits requested using commit-control arguments are
+                coalesced by a `CommitScheduler` so that at most one is
+                issued per `commit_interval` seconds.  See `CommitScheduler`
+                for the values of `commit_mode`.
+
+            fingerprints -- A `FingerprintStore` recording the documents
+                sent, so that `add_many` can skip unchanged documents.
+
+            pool_size -- Maximum number of concurrent requests made by
+                methods which send requests in parallel, such as
+                `delete_many`.  See `ConnectionPool`.
+
         """
 
         self.scheme, self.host, self.path = urlparse.urlparse(url, 'http')[:3]
@@ -388,16 +450,7 @@ class Solr:
 
         assert self.max_retries >= 0
 
-        kwargs = {}
-
-        if self.timeout and _python_version >= 2.6 and _python_version < 3:
-            kwargs['timeout'] = self.timeout
-
-        if self.scheme == 'https':
-            self.conn = httplib.HTTPSConnection(self.host,
-                   key_file=ssl_key, cert_file=ssl_cert, **kwargs)
-        else:
-            self.conn = httplib.HTTPConnection(self.host, **kwargs)
+        self.conn = self._http_connection()
 
         self.response_version = 2.2
         self.encoder = codecs.getencoder('utf-8')
@@ -432,13 +485,59 @@ class Solr:
             self.form_headers['Connection'] = 'close'
 
         self.debug = debug
+
+        # Serializes use of the underlying HTTP connection, so that a
+        # connection may be shared with the commit scheduler's timer.
+        self._lock = threading.RLock()
+        if commit_interval is not None:
+            self.commits = CommitScheduler(self, commit_interval, commit_mode)
+        else:
+            self.commits = None
+        self.fingerprints = fingerprints
+        self.pool = ConnectionPool(self, pool_size)
+        self._bind_handlers()
+
+    def _bind_handlers(self):
         self.select = SearchHandler(self, "/select")
         self.add = Updater(self).add
         self.add_many = Updater(self).add_many
+        self.add_columns = Updater(self).add_columns
+        self.add_many_bisect = Updater(self).add_many_bisect
+        self.add_batches = Updater(self).add_batches
+        self.add_stream = Updater(self).add_stream
+
+    def _http_connection(self):
+        kwargs = {}
+
+        if self.timeout and _python_version >= 2.6 and _python_version < 3:
+            kwargs['timeout'] = self.timeout
+
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host,
+                   key_file=self.ssl_key, cert_file=self.ssl_cert, **kwargs)
+        else:
+            return httplib.HTTPConnection(self.host, **kwargs)
+
+    def _copy(self):
+        """
+        Return a copy of this connection with its own HTTP connection,
+        so that both can be used at the same time.  The copy has its own
+        (initially empty) pool, so a function run by `ConnectionPool.map`
+        can use the pool of its connection without waiting for the
+        connections held by the outer call.
+        """
+        other = copy.copy(self)
+        other.conn = self._http_connection()
+        other.reconnects = 0
+        other._lock = threading.RLock()
+        other.pool = ConnectionPool(other, self.pool.size)
+        other._bind_handlers()
+        return other
 
     def close(self):
-        """Close the underlying HTTP(S) connection."""
+        """Close the underlying HTTP(S) connection, and those in the pool."""
         self.conn.close()
+        self.pool.close()
 
 
     # Update interface.
@@ -472,15 +571,52 @@ class Solr:
         """
         return self._delete(id=id, ids=ids, queries=queries)
 
-    @committing
-    def delete_many(self, ids):
+    def delete_many(self, ids, chunk_size=1000, progress=None,
+                    **commit_args):
         """
         Delete documents using an iterable of ids.
 
-        This is equivalent to ``delete(ids=[ids])``.
-        Supports commit-control arguments.
+        Duplicate ids are dropped, and the rest are sent in requests of
+        at most `chunk_size` ids, several at a time through the
+        connection's `pool`.  `ids` may be an iterator; it is consumed as
+        the requests are sent.  If `progress` is given, it is called with
+        the number of ids deleted so far after each request.
+
+        Supports commit-control arguments; the commit is included in the
+        last request, sent once the others have completed.
         """
-        return self._delete(ids=ids)
+        query, scheduler = _commit_query(self, commit_args, strict=True)
+        chunks = _unique_chunks(ids, chunk_size)
+        try:
+            last = chunks.next()
+        except StopIteration:
+            return None
+
+        lock = threading.Lock()
+        deleted = [0]
+
+        def send(conn, chunk, query=None):
+            data = conn._update(conn._delete(ids=chunk), query)
+            if progress is not None:
+                lock.acquire()
+                try:
+                    deleted[0] += len(chunk)
+                    progress(deleted[0])
+                finally:
+                    lock.release()
+            return data
+
+        def held_back():
+            # Yield all chunks but the last, which carries the commit.
+            for chunk in chunks:
+                yield last[:]
+                last[:] = chunk
+
+        self.pool.map(send, held_back())
+        data = send(self, last, query)
+        if scheduler is not None:
+            scheduler.schedule()
+        return data
 
     @committing
     def delete_query(self, query):
@@ -492,6 +628,21 @@ class Solr:
         """
         return self._delete(queries=[query])
 
+    def delete_missing(self, **commit_args):
+        """
+        Delete the documents recorded in the connection's fingerprint
+        store which weren't added since the store's `begin` method was
+        last called, returning their ids.
+
+        Supports commit-control arguments.
+        """
+        if self.fingerprints is None:
+            raise ValueError("connection has no fingerprint store")
+        ids = self.fingerprints.missing()
+        if ids:
+            self.delete(ids=ids, **commit_args)
+        return ids
+
     def commit(self, wait_flush=True, wait_searcher=True, _optimize=False):
         """
         Issue a commit command to the Solr server.
@@ -499,9 +650,26 @@ class Solr:
         `wait_flush` and `wait_searcher` have the same interpretations as
         the like-name `commit-control arguments`_.
 
+        Any commits pending in the commit scheduler are satisfied by this
+        commit.
+
         """
+        if self.commits is not None:
+            self.commits.cancel()
         return self._commit("commit", wait_flush, wait_searcher)
 
+    def flush_commits(self, wait_flush=True, wait_searcher=True):
+        """
+        Immediately issue any commit deferred by the commit scheduler.
+
+        Use this when changes must be visible to searches before
+        continuing.  Returns ``None`` if no commit was pending or the
+        connection doesn't coalesce commits.
+
+        """
+        if self.commits is not None:
+            return self.commits.flush(wait_flush, wait_searcher)
+
     def optimize(self, wait_flush=True, wait_searcher=True):
         """
         Issue an optimize command to the Solr server.
@@ -512,7 +680,7 @@ class Solr:
         """
         return self._commit("optimize", wait_flush, wait_searcher)
 
-    def _commit(self, verb, wait_flush, wait_searcher):
+    def _commit(self, verb, wait_flush, wait_searcher, soft=False):
         if not wait_searcher:  #just handle deviations from the default
             if not wait_flush:
                 options = 'waitFlush="false" waitSearcher="false"'
@@ -520,6 +688,8 @@ class Solr:
                 options = 'waitSearcher="false"'
         else:
             options = ''
+        if soft:
+            options += ' softCommit="true"'
         xstr = u'<%s %s/>' % (verb, options)
         return self._update(xstr)
 
@@ -527,8 +697,13 @@ class Solr:
 
     def _update(self, request, query=None):
         selector = '%s/update%s' % (self.path, qs_from_items(query))
-        rsp, data = self._post(selector, request, self.xmlheaders)
+        if isinstance(request, basestring):
+            rsp, data = self._post(selector, request, self.xmlheaders)
+        else:
+            rsp, data = self._post_chunked(selector, request, self.xmlheaders)
+        return self._check_update(rsp, data)
 
+    def _check_update(self, rsp, data):
         # Detect old-style error response (HTTP response code
         # of 200 with a non-zero status).
         starts = data.startswith
@@ -541,19 +716,116 @@ class Solr:
                 raise SolrException(rsp.status, reason)
         return data
 
+    def post_file(self, path, content_type, split_every=None,
+                  **commit_args):
+        """
+        Send an update file to the Solr server without reading it into
+        memory.
+
+        The file at `path` is memory-mapped and its contents written to
+        the connection directly.  `content_type` is the MIME type of the
+        file, such as ``'text/xml'``, ``'application/json'`` or
+        ``'text/csv'``; CSV files are posted to ``/update/csv``, others
+        to ``/update``.
+
+        If `split_every` is given, the file is sent in several requests of
+        at most that many documents each.  XML files must hold a single
+        ``<add>`` element, and are split after ``</doc>`` tags (so nested
+        documents aren't supported); each request repeats the text before
+        the first and after the last document.  CSV files are split at
+        line ends (so quoted values must not contain line breaks), and
+        each request repeats the header line.  JSON files can't be split.
+
+        Supports commit-control arguments; the commit is collapsed into
+        the last request.
+        """
+        query, scheduler = _commit_query(self, commit_args, strict=True)
+        if 'csv' in content_type:
+            splitter = _csv_regions
+            relpath = '/update/csv'
+        elif 'xml' in content_type:
+            splitter = _xml_regions
+            relpath = '/update'
+        elif split_every:
+            raise ValueError("only XML and CSV files can be split")
+        else:
+            relpath = '/update'
+        headers = self.xmlheaders.copy()
+        headers['Content-Type'] = content_type
+
+        f = open(path, 'rb')
+        try:
+            if not os.fstat(f.fileno()).st_size:
+                # Nothing to add, but a requested commit is still issued.
+                if not query and scheduler is None:
+                    return None
+                data = self._update(u'<add></add>', query)
+                if scheduler is not None:
+                    scheduler.schedule()
+                return data
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            if split_every:
+                regions = splitter(mm, int(split_every))
+            else:
+                regions = iter([('', 0, len(mm), '')])
+            data = None
+            region = next(regions, None)
+            while region is not None:
+                next_region = next(regions, None)
+                prefix, start, end, suffix = region
+                selector = '%s%s%s' % (self.path, relpath, qs_from_items(
+                    next_region is None and query or None))
+                rsp, data = self._post_buffers(
+                    selector, [prefix, buffer(mm, start, end - start), suffix],
+                    headers)
+                data = self._check_update(rsp, data)
+                region = next_region
+        finally:
+            mm.close()
+        if scheduler is not None:
+            scheduler.schedule()
+        return data
+
+    def _post_buffers(self, url, parts, headers):
+        # Like _post, but the body is the concatenation of `parts`, which
+        # may be strings or buffers; they are written to the connection
+        # without being copied.
+        if self.debug:
+            logging.info("solrpy request: %d bytes for %s"
+                         % (sum(map(len, parts)), url))
+
+        def write(conn):
+            for part in parts:
+                if len(part):
+                    conn.send(part)
+
+        headers = headers.copy()
+        headers['Content-Length'] = str(sum(map(len, parts)))
+        return self._post(url, write, headers)
+
     def _delete(self, id=None, ids=None, queries=None):
         """
         Delete a specific document by id.
         """
-        if not ids:
-            ids = []
-        if id:
-            ids.insert(0, id)
+        keys = []
+        if id is not None:
+            keys.append(id)
+        keys.extend(ids or ())
         lst = []
-        for id in ids:
-            lst.append(u'<id>%s</id>\n' % escape(unicode(id)))
+        for key in keys:
+            lst.append(u'<id>%s</id>\n' % escape(unicode(key)))
         for query in (queries or ()):
             lst.append(u'<query>%s</query>\n' % escape(unicode(query)))
+        if self.fingerprints is not None:
+            # The documents matching a query aren't known, so forget
+            # everything rather than skip re-adding a deleted document.
+            if queries:
+                self.fingerprints.clear()
+            elif keys:
+                self.fingerprints.forget(keys)
         if lst:
             lst.insert(0, u'<delete>\n')
             lst.append(u'</delete>')
@@ -568,7 +840,7 @@ class Solr:
 
     def _reconnect(self):
         self.reconnects += 1
-        self.close()
+        self.conn.close()
         self.conn.connect()
         if self.timeout and _python_version < 2.6:
             if self.scheme == 'http':
@@ -576,35 +848,135 @@ class Solr:
             elif self.scheme == 'https':
                 self.conn.sock.sock.settimeout(self.timeout)
 
-    def _post(self, url, body, headers):
+    def _check_connection(self):
+        # A persistent connection left idle may have been closed by the
+        # server.  Nothing should arrive on an idle connection, so if its
+        # socket is readable, it is at end of file or out of step with
+        # the server: open a new one.
+        sock = self.conn.sock
+        if sock is None:
+            return
+        try:
+            readable = select.select([sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            readable = True
+        if readable:
+            self._reconnect()
+
+    def _post(self, url, body, headers, retry=True):
+        """
+        Post `body` to `url` and return the response and its body.
+
+        `body` is either a string, sent as it is, or a callable which
+        writes the request body to the HTTP connection it is given, after
+        the headers have been sent; `headers` must then give its length
+        or transfer encoding.  Connection errors are retried up to `max_retries`
+        times, calling `body` again, unless `retry` is false.
+        """
+        if isinstance(body, basestring):
+            if self.debug:
+                logging.info("solrpy request: %s" % body)
+            body = body.encode('UTF-8').replace('%2B', '+')
+
+        self._lock.acquire()
+        try:
+            rsp = self._request(url, body, headers, retry)
+            data = rsp.read()
+            if self.debug:
+                logging.info("solrpy got response: %s" % data)
+            return rsp, data
+        finally:
+            if not self.persistent:
+                self.conn.close()
+            self._lock.release()
+
+    def _request(self, url, body, headers, retry=True):
+        # Send a POST request whose body is the string `body`, or is
+        # written by calling `body`, and return the response, before its
+        # body has been read.  The caller holds the lock.
+        _headers = self.auth_headers.copy()
+        _headers.update(headers)
+        attempts = retry and self.max_retries + 1 or 1
+        if not retry:
+            # A request which can't be sent again must not be started on
+            # a stale connection.
+            self._check_connection()
+        while True:
+            try:
+                if isinstance(body, str):
+                    self.conn.request('POST', url, body, _headers)
+                else:
+                    self.conn.putrequest('POST', url)
+                    for name, value in _headers.items():
+                        self.conn.putheader(name, value)
+                    self.conn.endheaders()
+                    body(self.conn)
+                return check_response_status(self.conn.getresponse())
+            except (socket.error,
+                    httplib.ImproperConnectionState,
+                    httplib.BadStatusLine):
+                    # We include BadStatusLine as they are spurious
+                    # and may randomly happen on an otherwise fine
+                    # Solr connection (though not often)
+                self._reconnect()
+                attempts -= 1
+                if attempts <= 0:
+                    raise
+            except SolrException:
+                raise
+            except:
+                # The request may have been abandoned part way through,
+                # leaving the connection unusable.
+                self.conn.close()
+                raise
+
+    def _post_chunked(self, url, chunks, headers):
+        """
+        Post the strings produced by the iterable `chunks` as the request
+        body, sending each as it is produced using chunked transfer
+        encoding.  Since `chunks` can only be consumed once, the request
+        is not retried; instead, an idle connection the server has closed
+        is reopened before the request is started.
+        """
+        if self.debug:
+            logging.info("solrpy request: chunked body for %s" % url)
+
+        def write(conn):
+            for chunk in chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('UTF-8')
+                if chunk:
+                    conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+            conn.send('0\r\n\r\n')
+
+        headers = headers.copy()
+        headers['Transfer-Encoding'] = 'chunked'
+        return self._post(url, write, headers, retry=False)
+
+    def _post_stream(self, url, body, headers, block_size=64 * 1024):
+        """
+        Post `body` and yield the response body in blocks as it is read
+        from the socket.
+
+        The request is sent over a connection of its own, which is
+        closed once the response has been read completely or the
+        generator is closed, so this connection remains usable (from
+        this thread or others) while the response is being read.
+        """
         if self.debug:
             logging.info("solrpy request: %s" % body)
 
+        data = body.encode('UTF-8')
+        stream = self._copy()
         try:
-            _headers = self.auth_headers.copy()
-            _headers.update(headers)
-            attempts = self.max_retries + 1
-            while attempts > 0:
-                try:
-                    self.conn.request('POST', url, body.encode('UTF-8').replace('%2B', '+'), _headers)
-                    rsp = check_response_status(self.conn.getresponse())
-                    data = rsp.read()
-                    if self.debug:
-                        logging.info("solrpy got response: %s" % data)
-                    return rsp, data
-                except (socket.error,
-                        httplib.ImproperConnectionState,
-                        httplib.BadStatusLine):
-                        # We include BadStatusLine as they are spurious
-                        # and may randomly happen on an otherwise fine
-                        # Solr connection (though not often)
-                    self._reconnect()
-                    attempts -= 1
-                    if attempts <= 0:
-                        raise
+            rsp = stream._request(url, data, headers)
+            while True:
+                block = rsp.read(block_size)
+                if not block:
+                    break
+                yield block
         finally:
-            if not self.persistent:
-                self.close()
+            stream.conn.close()
 
 
 class SolrConnection(Solr):
@@ -664,6 +1036,297 @@ class SolrConnection(Solr):
         return self.select.raw(**params)
 
 
+class CommitScheduler(object):
+    """
+    Coalesce the commits requested by update methods which support
+    commit-control arguments.
+
+    Instead of sending a hard commit with every such request, at most one
+    commit is issued per `interval` seconds, however many requests (from
+    any number of threads) asked for one.  `mode` selects how the
+    deferred commit is performed:
+
+    ``"within"``
+        Each update request carries ``commitWithin`` set to `interval`,
+        and Solr performs the commit itself.
+
+    ``"soft"``
+        A soft commit is issued by a timer `interval` seconds after the
+        first request which wasn't covered by an earlier commit.
+
+    ``"hard"``
+        As for ``"soft"``, but a hard commit is issued.
+
+    Optimize requests are never deferred.
+
+    The `requested` attribute counts commits asked for, and `issued`
+    counts commits sent by the client; `coalesced` is the difference.
+    (With ``"within"``, only flushes are sent by the client, and Solr may
+    merge the remaining commits further.)
+
+    If a deferred commit fails, it is retried after another `interval`.
+    `timer` is called as ``timer(interval, function)`` to start a timer
+    calling `function` once, and returns an object with a ``cancel``
+    method; by default, a daemon `threading.Timer` is used.
+    """
+
+    MODES = ("within", "soft", "hard")
+
+    def __init__(self, conn, interval=1.0, mode="within", timer=None):
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of %s" % ", ".join(self.MODES))
+        self.conn = conn
+        self.interval = float(interval)
+        if self.interval <= 0:
+            raise ValueError("interval must be positive")
+        self.mode = mode
+        self.requested = 0
+        self.issued = 0
+        self._pending = False
+        self._timer = None
+        self._start_timer = timer or _daemon_timer
+        self._lock = threading.Lock()
+
+    @property
+    def coalesced(self):
+        return self.requested - self.issued
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def request_params(self):
+        """
+        Return the query parameters to add to an update request which
+        asked for a commit.
+        """
+        if self.mode == "within":
+            return {"commitWithin": str(int(self.interval * 1000))}
+        return {}
+
+    def schedule(self):
+        """
+        Record a commit request for an update which has been sent.
+        """
+        self._lock.acquire()
+        try:
+            self.requested += 1
+            self._pending = True
+            self._arm()
+        finally:
+            self._lock.release()
+
+    def _arm(self):
+        # Start the timer for the pending commit; called with the lock
+        # held.
+        if self.mode != "within" and self._timer is None:
+            self._timer = self._start_timer(self.interval, self._run)
+
+    def cancel(self):
+        """
+        Forget any pending commit, since one is being issued elsewhere.
+        """
+        self._take()
+
+    def flush(self, wait_flush=True, wait_searcher=True):
+        """
+        Issue the pending commit now, if there is one.
+        """
+        if not self._take():
+            return None
+        try:
+            return self.conn._commit("commit", wait_flush, wait_searcher,
+                                     soft=(self.mode == "soft"))
+        except:
+            self._lock.acquire()
+            try:
+                self._pending = True
+                self.issued -= 1
+                self._arm()
+            finally:
+                self._lock.release()
+            raise
+
+    def _take(self):
+        # Claim the pending commit, if any; requests recorded after this
+        # point arm a new one.
+        self._lock.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending = self._pending
+            if pending:
+                self._pending = False
+                self.issued += 1
+            return pending
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        try:
+            self.flush()
+        except Exception:
+            logging.exception("solrpy: deferred commit failed")
+
+
+def _daemon_timer(interval, function):
+    timer = threading.Timer(interval, function)
+    timer.setDaemon(True)
+    timer.start()
+    return timer
+
+
+BatchDecision = namedtuple(
+    'BatchDecision',
+    'time docs size latency error action next_docs next_size')
+
+
+class AdaptiveBatchSize(object):
+    """
+    Additive-increase/multiplicative-decrease controller for the size of
+    batches sent by `Updater.add_batches`.
+
+    A batch holds at most `docs` documents and `size` bytes of
+    serialized XML, encoded as UTF-8.  After each request, both limits
+    grow by `docs_step` and `size_step` if the request succeeded within
+    `target_latency` seconds; if it took longer or failed, both are
+    multiplied by `decrease`.  The limits are kept within
+    `min_docs`..`max_docs` and `min_size`..`max_size`.
+
+    The last `history` decisions are kept in `decisions` as
+    `BatchDecision` tuples, and logged at debug level.
+    """
+
+    def __init__(self, docs=100, min_docs=1, max_docs=10000,
+                 size=1024 * 1024, min_size=64 * 1024,
+                 max_size=32 * 1024 * 1024, target_latency=1.0,
+                 docs_step=10, size_step=64 * 1024, decrease=0.5,
+                 history=1000):
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.min_docs = int(min_docs)
+        self.max_docs = int(max_docs)
+        self.min_size = int(min_size)
+        self.max_size = int(max_size)
+        if not 1 <= self.min_docs <= self.max_docs:
+            raise ValueError("invalid bounds for the number of documents")
+        if not 1 <= self.min_size <= self.max_size:
+            raise ValueError("invalid bounds for the batch size")
+        self.docs = min(max(int(docs), self.min_docs), self.max_docs)
+        self.size = min(max(int(size), self.min_size), self.max_size)
+        self.target_latency = float(target_latency)
+        self.docs_step = int(docs_step)
+        self.size_step = int(size_step)
+        self.decrease = float(decrease)
+        self.requests = 0
+        self.errors = 0
+        self.decisions = deque(maxlen=history)
+
+    @property
+    def error_rate(self):
+        if not self.requests:
+            return 0.0
+        return float(self.errors) / self.requests
+
+    def observe(self, docs, size, latency, error=False):
+        """
+        Record the outcome of a request sending `docs` documents in
+        `size` bytes, which took `latency` seconds, and adjust the
+        limits for the next batch.
+        """
+        self.requests += 1
+        if error:
+            self.errors += 1
+        if error or latency > self.target_latency:
+            action = "decrease"
+            self.docs = max(self.min_docs, int(self.docs * self.decrease))
+            self.size = max(self.min_size, int(self.size * self.decrease))
+        else:
+            action = "increase"
+            self.docs = min(self.max_docs, self.docs + self.docs_step)
+            self.size = min(self.max_size, self.size + self.size_step)
+        decision = BatchDecision(time.time(), docs, size, latency, error,
+                                 action, self.docs, self.size)
+        self.decisions.append(decision)
+        logging.debug("solrpy batch size: %r", decision)
+        return decision
+
+
+class ConnectionPool(object):
+    """
+    Pool of connections to the same Solr server as `conn`, used to send
+    requests concurrently.  Each pooled connection is a copy of `conn`
+    with its own HTTP connection; at most `size` are created, as they
+    are needed.  Pooled connections have pools of their own, so calls
+    to `map` can be nested.
+
+    Every `Solr` connection has a pool as its `pool` attribute.  For
+    example, to run several queries concurrently:
+    >>> def fetch(conn, q):
+    ...     return conn.select(q).results
+    >>> results = conn.pool.map(fetch, queries)
+    """
+
+    def __init__(self, conn, size=4):
+        self.conn = conn
+        self.size = int(size)
+        assert self.size >= 1
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Return a pooled connection, waiting for one if necessary."""
+        self._cond.acquire()
+        try:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        finally:
+            self._cond.release()
+        return self.conn._copy()
+
+    def release(self, conn):
+        """Return a connection obtained from `acquire` to the pool."""
+        self._cond.acquire()
+        try:
+            self._idle.append(conn)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def close(self):
+        """Close the idle pooled connections."""
+        self._cond.acquire()
+        try:
+            for conn in self._idle:
+                conn.close()
+        finally:
+            self._cond.release()
+
+    def map(self, function, items, workers=None):
+        """
+        Call ``function(conn, item)`` for each item of the iterable
+        `items`, from up to `workers` threads (by default, `size`) each
+        using a pooled connection, and return the results in order.
+
+        `items` is consumed as the calls are made.  If a call raises an
+        exception, no further calls are started, and the exception is
+        re-raised once those in progress have finished.
+        """
+        def call(item):
+            conn = self.acquire()
+            try:
+                return function(conn, item)
+            finally:
+                self.release(conn)
+
+        return _parallel_map(call, items, min(workers or self.size, self.size))
+
+
 class UpdateOps(object):
     SET = 'set'
     INC = INCREMENT = 'inc'
@@ -690,7 +1353,11 @@ class Updater(object):
         for name, op in field_ops.items():
             self.field_formatters.set_updater(name, op)
 
-    def add(self, doc):
+    @property
+    def commits(self):
+        return self.conn.commits
+
+    def add(self, doc, **commit_args):
         """
         Add a document to the Solr server.  Document fields
         should be specified as arguments to this function
@@ -702,24 +1369,355 @@ class Updater(object):
 
         Supports commit-control arguments.
         """
-        return self.add_many((doc,))
+        return self.add_many((doc,), **commit_args)
 
-    @committing
-    def add_many(self, docs):
+    def add_many(self, docs, bisect=False, **commit_args):
         """
         Add several documents to the Solr server.
 
         `docs`
             An iterable of document dictionaries.
 
+        `bisect`
+            If true and Solr rejects the request as a bad request (HTTP
+            400), the documents are split in halves which are re-sent
+            separately, recursing into the halves which fail again, at
+            most `bisect` levels deep (16 if `bisect` is ``True``).
+            Documents which are accepted are added in the largest
+            sub-batches that succeed, so only a logarithmic number of
+            requests is made for each bad document.  If any documents
+            were rejected, `SolrBatchException` is raised after the
+            others have been added (and committed, if requested); its
+            `failures` attribute lists each rejected document with the
+            exception for the smallest sub-batch containing it.  Other
+            errors are raised immediately.
+
+        If the connection has a fingerprint store, documents which
+        haven't changed since they were last sent are skipped.
+
+        Supports commit-control arguments.
+        """
+        query, scheduler = _commit_query(self, commit_args, strict=True)
+        items = list(self._items(docs))
+        if (not items and self._fingerprints() is not None
+                and not query and scheduler is None):
+            return None
+        failures = []
+        data = self._send(items, query, _bisect_depth(bisect), failures)
+        if scheduler is not None:
+            scheduler.schedule()
+        if failures:
+            raise SolrBatchException(failures)
+        return data
+
+    @committing
+    def add_stream(self, docs, chunk_size=64 * 1024):
+        """
+        Add documents from an iterable in a single streamed request.
+
+        Documents are serialized as the request is sent, using chunked
+        transfer encoding with chunks of about `chunk_size` characters,
+        so memory use doesn't grow with the number of documents and
+        serialization overlaps with network transmission.  A connection
+        closed by the server while idle is reopened before the request is
+        sent, but the request can't be re-tried if the connection fails
+        while it is being sent.
+
         Supports commit-control arguments.
         """
+        return self.__chunks(docs, int(chunk_size))
+
+    def __chunks(self, docs, chunk_size):
+        buf = [u'<add>']
+        size = 0
+        for doc in docs:
+            lst = []
+            self.__add(lst, doc)
+            part = u''.join(lst)
+            buf.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield u''.join(buf)
+                buf = []
+                size = 0
+        buf.append(u'</add>')
+        yield u''.join(buf)
+
+    def _add_xml(self, docs):
         lst = [u'<add>']
         for doc in docs:
             self.__add(lst, doc)
         lst.append(u'</add>')
         return ''.join(lst)
 
+    def _doc_xml(self, lst, doc):
+        # Append the serialization of a single document to `lst`.
+        self.__add(lst, doc)
+
+    def add_many_bisect(self, docs, max_depth=16, **commit_args):
+        """
+        Add several documents, isolating any documents Solr rejects.
+
+        Same as ``add_many(docs, bisect=max_depth)``; kept for callers
+        which predate the `bisect` argument of `add_many`.
+
+        Supports commit-control arguments.
+        """
+        return self.add_many(docs, bisect=max_depth, **commit_args)
+
+    def _fingerprints(self):
+        # The fingerprint store to check documents against, if any.
+        # Partial updates are always sent.
+        store = self.conn.fingerprints
+        if store is None or self.field_formatters:
+            return None
+        return store
+
+    def _items(self, docs, group_size=1000):
+        # Yield a (document, serialization, fingerprint mark) triple for
+        # each of `docs` which is to be sent, checking the fingerprint
+        # store, if any, `group_size` documents at a time.
+        store = self._fingerprints()
+        docs = iter(docs)
+        while True:
+            group = list(itertools.islice(docs, group_size))
+            if not group:
+                return
+            if store is None:
+                marks = [None] * len(group)
+            else:
+                group, marks = store.changes(group, self._doc_xml)
+            for doc, mark in zip(group, marks):
+                lst = []
+                self.__add(lst, doc)
+                yield doc, u''.join(lst), mark
+
+    def _send(self, items, query, depth=0, failures=None):
+        # Send the documents of `items` (as yielded by `_items`) in one
+        # request with the update parameters `query`.  If `depth` is
+        # positive, a bad request is bisected, the rejected documents
+        # being added to `failures`, and the commit it asked for is
+        # issued separately once the good documents have been added.
+        try:
+            return self.__post(items, query)
+        except SolrException, e:
+            if e.httpcode != 400 or depth < 1:
+                raise
+            update_query = dict([(k, v) for k, v in query.items()
+                                 if k == "commitWithin"])
+            self.__bisect(items, 0, len(items), update_query, depth, e,
+                          failures)
+            if "optimize" in query or "commit" in query:
+                self.conn._commit(
+                    "optimize" in query and "optimize" or "commit",
+                    query.get("waitFlush") != "false",
+                    query.get("waitSearcher") != "false")
+            return None
+
+    def __post(self, items, query):
+        data = self._update(
+            u''.join([u'<add>'] + [part for doc, part, mark in items]
+                     + [u'</add>']), query)
+        marks = [mark for doc, part, mark in items if mark is not None]
+        if marks:
+            self.conn.fingerprints.record(marks)
+        return data
+
+    def __bisect(self, items, start, end, query, depth, error, failures):
+        if end - start < 2 or depth < 1:
+            failures.extend([(doc, error) for doc, part, mark
+                             in items[start:end]])
+            return
+        middle = (start + end) // 2
+        for lo, hi in ((start, middle), (middle, end)):
+            try:
+                self.__post(items[lo:hi], query)
+            except SolrException, e:
+                if e.httpcode != 400:
+                    raise
+                self.__bisect(items, lo, hi, query, depth - 1, e, failures)
+
+    def add_columns(self, columns, batch_size=None, **commit_args):
+        """
+        Add documents given as columns of field values.
+
+        `columns`
+            A mapping from field name to a sequence of values (a list,
+            tuple or ``array.array``).  All sequences must have the same
+            length; the values at index *i* of each column make up the
+            *i*-th document.
+
+        `batch_size`
+            Maximum number of documents to send in each request to Solr.
+            By default, all documents are sent in a single request.
+
+        Values are converted as by `add_many`.  The conversion for each
+        column is chosen once, from the type of its first value which is
+        not ``None`` (or, for multi-valued columns, of the first value in
+        it); values of other types are converted one by one as usual, so
+        columns holding values of a single type are serialized fastest.
+
+        Example::
+
+            connection.add_columns({"id": ["a", "b"], "price": [1, 2]})
+
+        Supports commit-control arguments; the commit is collapsed into
+        the request sending the last batch.
+        """
+        query, scheduler = _commit_query(self, commit_args, strict=True)
+        names = list(columns.keys())
+        length = None
+        for name in names:
+            if length is None:
+                length = len(columns[name])
+            elif len(columns[name]) != length:
+                raise ValueError(
+                    "column %r has %d values, expected %d"
+                    % (name, len(columns[name]), length))
+        length = length or 0
+        if batch_size is None:
+            batch_size = max(length, 1)
+        batch_size = int(batch_size)
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
+        fields = [(columns[name],
+                   _column_serializer(self.field_formatters[name],
+                                      columns[name]))
+                  for name in names]
+        store = self._fingerprints()
+        result = None
+        # Without documents, one empty request still carries the commit.
+        for start in xrange(0, max(length, 1), batch_size):
+            end = min(start + batch_size, length)
+            last = end == length
+            if store is None:
+                items = [(None, self.__row(fields, i), None)
+                         for i in xrange(start, end)]
+            else:
+                # The fingerprints are those of the equivalent documents.
+                items = list(self._items(
+                    [dict([(name, columns[name][i]) for name in names
+                           if columns[name][i] is not None])
+                     for i in xrange(start, end)]))
+            if items or (last and (query or scheduler is not None)):
+                result = self._send(items, last and query or {})
+        if scheduler is not None:
+            scheduler.schedule()
+        return result
+
+    def __row(self, fields, i):
+        lst = [u'<doc>']
+        for column, serialize in fields:
+            value = column[i]
+            if value is not None:
+                lst.append(serialize(value))
+        lst.append(u'</doc>')
+        return u''.join(lst)
+
+    def add_batches(self, docs, batch_size=None, bisect=False,
+                    **commit_args):
+        """
+        Add documents from an iterable in a series of requests.
+
+        `batch_size` is either a fixed maximum number of documents per
+        request, or an `AdaptiveBatchSize` controller which adjusts the
+        size of each batch based on the latency and failures of earlier
+        requests; by default, a new controller with default settings is
+        used.  Pass the same controller to later calls to keep what it
+        learned.
+
+        A batch which fails with a server error (HTTP 5xx) is re-sent in
+        batches of the reduced size, up to the connection's
+        `max_retries` times in a row.  Connection errors have already
+        been retried by the connection when they reach this method, so
+        they are raised.
+
+        Rejected batches are bisected if `bisect` is true, and
+        documents are checked against the fingerprint store, as for
+        `add_many`.
+
+        Supports commit-control arguments; the commit is collapsed into
+        the request sending the last batch.
+        """
+        query, scheduler = _commit_query(self, commit_args, strict=True)
+        if batch_size is None:
+            controller = AdaptiveBatchSize()
+        elif isinstance(batch_size, (int, long)):
+            controller = AdaptiveBatchSize(
+                batch_size, min_docs=batch_size, max_docs=batch_size,
+                min_size=sys.maxint, max_size=sys.maxint)
+        else:
+            controller = batch_size
+        depth = _bisect_depth(bisect)
+        failures = []
+
+        items = []
+        sizes = []
+        size = 0
+        for item in self._items(docs):
+            item_size = len(item[1].encode('utf-8'))
+            # A full batch is only sent once another document arrives, so
+            # the last batch is known and can carry the commit.
+            if items and (len(items) >= controller.docs
+                          or size + item_size > controller.size):
+                self.__send_batches(items, sizes, {}, controller, depth,
+                                    failures)
+                items = []
+                sizes = []
+                size = 0
+            items.append(item)
+            sizes.append(item_size)
+            size += item_size
+        if not items and not query and scheduler is None:
+            data = None
+        else:
+            data = self.__send_batches(items, sizes, query, controller,
+                                       depth, failures)
+            if scheduler is not None:
+                scheduler.schedule()
+        if failures:
+            raise SolrBatchException(failures)
+        return data
+
+    def __send_batches(self, items, sizes, query, controller, depth,
+                       failures):
+        # Send `items`, whose serializations take `sizes` bytes,
+        # re-splitting what is left according to the controller after
+        # each request.
+        errors = 0
+        while True:
+            count = 0
+            size = 0
+            for item_size in sizes:
+                if count and (count >= controller.docs
+                              or size + item_size > controller.size):
+                    break
+                count += 1
+                size += item_size
+            last = count == len(items)
+            started = time.time()
+            try:
+                data = self._send(items[:count], last and query or {},
+                                  depth, failures)
+            except (socket.error, httplib.HTTPException):
+                controller.observe(count, size, time.time() - started, True)
+                raise
+            except SolrException, e:
+                if e.httpcode < 500:
+                    raise
+                controller.observe(count, size, time.time() - started, True)
+                errors += 1
+                if errors > self.conn.max_retries:
+                    raise
+                continue
+            controller.observe(count, size, time.time() - started)
+            errors = 0
+            items = items[count:]
+            sizes = sizes[count:]
+            if not items:
+                return data
+
     @committing
     def __add(self, lst, fields):
         lst.append(u'<doc>')
@@ -735,32 +1733,108 @@ class Updater(object):
                 # ignore values that are not defined
                 if value == None:
                     continue
-                # Do some basic data conversion
-                if isinstance(value, datetime.datetime):
-                    value = utc_to_string(value)
-                elif isinstance(value, datetime.date):
-                    value = datetime.datetime.combine(
-                        value, datetime.time(tzinfo=UTC()))
-                    value = utc_to_string(value)
-                elif isinstance(value, bool):
-                    value = value and 'true' or 'false'
-
-                lst.append(self.field_formatters[field](escape(unicode(value))))
+                lst.append(self.field_formatters[field](_convert_value(value)))
         lst.append('</doc>')
 
 
 
+def _bisect_depth(bisect):
+    # The bisection depth called for by the `bisect` argument of
+    # `Updater.add_many`.
+    if bisect is True:
+        return 16
+    return int(bisect or 0)
+
+
+def _convert_value(value):
+    """
+    Convert a field value to escaped text for an update request.
+    """
+    # Do some basic data conversion
+    if isinstance(value, datetime.datetime):
+        value = utc_to_string(value)
+    elif isinstance(value, datetime.date):
+        value = datetime.datetime.combine(
+            value, datetime.time(tzinfo=UTC()))
+        value = utc_to_string(value)
+    elif isinstance(value, bool):
+        value = value and 'true' or 'false'
+    return escape(unicode(value))
+
+
+def _value_converter(sample):
+    """
+    Return a function converting values to escaped text as
+    `_convert_value` does, specialized for values of the same type as
+    `sample`; values of any other type are converted as usual.
+    """
+    kind = type(sample)
+    if kind in (int, long, float):
+        # Numbers never need escaping.
+        def convert(value):
+            if type(value) is kind:
+                return unicode(value)
+            return _convert_value(value)
+    elif kind is bool:
+        def convert(value):
+            if type(value) is bool:
+                return value and u'true' or u'false'
+            return _convert_value(value)
+    elif kind is unicode:
+        def convert(value):
+            if type(value) is unicode:
+                return escape(value)
+            return _convert_value(value)
+    elif kind is datetime.datetime:
+        def convert(value):
+            if type(value) is datetime.datetime:
+                return unicode(utc_to_string(value))
+            return _convert_value(value)
+    else:
+        convert = _convert_value
+    return convert
+
+
+def _column_serializer(formatter, column):
+    """
+    Return a function serializing one cell of `column` as ``<field>``
+    elements using `formatter`: one for a single value, or one for each
+    value of a list, tuple or set, as `Updater.add_many` does.
+    """
+    sample = None
+    for sample in column:
+        if sample is not None:
+            break
+    if isinstance(sample, (list, tuple, set)):
+        inner = None
+        for inner in sample:
+            if inner is not None:
+                break
+        sample = inner
+    convert = _value_converter(sample)
+
+    def serialize(value):
+        if not isinstance(value, (list, tuple, set)):
+            return formatter(convert(value))
+        return u''.join([formatter(convert(item))
+                         for item in value if item is not None])
+    return serialize
+
+
 class SearchHandler(object):
 
-    def __init__(self, conn, relpath="/select", arg_separator="_", parse_response=None):
+    def __init__(self, conn, relpath="/select", arg_separator="_", parse_response=None,
+                 unique_key='id'):
         self.conn = conn
         self.selector = conn.path + relpath
         self.arg_separator = arg_separator
         # NB: parse_response.wt should be set as appropriate, and parse_response(file_like, params, query) returns a Response object
         self.parse_response = parse_response or parse_xml_response
+        self.unique_key = unique_key
 
     def __call__(self, q=None, fields=None, highlight=None,
-                 score=True, sort=None, sort_order="asc", **params):
+                 score=True, sort=None, sort_order="asc",
+                 lazy_highlight=False, **params):
         """
         q is the query string.
 
@@ -787,6 +1861,12 @@ class SearchHandler(object):
         sort_order is the backward compatible way to add the same ordering
         to all the sort field when it is not specified.
 
+        lazy_highlight, if true, leaves highlighting out of the query;
+        the highlighting of the documents returned is fetched with one
+        more query when the "highlighting" attribute of the response is
+        first read.  The handler's unique_key field is added to "fields".
+        Highlighting parameters (hl_*) are only sent with that query.
+
         Optional parameters can also be passed in.  Many SOLR
         parameters are in a dotted notation (e.g., hl.simple.post).
         For such parameters, replace the dots with underscores when
@@ -797,6 +1877,97 @@ class SearchHandler(object):
         # Optional parameters with '_' instead of '.' will be converted
         # later by raw_query().
 
+        if q is not None:
+            params['q'] = q
+        if lazy_highlight and highlight:
+            return self._lazy_highlight(fields, highlight, score, sort,
+                                        sort_order, params)
+        self._query_params(fields, highlight, score, sort, sort_order, params)
+        data = self.raw(**params)
+        return self.parse_response(StringIO(data),  params, self)
+
+    def _lazy_highlight(self, fields, highlight, score, sort, sort_order,
+                        params):
+        if highlight is True:
+            if not fields:
+                raise ValueError("highlight is True and no fields were given")
+            highlight = fields
+        hl_params = {}
+        for key in params.keys():
+            name = key.replace(self.arg_separator, '.')
+            if name == 'hl' or name.startswith('hl.'):
+                hl_params[key] = params.pop(key)
+        if fields:
+            if isinstance(fields, basestring):
+                fields = fields.replace(',', ' ').split()
+            if self.unique_key not in fields and '*' not in fields:
+                fields = list(fields) + [self.unique_key]
+
+        self._query_params(fields, None, score, sort, sort_order, params)
+        query = dict(params)
+        data = self.raw(**params)
+        response = self.parse_response(StringIO(data), params, self)
+        if response is None:
+            return None
+
+        def fetch(response):
+            return self._fetch_highlighting(response, query, highlight,
+                                            hl_params)
+        response._highlight = fetch
+        # Following pages are highlighted lazily as well.
+        params = dict(params)
+        params.update(hl_params)
+        params.update({'fields': fields, 'highlight': highlight,
+                       'score': score, 'lazy_highlight': True})
+        response._set_params(params, self)
+        return response
+
+    def _fetch_highlighting(self, response, params, highlight, hl_params):
+        ids = [doc[self.unique_key] for doc in response.results
+               if doc.get(self.unique_key) is not None]
+        if not ids:
+            return MultiDict()
+        query = {}
+        for key, value in params.items():
+            name = key.replace(self.arg_separator, '.')
+            if name.split('.')[0] not in _NOT_HIGHLIGHTED:
+                query[key] = value
+        query.update(hl_params)
+        fq = query.pop('fq', [])
+        if isinstance(fq, basestring):
+            fq = [fq]
+        query['fq'] = list(fq) + [_terms_query(self.unique_key, ids)]
+        query['start'] = 0
+        query['rows'] = len(ids)
+        q = query.pop('q', None)
+        highlighted = self(q, fields=self.unique_key, highlight=highlight,
+                           score=False, **query)
+        return getattr(highlighted, 'highlighting', None) or MultiDict()
+
+    def prepare(self, fields=None, highlight=None, score=True, sort=None,
+                sort_order="asc", **params):
+        """
+        Return a `PreparedQuery` for making queries which differ only in
+        a few parameters, such as ``q`` and ``start``.
+
+        The arguments are as for calling the handler, and are encoded
+        once, when the query is prepared; the arguments given to each
+        call of the prepared query are encoded separately and added to
+        them.
+
+        For example:
+        >>> search = conn.select.prepare(fields='id,title', sort='date desc',
+        ...                              fq=['type:book'], rows=20)
+        >>> response = search('title:lucene')
+        >>> response = search('title:solr', start=20)
+        """
+        return PreparedQuery(self, fields, highlight, score, sort, sort_order,
+                             params)
+
+    def _query_params(self, fields, highlight, score, sort, sort_order,
+                      params):
+        # Add the parameters derived from the arguments of __call__ to
+        # `params`, which is returned.
         if highlight:
             params['hl'] = 'true'
             if not isinstance(highlight, (bool, int, float)):
@@ -811,9 +1982,6 @@ class SearchHandler(object):
                 else:
                     params['hl_fl'] = ",".join(fields)
 
-        if q is not None:
-            params['q'] = q
-
         if fields:
             if not isinstance(fields, basestring):
                 fields = ",".join(fields)
@@ -840,9 +2008,72 @@ class SearchHandler(object):
         params['fl'] = fields
         params['version'] = self.conn.response_version
         params['wt'] = self.parse_response.wt
+        return params
 
-        data = self.raw(**params)
-        return self.parse_response(StringIO(data),  params, self)
+    def cursor(self, q=None, sort=None, cursor_mark="*", **params):
+        """
+        Iterate through all the matches of a query using Solr's cursor
+        support, yielding a Response for each page of `rows` matches.
+
+        `sort` must include the schema's unique key field, as Solr
+        requires for cursors.  The ``nextCursorMark`` attribute of each
+        response may be passed as `cursor_mark` to resume after that
+        page.  Other arguments are as for calling the handler.
+
+        For example:
+        >>> for page in conn.select.cursor('*:*', sort='id asc', rows=500):
+        ...     process(page.results)
+        """
+        if not sort:
+            raise ValueError("a cursor requires a sort")
+        while True:
+            response = self(q, sort=sort, cursorMark=cursor_mark, **params)
+            yield response
+            next_mark = getattr(response, 'nextCursorMark', None)
+            if next_mark is None or next_mark == cursor_mark:
+                return
+            cursor_mark = next_mark
+
+    def count(self, q=None, cache=None, **params):
+        """
+        Return the number of documents matching `q`.
+
+        Only the count is requested (``rows=0``, with no scores), and
+        the response is read no further than the count.  Other keyword
+        arguments, such as ``fq``, are added to the query as for calling
+        the handler.  If `cache` (a `CountCache`) holds the count of the
+        same query, it is returned without a request; otherwise the
+        count is added to it.
+
+        For example:
+        >>> conn.select.count('category:books', fq='in_stock:true')
+        1234L
+        """
+        if q is not None:
+            params['q'] = q
+        params['rows'] = 0
+        params['version'] = self.conn.response_version
+        params['wt'] = parse_xml_response.wt
+        if cache is not None:
+            key = (self.selector, _params_key(params))
+            count = cache.get(key)
+            if count is not None:
+                return count
+        rsp, data = self.conn._post(self.selector, self._encode(params),
+                                    self.conn.form_headers)
+        count = _parse_num_found(StringIO(data))
+        if count is None:
+            raise SolrException(rsp.status, "no result in response", data)
+        if cache is not None:
+            cache.put(key, count)
+        return count
+
+    def exists(self, q=None, cache=None, **params):
+        """
+        Return true if any document matches `q`.  The arguments are as
+        for `count`.
+        """
+        return self.count(q, cache, **params) > 0
 
     def raw(self, **params):
         """
@@ -851,20 +2082,150 @@ class SearchHandler(object):
         Return the raw result.  No pre-processing or post-processing
         happens to either input parameters or responses.
         """
-        # Clean up optional parameters to match SOLR spec.
-        query = []
-        to_str = lambda s: s.encode('utf-8') if isinstance(s, unicode) else s
-        for key, value in params.items():
-            key = key.replace(self.arg_separator, '.')
-            if isinstance(value, (list, tuple)):
-                query.extend([(key, to_str(v)) for v in value])
-            else:
-                query.append((key, to_str(value)))
-        request = urllib.urlencode(query, doseq=True)
+        return self._post_query(self._encode(params))
+
+    def _encode(self, params):
+        return _encode_params(params, self.arg_separator)
+
+    def _post_query(self, request):
         rsp, data = self.conn._post(self.selector, request, self.conn.form_headers)
         return data
 
 
+class PreparedQuery(object):
+    """
+    A query prepared with `SearchHandler.prepare`, whose constant
+    parameters have already been encoded.
+
+    Calling it with a query string, and any other parameters, returns a
+    `Response` as for the handler; only the parameters of the call are
+    encoded.  A parameter which was also given when preparing the query
+    replaces the prepared value, at the cost of encoding the whole
+    request.  The `next_batch` and `previous_batch` methods of the
+    responses use the prepared query.
+    """
+
+    def __init__(self, handler, fields=None, highlight=None, score=True,
+                 sort=None, sort_order="asc", params=None):
+        self.handler = handler
+        params = handler._query_params(fields, highlight, score, sort,
+                                       sort_order, dict(params or {}))
+        self.params = dict([(self._key(k), v) for k, v in params.items()])
+        self._static = handler._encode(self.params)
+
+    def __call__(self, q=None, **params):
+        if q is not None:
+            params['q'] = q
+        for key in params:
+            if self._key(key) in self.params:
+                request = dict(self.params)
+                request.update([(self._key(k), v) for k, v in params.items()])
+                request = self.handler._encode(request)
+                break
+        else:
+            request = self.handler._encode(params)
+            if request:
+                request += '&' + self._static
+            else:
+                request = self._static
+        data = self.handler._post_query(request)
+        return self.handler.parse_response(StringIO(data), params, self)
+
+    def _key(self, key):
+        return key.replace(self.handler.arg_separator, '.')
+
+
+class CountCache(object):
+    """
+    Cache of the counts returned by `SearchHandler.count`, each kept for
+    `ttl` seconds.  When more than `max_entries` counts are cached, the
+    oldest are discarded.  The cache may be shared between threads and
+    handlers.  `clock` returns the current time in seconds; by default,
+    `time.time` is used.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=10000, clock=None):
+        self.ttl = ttl
+        self.max_entries = int(max_entries)
+        self._clock = clock or time.time
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def get(self, key):
+        """Return the count cached for `key`, or ``None``."""
+        self._lock.acquire()
+        try:
+            entry = self._counts.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._counts[key]
+                return None
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def put(self, key, count):
+        """Cache `count` for `key`."""
+        self._lock.acquire()
+        try:
+            self._counts.pop(key, None)
+            self._counts[key] = (self._clock() + self.ttl, count)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Discard all cached counts."""
+        self._lock.acquire()
+        try:
+            self._counts.clear()
+        finally:
+            self._lock.release()
+
+
+# Parameters left out of the query for highlighting only.
+_NOT_HIGHLIGHTED = set(['fl', 'sort', 'start', 'rows', 'cursorMark', 'facet',
+                        'stats', 'group', 'spellcheck', 'debug', 'debugQuery',
+                        'mlt', 'expand', 'terms', 'json', 'version', 'wt'])
+
+# Characters tried in turn to separate the terms of a {!terms} query.
+_TERMS_SEPARATORS = (',', '|', ';', '\t', '\x1f')
+
+
+def _terms_query(field, values):
+    """
+    Return a ``{!terms}`` query for documents with any of `values` in
+    `field`.
+    """
+    terms = [unicode(value) for value in values]
+    for separator in _TERMS_SEPARATORS:
+        if not [term for term in terms if separator in term]:
+            break
+    else:
+        raise ValueError("no separator for the terms %r" % (terms,))
+    if separator == ',':
+        local = u'{!terms f=%s}' % field
+    else:
+        local = u'{!terms f=%s separator="%s"}' % (field, separator)
+    return local + separator.join(terms)
+
+
+def _params_key(params):
+    # A hashable form of query parameters, independent of their order.
+    key = []
+    for name, value in params.items():
+        if isinstance(value, (list, tuple)):
+            value = tuple(value)
+        key.append((name, value))
+    key.sort()
+    return tuple(key)
+
+
 # ===================================================================
 # Response objects
 # ===================================================================
@@ -889,6 +2250,10 @@ class Response(object):
         self._query = None
         self._params = {}
 
+        # Set by SearchHandler for lazy highlighting; called with the
+        # response to return its highlighting.
+        self._highlight = None
+
     def _set_params(self, params, query):
         self._query = query
         self._params = params or {}
@@ -926,6 +2291,25 @@ class Response(object):
 
     maxScore = property(_get_maxScore, _set_maxScore, _del_maxScore)
 
+    def _set_highlighting(self, value):
+        self._highlighting = value
+
+    def _get_highlighting(self):
+        try:
+            return self._highlighting
+        except AttributeError:
+            if self._highlight is None:
+                raise
+        self._highlighting = self._highlight(self)
+        self._highlight = None
+        return self._highlighting
+
+    def _del_highlighting(self):
+        del self._highlighting
+
+    highlighting = property(_get_highlighting, _set_highlighting,
+                            _del_highlighting)
+
     def __len__(self):
         """
         Return the number of matching documents contained in this set.
@@ -1129,6 +2513,32 @@ def parse_xml_response(data, params, query):
 parse_xml_response.wt = 'standard'
 
 
+class _NumFound(Exception):
+    pass
+
+
+class _NumFoundHandler(ContentHandler):
+    # Stops parsing at the main result element.
+
+    def startElement(self, name, attrs):
+        if name == 'result' and attrs.get('name', 'response') == 'response':
+            raise _NumFound(long(attrs.get('numFound', 0)))
+
+
+def _parse_num_found(data):
+    """
+    Return the ``numFound`` of the XML results of a /select call, or
+    ``None`` if there are no results, reading no further than needed.
+    """
+    parser = make_parser()
+    parser.setContentHandler(_NumFoundHandler())
+    try:
+        parser.parse(data)
+    except _NumFound, e:
+        return e.args[0]
+    return None
+
+
 class ResponseContentHandler(ContentHandler):
     """
     ContentHandler for the XML results of a /select call.
@@ -1324,6 +2734,149 @@ def utc_from_string(value):
     except ValueError:
         raise ValueError ("'%s' is not a valid ISO 8601 Solr date" % value)
 
+def _xml_regions(mm, every):
+    """
+    Split an XML ``<add>`` file mapped by `mm` after every `every`
+    ``</doc>`` tags, yielding ``(prefix, start, end, suffix)`` tuples.
+    """
+    first = mm.find('<doc')
+    last = mm.rfind('</doc>')
+    if first < 0 or last < 0:
+        yield '', 0, len(mm), ''
+        return
+    prefix = mm[:first]
+    suffix = mm[last + len('</doc>'):]
+    start = first
+    while 0 <= start < last:
+        end = start
+        for i in xrange(every):
+            pos = mm.find('</doc>', end)
+            if pos < 0:
+                break
+            end = pos + len('</doc>')
+        yield prefix, start, end, suffix
+        start = mm.find('<doc', end)
+
+
+def _csv_regions(mm, every):
+    """
+    Split a CSV file mapped by `mm` into groups of `every` lines after
+    the header line, yielding ``(prefix, start, end, suffix)`` tuples.
+    A file without any lines after the header is a single region.
+    """
+    start = mm.find('\n') + 1
+    if not start or start >= len(mm):
+        yield '', 0, len(mm), ''
+        return
+    prefix = mm[:start]
+    size = len(mm)
+    while start < size:
+        end = start
+        for i in xrange(every):
+            pos = mm.find('\n', end)
+            if pos < 0:
+                end = size
+                break
+            end = pos + 1
+        yield prefix, start, end, ''
+        start = end
+
+
+def _parallel_map(function, items, workers):
+    """
+    Call `function` for each item of the iterable `items` from up to
+    `workers` threads (no more than there are items, if `items` has a
+    length), and return the results in order.
+
+    `items` is consumed as the calls are made.  If a call raises an
+    exception, no further calls are started, and the exception is
+    re-raised once those in progress have finished.
+    """
+    if hasattr(items, '__len__'):
+        if not len(items):
+            return []
+        workers = min(workers, len(items))
+    items = enumerate(items)
+    results = {}
+    errors = []
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            lock.acquire()
+            try:
+                if errors:
+                    return
+                try:
+                    index, item = items.next()
+                except StopIteration:
+                    return
+                except:
+                    errors.append(sys.exc_info())
+                    return
+            finally:
+                lock.release()
+            try:
+                results[index] = function(item)
+            except:
+                lock.acquire()
+                try:
+                    errors.append(sys.exc_info())
+                finally:
+                    lock.release()
+                return
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=work, name='solrpy-worker')
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return [results[i] for i in range(len(results))]
+
+
+def _unique_chunks(ids, size):
+    """
+    Yield lists of at most `size` ids from the iterable `ids`, skipping
+    ids seen before.
+    """
+    seen = set()
+    chunk = []
+    for id in ids:
+        key = unicode(id)
+        if key in seen:
+            continue
+        seen.add(key)
+        chunk.append(id)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _encode_params(params, arg_separator='_'):
+    """
+    Encode the request parameters `params` as a form body.  Occurrences
+    of `arg_separator` in the names are replaced by dots (so ``hl_fl``
+    becomes ``hl.fl``), and each value of a list or tuple is sent.
+    """
+    query = []
+    for key, value in params.items():
+        key = key.replace(arg_separator, '.')
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        for v in value:
+            if isinstance(v, unicode):
+                v = v.encode('utf-8')
+            query.append((key, v))
+    return urllib.urlencode(query, doseq=True)
+
+
 def qs_from_items(query):
     # This deals with lists of values since multiple filter queries can
     # be used for a single request.
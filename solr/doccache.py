@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+
+from solr.core import SearchHandler
+from solr.realtime import RealTimeGetHandler
+
+__all__ = ['DocumentCache', 'CachingSearchHandler']
+
+
+class DocumentCache(object):
+    """
+    Bounded cache of documents, each stored with its ``_version_``.
+
+    A cached document is only returned if the version asked for
+    matches; when more than `max_docs` documents are cached, the least
+    recently used are discarded.  The cache may be shared between
+    threads and handlers.
+    """
+
+    def __init__(self, max_docs=10000):
+        self.max_docs = int(max_docs)
+        self.hits = 0
+        self.misses = 0
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, key, version):
+        """Return the document cached for `key` at `version`, or ``None``."""
+        self._lock.acquire()
+        try:
+            entry = self._docs.pop(key, None)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._docs[key] = entry
+            self.hits += 1
+            return dict(entry[1])
+        finally:
+            self._lock.release()
+
+    def put(self, key, version, doc):
+        """Cache `doc` as the `version` of the document `key`."""
+        self._lock.acquire()
+        try:
+            self._docs.pop(key, None)
+            self._docs[key] = (version, dict(doc))
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Discard all cached documents."""
+        self._lock.acquire()
+        try:
+            self._docs.clear()
+        finally:
+            self._lock.release()
+
+
+class CachingSearchHandler(object):
+    """
+    Search handler retrieving documents in two phases, to avoid
+    transferring documents which are already cached locally.
+
+    The query first fetches only the unique key and ``_version_`` of
+    each match.  Documents whose version is in the `cache` (a
+    `DocumentCache`) are taken from it; the rest are fetched with one
+    batch of real-time get requests (see `RealTimeGetHandler`) and
+    cached.  The returned `Response` is that of the query, with its
+    results replaced by the full documents in the original order.  A
+    document deleted between the two phases is left out.
+
+    For example:
+    >>> search = solr.CachingSearchHandler(conn, solr.DocumentCache(50000))
+    >>> response = search('category:books', fields='id,title,body', rows=20)
+    """
+
+    def __init__(self, conn, cache=None, relpath="/select", unique_key='id',
+                 get=None):
+        self.conn = conn
+        if cache is None:
+            cache = DocumentCache()
+        self.cache = cache
+        self.unique_key = unique_key
+        self.search = SearchHandler(conn, relpath)
+        self.get = get or RealTimeGetHandler(conn, unique_key=unique_key)
+
+    def __call__(self, q=None, fields=None, highlight=None, score=True,
+                 **params):
+        """
+        Arguments are as for `SearchHandler`; `fields` applies to the
+        documents returned.
+        """
+        if isinstance(fields, basestring):
+            fields = fields.replace(',', ' ').split()
+        requested = list(fields or ['*'])
+        # The version is needed to cache the documents, but is only
+        # returned if it was asked for.
+        fields = list(requested)
+        strip = '*' not in fields and '_version_' not in fields
+        if strip:
+            fields.append('_version_')
+        if highlight is True:
+            highlight = [f for f in fields if f not in ('*', '_version_')]
+            if not highlight:
+                raise ValueError("highlight is True and no fields were given")
+
+        response = self.search(q, fields=[self.unique_key, '_version_'],
+                               highlight=highlight, score=score, **params)
+        if response is None:
+            return None
+
+        fl = ','.join(fields)
+        keys = [doc[self.unique_key] for doc in response.results]
+        docs = {}
+        misses = []
+        for doc in response.results:
+            key = doc[self.unique_key]
+            cached = self.cache.get((fl, key), doc.get('_version_'))
+            if cached is None:
+                misses.append(key)
+            else:
+                docs[key] = cached
+        if misses:
+            for key, doc in self.get(misses, fields=fl).items():
+                self.cache.put((fl, key), doc.get('_version_'), doc)
+                docs[key] = doc
+
+        results = []
+        for doc, key in zip(response.results, keys):
+            full = docs.get(key)
+            if full is not None:
+                # A copy, so that the cached document isn't changed.
+                full = dict(full)
+                if strip:
+                    full.pop('_version_', None)
+                if 'score' in doc:
+                    full['score'] = doc['score']
+                results.append(full)
+        response.results[:] = results
+
+        params.update({'q': q, 'fields': requested, 'highlight': highlight,
+                       'score': score})
+        response._set_params(params, self)
+        return response
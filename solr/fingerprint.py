@@ -0,0 +1,156 @@
+import hashlib
+import sqlite3
+import threading
+
+__all__ = ['FingerprintStore']
+
+
+class FingerprintStore(object):
+    """
+    Local record of the documents last sent to Solr, used to skip
+    re-sending unchanged documents.
+
+    The store is an SQLite database at `path` mapping each document's
+    `unique_key` value to a hash of its serialized fields.  A connection
+    created with ``fingerprints=store`` consults it in `add_many`
+    (and `add`): documents whose hash matches the recorded one are
+    skipped, and the hashes of documents sent are recorded once Solr has
+    accepted them.
+
+    To find documents which have disappeared from the source, call
+    `begin` before a full pass over it; afterwards, `missing` lists the
+    ids which weren't seen during the pass, and `Solr.delete_missing`
+    deletes them.
+
+    Deleting documents through the connection removes them from the
+    store; deleting by query clears the store, since the affected ids
+    aren't known.  Atomic updates (see `Solr.updater`) are never skipped.
+
+    The `sent` and `skipped` attributes count documents since the store
+    was opened.
+    """
+
+    def __init__(self, path, unique_key='id'):
+        self.path = path
+        self.unique_key = unique_key
+        self.sent = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints '
+            '(id TEXT PRIMARY KEY, hash TEXT NOT NULL, run INTEGER NOT NULL)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS runs (run INTEGER NOT NULL)')
+        row = self._db.execute('SELECT MAX(run) FROM runs').fetchone()
+        self.run = row[0] or 0
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+    def fingerprint(self, doc, serialize):
+        """
+        Return a stable hash of `doc`, using `serialize(lst, doc)` to
+        produce the serialized form of each field.
+        """
+        digest = hashlib.sha1()
+        for field in sorted(doc.keys()):
+            lst = []
+            serialize(lst, {field: doc[field]})
+            digest.update(u''.join(lst).encode('utf-8'))
+        return digest.hexdigest()
+
+    def changes(self, docs, serialize):
+        """
+        Return the documents from `docs` which differ from the recorded
+        versions, and a list of ``(id, hash)`` pairs to pass to `record`
+        once they have been sent.  Every recorded document in `docs` is
+        marked as seen in the current pass, so that it isn't reported by
+        `missing` even if sending the changed version fails; its recorded
+        hash is kept until `record` is called, so it is sent again.
+        """
+        changed = []
+        marks = []
+        seen = []
+        skipped = 0
+        self._lock.acquire()
+        try:
+            for doc in docs:
+                id = unicode(doc[self.unique_key])
+                digest = self.fingerprint(doc, serialize)
+                row = self._db.execute(
+                    'SELECT hash FROM fingerprints WHERE id = ?',
+                    (id,)).fetchone()
+                if row is not None:
+                    seen.append((self.run, id))
+                if row is not None and row[0] == digest:
+                    skipped += 1
+                else:
+                    changed.append(doc)
+                    marks.append((id, digest))
+            self._db.executemany(
+                'UPDATE fingerprints SET run = ? WHERE id = ?', seen)
+            self._db.commit()
+            self.skipped += skipped
+        finally:
+            self._lock.release()
+        return changed, marks
+
+    def record(self, marks):
+        """Record the hashes of documents which have been sent."""
+        self._lock.acquire()
+        try:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO fingerprints (id, hash, run) '
+                'VALUES (?, ?, ?)',
+                [(id, digest, self.run) for id, digest in marks])
+            self._db.commit()
+            self.sent += len(marks)
+        finally:
+            self._lock.release()
+
+    def forget(self, ids):
+        """Remove the records for `ids`."""
+        self._lock.acquire()
+        try:
+            self._db.executemany('DELETE FROM fingerprints WHERE id = ?',
+                                 [(unicode(id),) for id in ids])
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Remove all records."""
+        self._lock.acquire()
+        try:
+            self._db.execute('DELETE FROM fingerprints')
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def begin(self):
+        """Start a full pass over the source documents."""
+        self._lock.acquire()
+        try:
+            self.run += 1
+            self._db.execute('INSERT INTO runs (run) VALUES (?)', (self.run,))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def missing(self):
+        """
+        Return the ids of recorded documents which haven't been seen
+        since `begin` was last called.
+        """
+        self._lock.acquire()
+        try:
+            return [row[0] for row in self._db.execute(
+                'SELECT id FROM fingerprints WHERE run < ? ORDER BY id',
+                (self.run,))]
+        finally:
+            self._lock.release()
@@ -0,0 +1,123 @@
+import math
+import struct
+import hashlib
+
+from solr.core import _terms_query, _unique_chunks
+
+__all__ = ['BloomFilter', 'existing_ids']
+
+
+def _key(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    return unicode(value).encode('utf-8')
+
+
+class BloomFilter(object):
+    """
+    Set of values which may report values it doesn't hold (with a
+    probability of about `error_rate` once `capacity` values have been
+    added), but never misses one it holds.
+
+    Used with `existing_ids`, it saves queries for ids which are
+    certainly not in the index.  It only knows the ids it has been
+    given, so ids indexed after it was built should be added to it.
+
+    For example:
+    >>> bloom = solr.BloomFilter.from_index(conn)
+    >>> present = solr.existing_ids(conn, candidates, bloom=bloom)
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(
+            int(round(self.num_bits * math.log(2) / capacity)), 1)
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    @classmethod
+    def from_index(cls, conn, field='id', q='*:*', error_rate=0.01,
+                   rows=10000, capacity=None, **params):
+        """
+        Build a filter of the values of `field` (by default, the unique
+        key) in the documents matching `q`, read with a cursor in pages
+        of `rows`.  Unless `capacity` is given, the filter is sized for
+        the number of matches.  Other keyword arguments are added to
+        each query.
+        """
+        if capacity is None:
+            capacity = conn.select.count(q, **params)
+        bloom = cls(capacity, error_rate)
+        for response in conn.select.cursor(q, sort='%s asc' % field,
+                                           fields=field, score=False,
+                                           rows=rows, **params):
+            for doc in response.results:
+                value = doc.get(field)
+                if value is not None:
+                    bloom.add(value)
+        return bloom
+
+    def _positions(self, value):
+        digest = hashlib.md5(_key(value)).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        for i in xrange(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value):
+        """Add `value` to the filter."""
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, values):
+        """Add each of `values` to the filter."""
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value):
+        for position in self._positions(value):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def existing_ids(conn, ids, field='id', chunk_size=1000, bloom=None,
+                 **params):
+    """
+    Return the set of `ids` for which a document exists in the index.
+
+    The ids are looked up with ``{!terms}`` filter queries on `field`
+    (by default, the unique key), `chunk_size` ids at a time, several
+    at a time through the connection's pool.  If `bloom` (a
+    `BloomFilter` of the indexed ids) is given, ids it doesn't hold are
+    not looked up.  Other keyword arguments, such as ``fq``, are added
+    to each query.
+
+    Unlike a real-time get, only committed documents are found.
+    """
+    fq = params.pop('fq', [])
+    if isinstance(fq, basestring):
+        fq = [fq]
+    fq = list(fq)
+    if bloom is not None:
+        ids = [id for id in ids if id in bloom]
+
+    def lookup(conn, chunk):
+        response = conn.select('*:*', fields=field, score=False,
+                               rows=len(chunk),
+                               fq=fq + [_terms_query(field, chunk)], **params)
+        found = set([unicode(doc.get(field)) for doc in response.results])
+        return [id for id in chunk if unicode(id) in found]
+
+    present = set()
+    for found in conn.pool.map(lookup, _unique_chunks(ids, chunk_size)):
+        present.update(found)
+    return present
@@ -1,4 +1,74 @@
 import math
+import base64
+import threading
+from collections import OrderedDict
+
+__all__ = ['SolrPaginator', 'SolrPage', 'PageRange', 'InvalidPage',
+           'PageNotAnInteger', 'EmptyPage', 'CursorPaginator', 'CursorPage']
+
+
+class InvalidPage(Exception):
+    pass
+
+
+class PageNotAnInteger(InvalidPage):
+    pass
+
+
+class EmptyPage(InvalidPage):
+    pass
+
+
+class PageRange(object):
+    """
+    The page numbers of a paginator, from 1 to `num_pages`, computed as
+    they are needed rather than held in a list.
+    """
+
+    def __init__(self, num_pages):
+        self.num_pages = num_pages
+
+    def __len__(self):
+        return self.num_pages
+
+    def __iter__(self):
+        return iter(xrange(1, self.num_pages + 1))
+
+    def __contains__(self, page_num):
+        try:
+            return (int(page_num) == page_num
+                    and 1 <= page_num <= self.num_pages)
+        except (TypeError, ValueError):
+            return False
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return range(1, self.num_pages + 1)[index]
+        if index < 0:
+            index += self.num_pages
+        if not 0 <= index < self.num_pages:
+            raise IndexError("page range index out of range")
+        return index + 1
+
+    def __eq__(self, other):
+        if isinstance(other, PageRange):
+            return self.num_pages == other.num_pages
+        try:
+            if len(other) != self.num_pages:
+                return False
+        except TypeError:
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return 'PageRange(%d)' % self.num_pages
+
 
 class SolrPaginator:
     """
@@ -20,12 +90,24 @@ class SolrPaginator:
 
       http://docs.djangoproject.com/en/dev/topics/pagination/
 
+    The page of the response the paginator is created from is served
+    without another query, and up to `cache_pages` fetched pages are
+    kept, dropping the least recently used.  If `prefetch` is true,
+    the page after the one requested is fetched in the background; this
+    is off by default, since it doubles the queries of a client which
+    only looks at one page.
     """
 
-    def __init__(self, result, default_page_size=None):
+    def __init__(self, result, default_page_size=None, cache_pages=8,
+                 prefetch=False):
         self.params = result.header['params']
         self.result = result
         self.query = result._query
+        self.cache_pages = cache_pages
+        self.prefetch = prefetch
+        self._pages = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
 
         if 'rows' in self.params:
             self.page_size = int(self.params['rows'])
@@ -42,6 +124,13 @@ class SolrPaginator:
         else:
             self.page_size = len(self.result.results)
 
+        try:
+            start = int(self.result.results.start)
+        except AttributeError:
+            start = 0
+        if self.page_size and start % self.page_size == 0:
+            self._store(start // self.page_size + 1, self.result.results)
+
     @property
     def count(self):
         return int(self.result.numFound)
@@ -54,37 +143,97 @@ class SolrPaginator:
 
     @property
     def page_range(self):
-        """List the index numbers of the available result pages."""
-        if self.count == 0:
-            return []
-        # Add one because range is right-side exclusive
-        return range(1, self.num_pages + 1)
+        """The index numbers of the available result pages."""
+        return PageRange(self.num_pages)
 
     def _fetch_page(self, start=0):
         """Retrieve a new result response from Solr."""
-        # need to convert the keys to strings to pass them as parameters
-        new_params = {}
-        for k, v in self.params.items():
-            new_params[str(k)] = v.encode('utf-8')
-
-        # get the new start index
-        new_params['start'] = start
-        return self.query(**new_params)
+        # The parameters of the original call are reused as they are;
+        # those echoed by Solr need their keys converted to strings.
+        params = self.result._params
+        if not params:
+            params = dict([(str(k), v) for k, v in self.params.items()])
+        params = dict(params)
+        params['start'] = start
+        params['rows'] = self.page_size
+        q = params.pop('q', None)
+        return self.query(q, **params)
 
     def page(self, page_num=1):
         """Return the requested Page object"""
         try:
-            int(page_num)
-        except:
-            raise 'PageNotAnInteger'
+            page_num = int(page_num)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
 
         if page_num not in self.page_range:
-            raise 'EmptyPage', 'That page does not exist.'
+            raise EmptyPage('That page does not exist.')
+
+        results = self._cached(page_num)
+        if results is None:
+            # Page 1 starts at 0; take one off before calculating
+            start = (page_num - 1) * self.page_size
+            results = self._fetch_page(start=start).results
+            self._store(page_num, results)
+        if self.prefetch and page_num + 1 in self.page_range:
+            self._prefetch(page_num + 1)
+        return SolrPage(results, page_num, self)
+
+    def _cached(self, page_num):
+        self._lock.acquire()
+        try:
+            pending = self._pending.get(page_num)
+        finally:
+            self._lock.release()
+        if pending is not None:
+            pending.join()
+        self._lock.acquire()
+        try:
+            results = self._pages.pop(page_num, None)
+            if results is not None:
+                self._pages[page_num] = results
+            return results
+        finally:
+            self._lock.release()
 
-        # Page 1 starts at 0; take one off before calculating
-        start = (page_num - 1) * self.page_size
-        new_result = self._fetch_page(start=start)
-        return SolrPage(new_result.results, page_num, self)
+    def _store(self, page_num, results):
+        self._lock.acquire()
+        try:
+            self._pages.pop(page_num, None)
+            self._pages[page_num] = results
+            while len(self._pages) > max(self.cache_pages, 1):
+                self._pages.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def _prefetch(self, page_num):
+        self._lock.acquire()
+        try:
+            if page_num in self._pages or page_num in self._pending:
+                return
+            thread = threading.Thread(target=self._fetch_ahead,
+                                      args=(page_num,),
+                                      name='solrpy-paginator')
+            thread.setDaemon(True)
+            self._pending[page_num] = thread
+        finally:
+            self._lock.release()
+        thread.start()
+
+    def _fetch_ahead(self, page_num):
+        try:
+            try:
+                start = (page_num - 1) * self.page_size
+                self._store(page_num, self._fetch_page(start=start).results)
+            except Exception:
+                # The page will be fetched again if it is requested.
+                pass
+        finally:
+            self._lock.acquire()
+            try:
+                del self._pending[page_num]
+            finally:
+                self._lock.release()
 
 
 class SolrPage:
@@ -130,3 +279,162 @@ class SolrPage:
     def previous_page_number(self):
         return self.number - 1
 
+
+
+class CursorPaginator:
+    """
+    Paginator over the matches of a query using Solr's cursor support,
+    for which deep pages are as fast as the first one, and which
+    doesn't repeat or skip matches when the index changes between
+    pages.
+
+    `query` is a search handler, such as ``conn.select``, or a prepared
+    query; `sort` must include the schema's unique key field.  Other
+    keyword arguments are passed to each query.
+
+    Each page has a `bookmark`, an opaque string which can be put in a
+    URL and passed to `page_from_bookmark` to get the same page later,
+    even from another paginator for the same query.  The cursor
+    position of every page reached is kept, so that a page can be
+    requested by number without reading the pages before it again;
+    reaching a page further on requires reading the pages in between.
+
+    For example:
+    >>> paginator = solr.CursorPaginator(conn.select, 'title:solr',
+    ...                                  sort='date desc,id asc', page_size=20)
+    >>> page = paginator.page_from_bookmark(request.GET.get('page'))
+    >>> next_url = '?page=' + page.next_bookmark
+    """
+
+    def __init__(self, query, q=None, sort=None, page_size=10, **params):
+        self.query = query
+        self.q = q
+        self.sort = sort
+        self.page_size = int(page_size)
+        self.params = params
+        self.count = None
+        self._marks = {1: '*'}
+
+    @property
+    def num_pages(self):
+        """
+        The number of pages, from the number of matches reported by the
+        last query (``None`` before the first page is fetched).
+        """
+        if self.count is None:
+            return None
+        return int(math.ceil(float(self.count) / float(self.page_size)))
+
+    @property
+    def page_range(self):
+        """The index numbers of the available result pages."""
+        return PageRange(self.num_pages or 0)
+
+    def page(self, page_num=1):
+        """Return the requested `CursorPage`."""
+        try:
+            page_num = int(page_num)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if page_num < 1:
+            raise EmptyPage('That page does not exist.')
+
+        known = max([n for n in self._marks if n <= page_num])
+        page = self._fetch_page(known, self._marks[known])
+        while page.number < page_num:
+            if page.next_bookmark is None:
+                raise EmptyPage('That page does not exist.')
+            page = self._fetch_page(page.number + 1,
+                                    self._marks[page.number + 1])
+        return page
+
+    def page_from_bookmark(self, bookmark=None):
+        """
+        Return the page identified by `bookmark`, or the first page if
+        `bookmark` is empty.
+        """
+        if not bookmark:
+            return self.page(1)
+        page_num, cursor_mark = self._decode(bookmark)
+        self._marks.setdefault(page_num, cursor_mark)
+        return self._fetch_page(page_num, cursor_mark)
+
+    def bookmark(self, page_num):
+        """
+        Return the bookmark of page `page_num`, or ``None`` if its cursor
+        position isn't known yet.
+        """
+        cursor_mark = self._marks.get(page_num)
+        if cursor_mark is None:
+            return None
+        return self._encode(page_num, cursor_mark)
+
+    def _fetch_page(self, page_num, cursor_mark):
+        params = dict(self.params)
+        if self.sort is not None:
+            params['sort'] = self.sort
+        params['rows'] = self.page_size
+        params['cursorMark'] = cursor_mark
+        response = self.query(self.q, **params)
+        self.count = int(response.numFound)
+        next_mark = getattr(response, 'nextCursorMark', None)
+        if (next_mark is None or next_mark == cursor_mark
+                or len(response.results) < self.page_size):
+            next_mark = None
+        else:
+            self._marks[page_num + 1] = next_mark
+        return CursorPage(response.results, page_num, self, cursor_mark,
+                          next_mark)
+
+    def _encode(self, page_num, cursor_mark):
+        if isinstance(cursor_mark, unicode):
+            cursor_mark = cursor_mark.encode('utf-8')
+        token = base64.urlsafe_b64encode('%d:%s' % (page_num, cursor_mark))
+        return token.rstrip('=')
+
+    def _decode(self, bookmark):
+        try:
+            bookmark = str(bookmark)
+            bookmark += '=' * (-len(bookmark) % 4)
+            token = base64.urlsafe_b64decode(bookmark)
+            page_num, cursor_mark = token.split(':', 1)
+            page_num = int(page_num)
+        except (TypeError, ValueError, UnicodeError):
+            raise InvalidPage('Invalid page bookmark')
+        if page_num < 1 or not cursor_mark:
+            raise InvalidPage('Invalid page bookmark')
+        return page_num, cursor_mark
+
+
+class CursorPage(SolrPage):
+    """
+    A page of a `CursorPaginator`, with the bookmarks of this page and
+    of the next (``None`` on the last page).
+    """
+
+    def __init__(self, result, page_num, paginator, cursor_mark, next_mark):
+        SolrPage.__init__(self, result, page_num, paginator)
+        self.cursor_mark = cursor_mark
+        self.next_cursor_mark = next_mark
+
+    @property
+    def bookmark(self):
+        return self.paginator._encode(self.number, self.cursor_mark)
+
+    @property
+    def next_bookmark(self):
+        if self.next_cursor_mark is None:
+            return None
+        return self.paginator._encode(self.number + 1, self.next_cursor_mark)
+
+    @property
+    def previous_bookmark(self):
+        if self.number == 1:
+            return None
+        return self.paginator.bookmark(self.number - 1)
+
+    def has_next(self):
+        return self.next_cursor_mark is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
@@ -0,0 +1,107 @@
+import threading
+from collections import deque
+
+__all__ = ['prefetch_results']
+
+
+def _last_page(response):
+    if response is None or not response.results:
+        return True
+    try:
+        start = int(response.results.start)
+    except AttributeError:
+        start = 0
+    try:
+        return start + len(response.results) >= response.numFound
+    except AttributeError:
+        return False
+
+
+def prefetch_results(response, depth=2, max_docs=None):
+    """
+    Yield every document matching the query of `response`, in order,
+    starting with its results, while the following pages are fetched in
+    the background.
+
+    Up to `depth` pages beyond the one being read are requested ahead
+    with `Response.next_batch`, from a separate thread.  If `max_docs`
+    is given, no more pages are requested while that many documents
+    are waiting to be read, though one page is always fetched ahead.
+
+    For example:
+    >>> response = conn.select('category:books', rows=500)
+    >>> for doc in solr.prefetch_results(response, depth=3, max_docs=5000):
+    ...     process(doc)
+    """
+    if depth < 1:
+        raise ValueError("depth must be at least 1")
+    lock = threading.Condition()
+    state = {'pages': deque(), 'buffered': 0, 'done': False,
+             'error': None, 'stopped': False}
+
+    def room(size):
+        if len(state['pages']) >= depth:
+            return False
+        return (max_docs is None or not state['pages']
+                or state['buffered'] + size <= max_docs)
+
+    def fetch():
+        current = response
+        try:
+            while not _last_page(current):
+                lock.acquire()
+                try:
+                    while not state['stopped'] and not room(len(current)):
+                        lock.wait()
+                    if state['stopped']:
+                        return
+                finally:
+                    lock.release()
+                current = current.next_batch()
+                if current is None:
+                    break
+                lock.acquire()
+                try:
+                    state['pages'].append(current.results)
+                    state['buffered'] += len(current.results)
+                    lock.notifyAll()
+                finally:
+                    lock.release()
+        except Exception, e:
+            state['error'] = e
+        lock.acquire()
+        try:
+            state['done'] = True
+            lock.notifyAll()
+        finally:
+            lock.release()
+
+    thread = threading.Thread(target=fetch, name='solrpy-prefetch')
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        for doc in response.results:
+            yield doc
+        while True:
+            lock.acquire()
+            try:
+                while not state['pages'] and not state['done']:
+                    lock.wait()
+                if not state['pages']:
+                    if state['error'] is not None:
+                        raise state['error']
+                    return
+                page = state['pages'].popleft()
+                state['buffered'] -= len(page)
+                lock.notifyAll()
+            finally:
+                lock.release()
+            for doc in page:
+                yield doc
+    finally:
+        lock.acquire()
+        try:
+            state['stopped'] = True
+            lock.notifyAll()
+        finally:
+            lock.release()
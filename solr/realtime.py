@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from StringIO import StringIO
+
+from solr.core import parse_xml_response, _encode_params, _unique_chunks
+
+__all__ = ['RealTimeGetHandler', 'FetchedDocuments']
+
+
+class FetchedDocuments(OrderedDict):
+    """
+    Documents fetched by id, keyed by id in the order the ids were
+    given.  Ids for which no document exists are listed in `missing`,
+    also in order.
+    """
+
+    def __init__(self, *args, **kw):
+        OrderedDict.__init__(self, *args, **kw)
+        self.missing = []
+
+
+class RealTimeGetHandler(object):
+    """
+    Client for Solr's real-time get handler, ``/get``, which returns the
+    latest version of documents by id whether or not it has been
+    committed.
+
+    For example:
+    >>> get = solr.RealTimeGetHandler(conn)
+    >>> docs = get(['doc-1', 'doc-2', 'doc-3'], fields='id,title')
+    >>> docs['doc-2']['title']
+    >>> docs.missing
+    ['doc-3']
+
+    Ids are sent in requests of at most `chunk_size` ids, several at a
+    time through the connection's pool.  `unique_key` is the name of
+    the schema's unique key field.
+    """
+
+    def __init__(self, conn, relpath="/get", unique_key='id', chunk_size=100,
+                 arg_separator="_"):
+        self.conn = conn
+        self.selector = conn.path + relpath
+        self.unique_key = unique_key
+        self.chunk_size = int(chunk_size)
+        self.arg_separator = arg_separator
+
+    def __call__(self, ids, fields=None, **params):
+        """
+        Fetch the documents with the given `ids` (an iterable), returning
+        a `FetchedDocuments` mapping.  `fields` limits the fields
+        returned, as for `SearchHandler`; other keyword arguments (such
+        as ``fq``) are added to each request.
+        """
+        if fields:
+            if isinstance(fields, basestring):
+                fields = fields.replace(',', ' ').split()
+            if self.unique_key not in fields and '*' not in fields:
+                fields = list(fields) + [self.unique_key]
+            params['fl'] = ','.join(fields)
+        params['wt'] = parse_xml_response.wt
+        static = _encode_params(params, self.arg_separator)
+        order = []
+
+        def chunks():
+            for chunk in _unique_chunks(ids, self.chunk_size):
+                order.extend(chunk)
+                yield chunk
+
+        def fetch(conn, chunk):
+            request = _encode_params({'id': chunk})
+            if static:
+                request += '&' + static
+            rsp, data = conn._post(self.selector, request, conn.form_headers)
+            response = parse_xml_response(StringIO(data), None, None)
+            if len(chunk) == 1 and hasattr(response, 'doc'):
+                # A single id is answered with a document, not a list.
+                return response.doc is not None and [response.doc] or []
+            return list(getattr(response, 'results', None) or [])
+
+        found = {}
+        for docs in self.conn.pool.map(fetch, chunks()):
+            for doc in docs:
+                found[unicode(doc[self.unique_key])] = doc
+        result = FetchedDocuments()
+        for id in order:
+            doc = found.get(unicode(id))
+            if doc is None:
+                result.missing.append(id)
+            else:
+                result[id] = doc
+        return result
@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+import urllib
+from collections import namedtuple
+from StringIO import StringIO
+
+from solr.core import SolrException, parse_xml_response
+
+__all__ = ['Reindexer', 'ReindexProgress', 'swap_cores']
+
+
+ReindexProgress = namedtuple(
+    'ReindexProgress', 'read written batches elapsed rate cursor_mark')
+
+
+# Fields maintained by Solr which must not be copied into another core.
+_INTERNAL_FIELDS = ('_version_', 'score')
+
+
+class Reindexer(object):
+    """
+    Copy the documents of one core into another.
+
+    Documents matching `q` are read from the `source` connection with a
+    cursor, in pages of `rows` documents sorted by `sort` (which must
+    include the unique key), passed through `transform`, and added to
+    the `target` connection in one request per page.  Pages are read in
+    order while up to `workers` earlier pages are being written, using
+    the target connection's pool.
+
+    For example:
+    >>> reindexer = solr.Reindexer(
+    ...     old, new, transform=upgrade, checkpoint='/var/tmp/reindex')
+    >>> reindexer.run()
+    >>> solr.swap_cores(admin, 'live', 'rebuild')
+
+    `fields`
+        Fields to copy; by default, all stored fields.  ``_version_``
+        and ``score`` are never copied.
+
+    `transform`
+        Called with each document; returns the document to add (which
+        may be the same dictionary, modified), or ``None`` to skip it.
+
+    `checkpoint`
+        Path of a file recording the cursor mark after the last page
+        known to be written, together with every page before it.  If
+        the file exists when `run` is called, reindexing resumes from
+        the recorded position; it is removed once reindexing completes.
+
+    `progress`
+        Called with a `ReindexProgress` after each page is written.
+
+    Other keyword arguments are passed to the source query.
+    """
+
+    def __init__(self, source, target, q='*:*', sort='id asc', rows=1000,
+                 fields=None, transform=None, workers=None, checkpoint=None,
+                 progress=None, **params):
+        self.source = source
+        self.target = target
+        self.q = q
+        self.sort = sort
+        self.rows = int(rows)
+        self.fields = fields
+        self.transform = transform
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.params = params
+
+    def run(self, commit=True):
+        """
+        Copy the documents, committing the target at the end if `commit`
+        is true, and return the final `ReindexProgress`.
+        """
+        cursor_mark = self._load_checkpoint()
+        pages = self.source.select.cursor(
+            self.q, sort=self.sort, cursor_mark=cursor_mark,
+            fields=self.fields, score=False, rows=self.rows, **self.params)
+
+        lock = threading.Lock()
+        started = time.time()
+        state = {'read': 0, 'written': 0, 'batches': 0,
+                 'done': {}, 'next': 0, 'cursor_mark': cursor_mark}
+
+        def batches():
+            # Consumed by the pool's threads one at a time.
+            for seq, response in enumerate(pages):
+                docs = self._prepare(response.results)
+                state['read'] += len(response.results)
+                yield seq, docs, getattr(response, 'nextCursorMark', None)
+
+        def write(conn, batch):
+            seq, docs, next_mark = batch
+            if docs:
+                conn.add_many(docs)
+            lock.acquire()
+            try:
+                state['written'] += len(docs)
+                state['batches'] += 1
+                # Only checkpoint a cursor mark once every page before it
+                # has been written.
+                state['done'][seq] = next_mark
+                advanced = False
+                while state['next'] in state['done']:
+                    mark = state['done'].pop(state['next'])
+                    state['next'] += 1
+                    if mark is not None:
+                        state['cursor_mark'] = mark
+                        advanced = True
+                if advanced:
+                    self._save_checkpoint(state['cursor_mark'])
+                report = self._report(state, started)
+                if self.progress is not None:
+                    self.progress(report)
+            finally:
+                lock.release()
+
+        self.target.pool.map(write, batches(), self.workers)
+        if commit:
+            self.target.commit()
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return self._report(state, started)
+
+    def _prepare(self, results):
+        docs = []
+        for doc in results:
+            doc = dict(doc)
+            for field in _INTERNAL_FIELDS:
+                doc.pop(field, None)
+            if self.transform is not None:
+                doc = self.transform(doc)
+            if doc is not None:
+                docs.append(doc)
+        return docs
+
+    def _report(self, state, started):
+        elapsed = time.time() - started
+        return ReindexProgress(
+            state['read'], state['written'], state['batches'], elapsed,
+            elapsed and state['written'] / elapsed or 0.0,
+            state['cursor_mark'])
+
+    def _load_checkpoint(self):
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return '*'
+        f = open(self.checkpoint)
+        try:
+            return f.read().strip() or '*'
+        finally:
+            f.close()
+
+    def _save_checkpoint(self, cursor_mark):
+        if self.checkpoint is None:
+            return
+        f = open(self.checkpoint + '.tmp', 'w')
+        try:
+            f.write(cursor_mark + '\n')
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        os.rename(self.checkpoint + '.tmp', self.checkpoint)
+
+
+def swap_cores(conn, core, other):
+    """
+    Swap the names of two cores using the CoreAdmin API, so that
+    requests to `core` are served by the index of `other` and vice
+    versa.  `conn` is a connection to the Solr server's base URL (such
+    as ``http://localhost:8983/solr``).
+    """
+    request = urllib.urlencode({'action': 'SWAP', 'core': core,
+                                'other': other, 'wt': 'standard'})
+    rsp, data = conn._post(conn.path + '/admin/cores', request,
+                           conn.form_headers)
+    response = parse_xml_response(StringIO(data), None, None)
+    status = response and response.header.get('status')
+    if status:
+        raise SolrException(rsp.status, "core swap failed", data)
+    return response
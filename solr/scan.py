@@ -0,0 +1,175 @@
+import threading
+from Queue import Queue, Full
+
+__all__ = ['partitioned_scan', 'split_ranges']
+
+
+# Strings are treated as numbers in this base to compute midpoints; code
+# points from the surrogate range up are clamped below it.
+_BASE = 0xD800
+
+
+def _string_value(s, width):
+    n = 0
+    for i in range(width):
+        if i < len(s):
+            n = n * _BASE + min(ord(s[i]), _BASE - 1)
+        else:
+            n = n * _BASE
+    return n
+
+
+def _midpoint(lo, hi):
+    if isinstance(lo, basestring):
+        width = max(len(lo), len(hi)) + 1
+        n = (_string_value(lo, width) + _string_value(hi, width)) // 2
+        chars = []
+        for i in range(width):
+            n, c = divmod(n, _BASE)
+            chars.append(unichr(c))
+        return u''.join(reversed(chars)).rstrip(u'\0')
+    if isinstance(lo, float) or isinstance(hi, float):
+        return (lo + hi) / 2.0
+    return (lo + hi) // 2
+
+
+def _term(value):
+    if isinstance(value, basestring):
+        return u'"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _filters(params):
+    fq = params.pop('fq', [])
+    if isinstance(fq, basestring):
+        fq = [fq]
+    return list(fq)
+
+
+def split_ranges(conn, field, partitions, q='*:*', max_probes=16, **params):
+    """
+    Return `partitions` filter queries on `field` which divide the
+    documents matching `q` into ranges of similar sizes.
+
+    The field must be single-valued, with string or numeric values.  The
+    boundaries are found by bisection with ``rows=0`` queries counting
+    the matches below a candidate value, at most `max_probes` per
+    boundary; the boundaries are searched for in parallel through the
+    connection's pool.  Other keyword arguments are added to each
+    query.
+    """
+    fq = _filters(params)
+
+    def first(conn, order):
+        response = conn.select(q, fields=field, score=False, rows=1,
+                               sort='%s %s' % (field, order), fq=fq, **params)
+        if response.results:
+            return response.results[0].get(field)
+
+    low, high = conn.pool.map(first, ('asc', 'desc'))
+    if low is None or high is None or low == high or partitions < 2:
+        return [u'%s:[* TO *]' % field]
+    if not isinstance(low, (basestring, int, long, float)):
+        raise ValueError("can't split values of %s" % type(low).__name__)
+
+    def count(conn, upper):
+        return conn.select(q, fields=field, score=False, rows=0,
+                           fq=fq + [u'%s:[* TO %s}' % (field, _term(upper))],
+                           **params).numFound
+
+    total = conn.select(q, fields=field, score=False, rows=0, fq=fq,
+                        **params).numFound
+    tolerance = total // (partitions * 20)
+
+    def boundary(conn, k):
+        target = total * k // partitions
+        lo, hi = low, high
+        mid = hi
+        for i in range(max_probes):
+            mid = _midpoint(lo, hi)
+            if mid == lo or mid == hi:
+                break
+            below = count(conn, mid)
+            if abs(below - target) <= tolerance:
+                break
+            if below < target:
+                lo = mid
+            else:
+                hi = mid
+        return mid
+
+    bounds = sorted(set(conn.pool.map(boundary, range(1, partitions))))
+    ranges = []
+    lower = '*'
+    for bound in bounds:
+        ranges.append(u'%s:[%s TO %s}' % (field, lower, _term(bound)))
+        lower = _term(bound)
+    ranges.append(u'%s:[%s TO *]' % (field, lower))
+    return ranges
+
+
+def partitioned_scan(conn, q='*:*', field='id', partitions=4, rows=1000,
+                     sort='id asc', fields=None, workers=None, **params):
+    """
+    Yield every document matching `q`, reading from several cursors in
+    parallel.
+
+    The documents are divided into `partitions` ranges of `field` (by
+    default, the unique key) using `split_ranges`, and each range is
+    read with a cursor over `sort` (which must include the unique key)
+    in pages of `rows`, from up to `workers` threads through the
+    connection's pool.  Documents are yielded as their pages arrive, so
+    the order is unspecified; documents with no value in `field` are
+    not included.  Other keyword arguments are added to each query.
+
+    For example:
+    >>> for doc in solr.partitioned_scan(conn, partitions=8, fields='id,title'):
+    ...     export(doc)
+    """
+    fq = _filters(params)
+    ranges = split_ranges(conn, field, partitions, q, fq=fq, **params)
+    workers = min(workers or conn.pool.size, conn.pool.size)
+    pages = Queue(workers * 2)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.isSet():
+            try:
+                pages.put(item, True, 0.1)
+                return
+            except Full:
+                pass
+
+    def scan(conn, fq_range):
+        for response in conn.select.cursor(q, sort=sort, fields=fields,
+                                           score=False, rows=rows,
+                                           fq=fq + [fq_range], **params):
+            if stopped.isSet():
+                return
+            if response.results:
+                put(response.results)
+
+    def run():
+        try:
+            conn.pool.map(scan, ranges, workers)
+        except Exception, e:
+            put(e)
+        put(done)
+
+    thread = threading.Thread(target=run, name='solrpy-scan')
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            for doc in item:
+                yield doc
+    finally:
+        stopped.set()
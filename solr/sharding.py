@@ -0,0 +1,400 @@
+import heapq
+import threading
+import zlib
+
+from solr.core import Solr, SearchHandler, Response, Results, \
+     _commit_query, _parallel_map
+from solr.util import MultiDict
+
+__all__ = ['ShardedSolr', 'ShardedSearchHandler']
+
+
+def crc32_hash(value):
+    """
+    Default routing hash: the CRC-32 of the UTF-8 encoding of `value`,
+    which is stable across processes and platforms.
+    """
+    return zlib.crc32(unicode(value).encode('utf-8')) & 0xffffffff
+
+
+class ShardedSolr(object):
+    """
+    Client for an index partitioned across several standalone Solr cores.
+
+    Each document is routed to one of the shards at `urls` by hashing
+    its `route_field` (by default, the `unique_key` field).  Updates are
+    grouped by shard, and the shards' requests are sent in parallel;
+    commits are sent only to the shards which have received writes
+    since they were last committed.  They are sent right away, even if
+    the shards coalesce commits (see `commit_interval`).
+
+    Queries through `select` are sent to every shard in parallel and the
+    results merged; see `ShardedSearchHandler`.
+
+    For example:
+    >>> index = solr.ShardedSolr(['http://solr1:8983/solr/part0',
+    ...                           'http://solr2:8983/solr/part1'])
+    >>> index.add_many(docs, commit=True)
+    >>> index.delete(ids=['doc-1', 'doc-2'])
+    >>> response = index.select('title:lucene', rows=20)
+
+    `hash_function`
+        Maps a routing value to a non-negative integer; the shard is
+        that number modulo the number of shards.  Defaults to
+        `crc32_hash`.
+
+    Remaining keyword arguments are passed to the `Solr` constructor
+    for each shard; the connections are available as `shards`.
+
+    If documents are routed by a field other than the unique key,
+    deletes by id are sent to every shard.
+    """
+
+    def __init__(self, urls, unique_key='id', route_field=None,
+                 hash_function=crc32_hash, **kwargs):
+        self.shards = [Solr(url, **kwargs) for url in urls]
+        assert self.shards
+        self.unique_key = unique_key
+        self.route_field = route_field or unique_key
+        self.hash_function = hash_function
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.select = ShardedSearchHandler(self)
+
+    def close(self):
+        """Close the connections to all shards."""
+        for shard in self.shards:
+            shard.close()
+
+    def shard_for(self, value):
+        """Return the index of the shard for the routing value `value`."""
+        return self.hash_function(value) % len(self.shards)
+
+    # Update interface.
+
+    def add(self, doc, **commit_args):
+        """
+        Add a document to the shard it is routed to.
+
+        Supports commit-control arguments.
+        """
+        return self.add_many((doc,), **commit_args)
+
+    def add_many(self, docs, batch_size=None, **commit_args):
+        """
+        Add several documents, sending each shard its documents in
+        parallel.  If `batch_size` is given, each shard receives its
+        documents in requests of at most that many.
+
+        Supports commit-control arguments; the commit is sent to every
+        shard with uncommitted writes.
+        """
+        groups = {}
+        for doc in docs:
+            index = self.shard_for(doc[self.route_field])
+            groups.setdefault(index, []).append(doc)
+
+        def send(index, shard, commit_args):
+            docs = groups[index]
+            size = batch_size or len(docs)
+            for start in xrange(0, len(docs) - size, size):
+                shard.add_many(docs[start:start + size])
+            start = (len(docs) - 1) // size * size
+            shard.add_many(docs[start:], **commit_args)
+
+        self._each(groups.keys(), send, commit_args)
+
+    def delete(self, id=None, ids=None, queries=None, **commit_args):
+        """
+        Delete documents by ids or queries, as for `Solr.delete`.  Ids
+        are sent to the shards they are routed to, and queries to every
+        shard.
+
+        Supports commit-control arguments; the commit is sent to every
+        shard with uncommitted writes.
+        """
+        groups = {}
+        keys = []
+        if id is not None:
+            keys.append(id)
+        keys.extend(ids or ())
+        queries = list(queries or ())
+        if queries or (keys and self.route_field != self.unique_key):
+            for index in range(len(self.shards)):
+                groups[index] = keys
+        else:
+            for key in keys:
+                groups.setdefault(self.shard_for(key), []).append(key)
+
+        def send(index, shard, commit_args):
+            shard.delete(ids=groups[index], queries=queries, **commit_args)
+
+        self._each(groups.keys(), send, commit_args)
+
+    def delete_many(self, ids, **commit_args):
+        """
+        Delete documents using an iterable of ids.
+
+        Supports commit-control arguments.
+        """
+        self.delete(ids=ids, **commit_args)
+
+    def delete_query(self, query, **commit_args):
+        """
+        Delete the documents matching a query from every shard.
+
+        Supports commit-control arguments.
+        """
+        self.delete(queries=[query], **commit_args)
+
+    def commit(self, wait_flush=True, wait_searcher=True):
+        """
+        Commit the shards which have received writes since they were
+        last committed, in parallel.
+        """
+        self._each((), None, {'commit': True, 'wait_flush': wait_flush,
+                              'wait_searcher': wait_searcher})
+
+    def optimize(self, wait_flush=True, wait_searcher=True):
+        """Optimize every shard, in parallel."""
+        _parallel_map(
+            lambda shard: shard.optimize(wait_flush, wait_searcher),
+            self.shards, len(self.shards))
+
+    @property
+    def dirty(self):
+        """Indexes of the shards with uncommitted writes."""
+        return sorted(self._dirty)
+
+    def _each(self, indexes, send, commit_args):
+        # Call send(index, shard, commit_args) for the shards with the
+        # given indexes in parallel, passing on the commit-control
+        # arguments.  Shards with earlier uncommitted writes are
+        # committed too if a commit is requested.  A requested commit is
+        # issued directly, even by shards which defer their commits.
+        _commit_query(self.shards[0], dict(commit_args), strict=True)
+        optimize = commit_args.get('optimize')
+        committing = commit_args.get('commit') or optimize
+        indexes = set(indexes)
+
+        self._lock.acquire()
+        try:
+            if committing:
+                targets = indexes | self._dirty
+                self._dirty.clear()
+            else:
+                targets = indexes
+                self._dirty.update(indexes)
+        finally:
+            self._lock.release()
+
+        def call(index):
+            shard = self.shards[index]
+            direct = (committing and not optimize
+                      and shard.commits is not None)
+            try:
+                if index in indexes:
+                    send(index, shard, not direct and commit_args or {})
+                    if not direct:
+                        return
+                if optimize:
+                    shard.optimize(commit_args.get('wait_flush', True),
+                                   commit_args.get('wait_searcher', True))
+                else:
+                    shard.commit(commit_args.get('wait_flush', True),
+                                 commit_args.get('wait_searcher', True))
+            except:
+                # The shard may have received writes.
+                self._lock.acquire()
+                try:
+                    self._dirty.add(index)
+                finally:
+                    self._lock.release()
+                raise
+
+        targets = sorted(targets)
+        if targets:
+            _parallel_map(call, targets, len(targets))
+
+
+class _SortKey(object):
+    # Orders documents by the values of the sort fields, each ascending
+    # or descending, with missing values last.
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __cmp__(self, other):
+        for a, b, descending in zip(self.values, other.values,
+                                    self.descending):
+            if a == b:
+                continue
+            if a is None:
+                return 1
+            if b is None:
+                return -1
+            if descending:
+                return cmp(b, a)
+            return cmp(a, b)
+        return 0
+
+
+def _parse_sort(sort):
+    """
+    Return the ``(field, descending)`` pairs of a normalized sort
+    parameter, such as ``"price asc,score desc"``.
+    """
+    criteria = []
+    for clause in sort.split(','):
+        field, order = clause.strip().rsplit(None, 1)
+        criteria.append((field.strip(), order.lower() == 'desc'))
+    return criteria
+
+
+def _field_list(fields):
+    if not fields:
+        return ['*']
+    if isinstance(fields, basestring):
+        fields = fields.replace(',', ' ').split()
+    return list(fields)
+
+
+def _merge_counts(counts):
+    # Sum facet counts from several shards, ordered by decreasing count.
+    totals = {}
+    for shard_counts in counts:
+        for term, count in shard_counts.iteritems():
+            totals[term] = totals.get(term, 0) + count
+    return MultiDict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+class ShardedSearchHandler(object):
+    """
+    Query handler sending each query to every shard of a `ShardedSolr`
+    in parallel and merging the results, available as its `select`
+    attribute.
+
+    The arguments are those of `SearchHandler`.  Each shard is asked for
+    its first ``start + rows`` matches, which are merged by score (or by
+    the `sort` fields, which must be plain fields or ``score``), and the
+    requested window of the merged list is returned as a `Response`.
+    ``numFound`` is the sum over the shards, ``maxScore`` the largest,
+    and the counts in ``facet_counts.facet_fields`` and
+    ``facet_counts.facet_queries`` are summed; other facet types aren't
+    merged.  Each shard only reports its own top terms, so merged facet
+    counts may omit terms in the long tail.
+    """
+
+    def __init__(self, index, relpath="/select"):
+        self.index = index
+        self.relpath = relpath
+
+    def __call__(self, q=None, fields=None, highlight=None,
+                 score=True, sort=None, sort_order="asc", **params):
+        start = int(params.pop('start', 0))
+        rows = int(params.pop('rows', 10))
+        requested = _field_list(fields)
+        fl = list(requested)
+        if sort:
+            # Normalize the sort as SearchHandler does, to find the
+            # fields needed for merging.
+            if isinstance(sort, basestring):
+                sort = [f.strip() for f in sort.split(",")]
+            sorting = []
+            for e in sort:
+                if not (e.endswith("asc") or e.endswith("desc")):
+                    e = "%s %s" % (e, sort_order)
+                sorting.append(e)
+            criteria = _parse_sort(",".join(sorting))
+        else:
+            criteria = [('score', True)]
+        added = []
+        if '*' not in fl:
+            for field, descending in criteria:
+                if field != 'score' and field not in fl:
+                    fl.append(field)
+                    added.append(field)
+        if not score and [f for f, d in criteria if f == 'score']:
+            added.append('score')
+
+        def search(shard):
+            handler = SearchHandler(shard, self.relpath)
+            return handler(q, fields=fl, highlight=highlight,
+                           score=score or 'score' in added, sort=sort,
+                           sort_order=sort_order, start=0,
+                           rows=start + rows, **params)
+
+        responses = _parallel_map(search, self.index.shards,
+                                  len(self.index.shards))
+        docs = self._merge(responses, criteria, start, rows)
+        for doc in docs:
+            for field in added:
+                doc.pop(field, None)
+
+        response = Response()
+        response.header = {'status': 0, 'QTime': max(
+            [r.header.get('QTime', 0) for r in responses if r is not None]
+            or [0])}
+        response.results = Results(docs)
+        response.results.numFound = response.numFound = sum(
+            [r.numFound for r in responses if r is not None])
+        response.results.start = response.start = start
+        scores = [r.maxScore for r in responses
+                  if r is not None and hasattr(r, '_maxScore')]
+        if scores:
+            response.maxScore = max(scores)
+        self._merge_extras(response, responses)
+        params.update({'q': q, 'fields': fields, 'highlight': highlight,
+                       'score': score, 'sort': sort, 'sort_order': sort_order,
+                       'start': start, 'rows': rows})
+        response._set_params(params, self)
+        return response
+
+    def _merge(self, responses, criteria, start, rows):
+        heap = []
+        for shard, response in enumerate(responses):
+            if response is not None and response.results:
+                heap.append(self._entry(response.results, shard, 0, criteria))
+        heapq.heapify(heap)
+        docs = []
+        while heap and len(docs) < start + rows:
+            key, shard, position, doc = heapq.heappop(heap)
+            docs.append(doc)
+            results = responses[shard].results
+            if position + 1 < len(results):
+                heapq.heappush(heap, self._entry(results, shard, position + 1,
+                                                 criteria))
+        return docs[start:]
+
+    def _entry(self, results, shard, position, criteria):
+        doc = results[position]
+        key = _SortKey([doc.get(field) for field, descending in criteria],
+                       [descending for field, descending in criteria])
+        return key, shard, position, doc
+
+    def _merge_extras(self, response, responses):
+        facets = [r.facet_counts for r in responses
+                  if r is not None and hasattr(r, 'facet_counts')]
+        if facets:
+            merged = MultiDict()
+            for name in ('facet_queries', 'facet_fields'):
+                sections = [f[name] for f in facets if name in f]
+                if not sections:
+                    continue
+                if name == 'facet_queries':
+                    merged[name] = _merge_counts(sections)
+                else:
+                    fields = MultiDict()
+                    for field in set([k for s in sections for k in s.keys()]):
+                        fields[field] = _merge_counts(
+                            [s[field] for s in sections if field in s])
+                    merged[name] = fields
+            response.facet_counts = merged
+        highlights = [r.highlighting for r in responses
+                      if r is not None and hasattr(r, 'highlighting')]
+        if highlights:
+            response.highlighting = MultiDict()
+            for highlighting in highlights:
+                response.highlighting.update(highlighting)
@@ -0,0 +1,400 @@
+import os
+import socket
+import struct
+import httplib
+import logging
+import threading
+import time
+import urllib
+import urlparse
+import zlib
+
+from solr.core import SolrException, Updater, _commit_query
+
+__all__ = ['UpdateSpool', 'SpoolFullError']
+
+
+class SpoolFullError(IOError):
+    """Raised when appending to a spool would exceed its size limit."""
+    pass
+
+
+_HEADER = struct.Struct('>II')
+
+
+class UpdateSpool(object):
+    """
+    Write-ahead spool for update requests.
+
+    Updates are serialized and appended to segment files in `directory`,
+    and the call returns as soon as the update is on disk; a background
+    thread replays the spooled updates to Solr in order, retrying while
+    Solr can't be reached.  Fully delivered segments are removed.
+
+    For example:
+    >>> conn = solr.Solr('http://localhost:8983/solr')
+    >>> spool = solr.UpdateSpool(conn, '/var/spool/solrpy')
+    >>> spool.add_many(docs, commit=True)
+    >>> spool.close(drain=True)
+
+    `segment_size`
+        Size, in bytes, after which a new segment file is started.
+
+    `max_bytes`
+        Maximum size of undelivered data kept on disk; appending more
+        raises `SpoolFullError`.  ``None`` disables the limit.
+
+    `fsync`
+        When appended data is forced to disk: ``"always"`` (before each
+        append returns), ``"never"`` (left to the operating system), or a
+        number of seconds which may elapse between forced writes.
+
+    `retry_interval`
+        Seconds to wait before re-sending an update after a connection
+        error or a server error (HTTP 5xx).
+
+    Updates which Solr rejects otherwise are logged, counted in
+    `rejected` and skipped.  If the background thread stops on an
+    unexpected error, the error is kept in `error` and raised by
+    `close`.  Delivery is at-least-once: an update may be
+    sent again if the process stops just after it was delivered.
+    """
+
+    def __init__(self, conn, directory, segment_size=16 * 1024 * 1024,
+                 max_bytes=1024 * 1024 * 1024, fsync="always",
+                 retry_interval=5.0, start=True):
+        if fsync not in ("always", "never"):
+            fsync = float(fsync)
+        self.conn = conn
+        self.directory = directory
+        self.segment_size = int(segment_size)
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.retry_interval = float(retry_interval)
+        self.delivered = 0
+        self.rejected = 0
+        self.error = None
+        self._updater = Updater(conn)
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = None
+        self._sizes = {}
+        self._last_sync = 0.0
+        self._reader = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+        if start:
+            self.start()
+
+    # Producer interface.
+
+    def add(self, doc, **commit_args):
+        """
+        Spool the addition of a single document.
+
+        Supports commit-control arguments, applied when the update is
+        delivered.
+        """
+        return self.add_many((doc,), **commit_args)
+
+    def add_many(self, docs, **commit_args):
+        """
+        Spool the addition of several documents.
+
+        Supports commit-control arguments, applied when the update is
+        delivered.
+        """
+        query, scheduler = _commit_query(self.conn, commit_args, strict=True)
+        self.append(self._updater._add_xml(docs), query,
+                    scheduler is not None)
+
+    def delete(self, id=None, ids=None, queries=None, **commit_args):
+        """
+        Spool the deletion of documents by ids or queries, as for
+        `Solr.delete`.
+
+        Supports commit-control arguments, applied when the update is
+        delivered.
+        """
+        query, scheduler = _commit_query(self.conn, commit_args, strict=True)
+        content = self.conn._delete(id=id, ids=ids, queries=queries)
+        if content:
+            self.append(content, query, scheduler is not None)
+
+    def append(self, content, query=None, schedule_commit=False):
+        """
+        Spool an update request body, to be posted to ``/update`` with
+        the parameters in the `query` mapping.
+        """
+        payload = '%s%s\n%s' % (
+            schedule_commit and 'S' or '-',
+            urllib.urlencode(sorted((query or {}).items())),
+            content.encode('utf-8'))
+        record = _HEADER.pack(len(payload),
+                              zlib.crc32(payload) & 0xffffffff) + payload
+
+        self._cond.acquire()
+        try:
+            if self._closing:
+                raise ValueError("spool is closed")
+            if (self.max_bytes is not None
+                    and self.pending_bytes + len(record) > self.max_bytes):
+                raise SpoolFullError(
+                    "spool %s would exceed %d bytes"
+                    % (self.directory, self.max_bytes))
+            if self._sizes[self._write_seg] >= self.segment_size:
+                self._roll()
+            self._writer.write(record)
+            self._writer.flush()
+            self._sync()
+            self._sizes[self._write_seg] += len(record)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    @property
+    def pending_bytes(self):
+        """Number of bytes on disk not yet delivered."""
+        seg, offset = self._read_pos
+        return sum(self._sizes.values()) - offset
+
+    # Drainer control.
+
+    def start(self):
+        """Start the background thread delivering spooled updates."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._drain,
+                                            name='solrpy-spool')
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Wait until all spooled updates have been delivered, until
+        `timeout` seconds have passed, or until the background thread
+        stops.  Returns true if the spool is empty.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while self._has_pending():
+                if (self.error is not None or self._thread is None
+                        or not self._thread.isAlive()):
+                    break
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            return not self._has_pending()
+        finally:
+            self._cond.release()
+
+    def close(self, drain=False, timeout=None):
+        """
+        Stop the background thread and close the spool files.
+
+        If `drain` is true, wait for spooled updates to be delivered
+        first, for at most `timeout` seconds if given.  Undelivered
+        updates remain on disk and are replayed when a spool is next
+        opened on the same directory.
+
+        If the background thread stopped on an error, it is raised once
+        the spool is closed.
+        """
+        if drain:
+            self.start()
+            self.wait(timeout)
+        self._cond.acquire()
+        try:
+            self._closing = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self.fsync != "never":
+            os.fsync(self._writer.fileno())
+        self._writer.close()
+        if self.error is not None:
+            raise self.error
+
+    # Segment files.
+
+    def _path(self, seg):
+        return os.path.join(self.directory, '%020d.seg' % seg)
+
+    def _recover(self):
+        segments = sorted([int(name[:-4]) for name in os.listdir(self.directory)
+                           if name.endswith('.seg') and name[:-4].isdigit()])
+        try:
+            f = open(os.path.join(self.directory, 'checkpoint'))
+            try:
+                seg, offset = [int(x) for x in f.read().split()]
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            seg, offset = segments and segments[0] or 0, 0
+        for s in segments:
+            if s < seg:
+                os.remove(self._path(s))
+            else:
+                self._sizes[s] = os.path.getsize(self._path(s))
+        if seg not in self._sizes:
+            seg, offset = min(self._sizes.keys() or [seg]), 0
+        self._read_pos = (seg, offset)
+        # Appends always go to a new segment; a torn record at the end of
+        # the previous one is detected by its length or checksum.
+        self._write_seg = max(self._sizes.keys() or [seg - 1]) + 1
+        self._writer = open(self._path(self._write_seg), 'ab')
+        self._sizes[self._write_seg] = 0
+
+    def _roll(self):
+        if self.fsync != "never":
+            os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._write_seg += 1
+        self._writer = open(self._path(self._write_seg), 'ab')
+        self._sizes[self._write_seg] = 0
+
+    def _sync(self):
+        if self.fsync == "always":
+            os.fsync(self._writer.fileno())
+        elif self.fsync != "never":
+            now = time.time()
+            if now - self._last_sync >= self.fsync:
+                os.fsync(self._writer.fileno())
+                self._last_sync = now
+
+    def _has_pending(self):
+        seg, offset = self._read_pos
+        return seg < self._write_seg or offset < self._sizes[seg]
+
+    def _checkpoint(self):
+        path = os.path.join(self.directory, 'checkpoint')
+        f = open(path + '.tmp', 'w')
+        try:
+            f.write('%d %d\n' % self._read_pos)
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def _next_record(self):
+        # Return the next complete record as (next offset, payload), or
+        # None after moving past a finished segment.  Called without the
+        # lock held, so it only reads what was known to be written.
+        self._cond.acquire()
+        try:
+            seg, offset = self._read_pos
+            size = self._sizes[seg]
+            sealed = seg < self._write_seg
+        finally:
+            self._cond.release()
+
+        payload = None
+        if offset + _HEADER.size <= size:
+            if self._reader is None:
+                self._reader = open(self._path(seg), 'rb')
+            self._reader.seek(offset)
+            length, crc = _HEADER.unpack(self._reader.read(_HEADER.size))
+            if offset + _HEADER.size + length <= size:
+                payload = self._reader.read(length)
+                if zlib.crc32(payload) & 0xffffffff == crc:
+                    return offset + _HEADER.size + length, payload
+        if not sealed:
+            return None
+        if offset < size:
+            logging.error("solrpy spool: discarding %d corrupt bytes at the "
+                          "end of %s", size - offset, self._path(seg))
+        self._finish_segment(seg)
+        return None
+
+    def _finish_segment(self, seg):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self._cond.acquire()
+        try:
+            del self._sizes[seg]
+            self._read_pos = (seg + 1, 0)
+            self._checkpoint()
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        os.remove(self._path(seg))
+
+    def _drain(self):
+        try:
+            self._deliver_all()
+        except Exception, e:
+            logging.exception("solrpy spool: delivery stopped")
+            self._cond.acquire()
+            try:
+                self.error = e
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+
+    def _deliver_all(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._closing and not self._has_pending():
+                    self._cond.wait()
+                if self._closing:
+                    return
+            finally:
+                self._cond.release()
+
+            record = self._next_record()
+            if record is None:
+                continue
+            end, payload = record
+            if self._deliver(payload):
+                self._cond.acquire()
+                try:
+                    self._read_pos = (self._read_pos[0], end)
+                    self._checkpoint()
+                    self._cond.notifyAll()
+                finally:
+                    self._cond.release()
+            else:
+                self._cond.acquire()
+                try:
+                    if not self._closing:
+                        self._cond.wait(self.retry_interval)
+                finally:
+                    self._cond.release()
+
+    def _deliver(self, payload):
+        # Returns false if the update should be retried.
+        flag = payload[0]
+        qs, body = payload[1:].split('\n', 1)
+        query = dict(urlparse.parse_qsl(qs))
+        try:
+            self.conn._update(body.decode('utf-8'), query)
+        except SolrException, e:
+            if e.httpcode >= 500:
+                logging.warning("solrpy spool: delivery failed: %s", e)
+                return False
+            logging.error("solrpy spool: update rejected: %s", e)
+            self.rejected += 1
+            return True
+        except (socket.error, httplib.HTTPException), e:
+            logging.warning("solrpy spool: delivery failed: %s", e)
+            return False
+        self.delivered += 1
+        if flag == 'S' and self.conn.commits is not None:
+            self.conn.commits.schedule()
+        return True
@@ -0,0 +1,296 @@
+import json
+from collections import namedtuple
+
+from solr.core import SolrException, _encode_params
+
+__all__ = ['ExportHandler', 'StreamHandler', 'SQLHandler', 'TupleStream']
+
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _JSONReader(object):
+    # Incremental reader for a JSON document arriving in blocks of bytes.
+    # Values are decoded one at a time as soon as they are complete, so
+    # only the value being read is held in memory.
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self._eof:
+            return False
+        try:
+            block = self._blocks.next()
+        except StopIteration:
+            self._eof = True
+            return False
+        if self._pos > len(self._buffer) // 2:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += block
+        return True
+
+    def peek(self):
+        """Return the next significant character, or '' at the end."""
+        while True:
+            while (self._pos < len(self._buffer)
+                   and self._buffer[self._pos] in _WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("expected %r at offset %d of the response, "
+                             "found %r" % (chars, self._pos, c))
+        self._pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next
+            # block.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """Yield the keys of the object starting here, leaving the reader
+        positioned at each key's value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Yield the values of the array starting here."""
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+class TupleStream(object):
+    """
+    Iterator over the tuples of a streaming response, read from the
+    socket as they are needed.
+
+    Values found in the response outside the tuples, such as
+    ``numFound``, are available from the `meta` dictionary once they
+    have been read.  If the tuples aren't all consumed, call `close` to
+    release the connection.
+
+    If `eof` is true, the stream ends with a tuple with an ``EOF``
+    field, which isn't yielded; its fields (such as ``RESPONSE_TIME``)
+    are added to `meta`.
+    """
+
+    def __init__(self, blocks, path, convert=None, eof=False):
+        self._blocks = blocks
+        self._reader = _JSONReader(blocks)
+        self._path = path
+        self._convert = convert
+        self._eof = eof
+        self.meta = {}
+        self._tuples = self._read()
+
+    @property
+    def response_time(self):
+        """
+        Milliseconds taken by Solr to produce the stream, as reported in
+        the ``EOF`` tuple, or ``None`` before it has been read.
+        """
+        return self.meta.get('RESPONSE_TIME')
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._tuples.next()
+
+    def close(self):
+        """Stop reading the response."""
+        self._tuples.close()
+        if hasattr(self._blocks, 'close'):
+            self._blocks.close()
+
+    def _read(self):
+        done = False
+        try:
+            for item in self._walk(self._path, self.meta):
+                if 'EXCEPTION' in item:
+                    raise SolrException(500, item['EXCEPTION'])
+                if done:
+                    continue
+                if self._eof and item.get('EOF'):
+                    # The rest of the response is read, but not yielded,
+                    # so that the connection can be reused.
+                    self.meta.update(item)
+                    done = True
+                    continue
+                if self._convert is not None:
+                    item = self._convert(item)
+                yield item
+        finally:
+            if hasattr(self._blocks, 'close'):
+                self._blocks.close()
+
+    def _walk(self, path, meta):
+        # Descend through the objects named by `path` to the array of
+        # tuples, collecting the other values along the way.
+        for key in self._reader.items():
+            if key != path[0]:
+                meta[key] = self._reader.value()
+            elif len(path) == 1:
+                for item in self._reader.elements():
+                    yield item
+            else:
+                for item in self._walk(path[1:], meta):
+                    yield item
+        header = meta.get('responseHeader') or {}
+        if header.get('status'):
+            raise SolrException(header['status'], repr(meta.get('error')))
+
+
+class _StreamingHandler(object):
+
+    def __init__(self, conn, relpath, arg_separator="_"):
+        self.conn = conn
+        self.selector = conn.path + relpath
+        self.arg_separator = arg_separator
+
+    def _stream(self, params):
+        return self.conn._post_stream(
+            self.selector, _encode_params(params, self.arg_separator),
+            self.conn.form_headers)
+
+
+class ExportHandler(_StreamingHandler):
+    """
+    Client for Solr's ``/export`` handler, which streams all the matches
+    of a query, sorted, with values taken from docValues fields.
+
+    Each match is yielded as a record with the requested `fields` as
+    attributes, in order (a named tuple, or a plain tuple if `tuples`
+    is true); fields with no value are ``None``.  The response is parsed
+    as it arrives, so memory use doesn't depend on the number of
+    matches.
+
+    For example:
+    >>> export = solr.ExportHandler(conn)
+    >>> for row in export('*:*', fields=['id', 'price'], sort='id asc'):
+    ...     print row.id, row.price
+    """
+
+    def __init__(self, conn, relpath="/export", arg_separator="_"):
+        _StreamingHandler.__init__(self, conn, relpath, arg_separator)
+
+    def __call__(self, q='*:*', fields=None, sort=None, tuples=False,
+                 **params):
+        """
+        Return a `TupleStream` of the matches of `q`.  `fields` and
+        `sort` are required by Solr; `fields` is a list of field names
+        or a comma-separated string.  The ``numFound`` value of the
+        response is available in the stream's `meta` dictionary once
+        the first match has been read.
+        """
+        if not fields or not sort:
+            raise ValueError("fields and sort are required for export")
+        if isinstance(fields, basestring):
+            fields = [f for f in fields.replace(',', ' ').split()]
+        fields = list(fields)
+        if isinstance(sort, (list, tuple)):
+            sort = ','.join(sort)
+        params.update({'q': q, 'fl': ','.join(fields), 'sort': sort,
+                       'wt': 'json'})
+
+        if tuples:
+            def convert(doc):
+                return tuple([doc.get(field) for field in fields])
+        else:
+            record = namedtuple('ExportRecord', fields, rename=True)
+
+            def convert(doc):
+                return record._make([doc.get(field) for field in fields])
+
+        return TupleStream(self._stream(params), ('response', 'docs'), convert)
+
+
+class StreamHandler(_StreamingHandler):
+    """
+    Client for Solr's ``/stream`` handler, which evaluates a streaming
+    expression on the server.
+
+    The tuples of the result are yielded as dictionaries, parsed as
+    they arrive.  An ``EXCEPTION`` tuple raises `SolrException`; the
+    ``RESPONSE_TIME`` reported at the end is available from the
+    stream's `response_time` attribute.
+
+    For example:
+    >>> stream = solr.StreamHandler(conn)
+    >>> totals = stream('rollup(search(sales, q="*:*", fl="region,amount", '
+    ...                 'sort="region asc", qt="/export"), over="region", '
+    ...                 'sum(amount))')
+    >>> for row in totals:
+    ...     print row['region'], row['sum(amount)']
+    """
+
+    def __init__(self, conn, relpath="/stream", arg_separator="_"):
+        _StreamingHandler.__init__(self, conn, relpath, arg_separator)
+
+    def __call__(self, expr, **params):
+        """Return a `TupleStream` of the result of the expression `expr`."""
+        params.update({'expr': expr, 'wt': 'json'})
+        return TupleStream(self._stream(params), ('result-set', 'docs'),
+                           eof=True)
+
+
+class SQLHandler(_StreamingHandler):
+    """
+    Client for Solr's ``/sql`` handler.
+
+    Rows are yielded as dictionaries keyed by the selected column names,
+    as for `StreamHandler`.
+
+    For example:
+    >>> sql = solr.SQLHandler(conn)
+    >>> for row in sql('SELECT region, sum(amount) FROM sales GROUP BY region',
+    ...                aggregationMode='facet'):
+    ...     print row
+    """
+
+    def __init__(self, conn, relpath="/sql", arg_separator="_"):
+        _StreamingHandler.__init__(self, conn, relpath, arg_separator)
+
+    def __call__(self, stmt, **params):
+        """Return a `TupleStream` of the rows selected by `stmt`."""
+        params.update({'stmt': stmt, 'wt': 'json'})
+        return TupleStream(self._stream(params), ('result-set', 'docs'),
+                           eof=True)
@@ -7,8 +7,17 @@ Meant to be run against Solr 1.2+.
 """
 
 # stdlib
+import os
+import re
+import cgi
+import array
+import shutil
 import socket
+import tempfile
+import threading
+import BaseHTTPServer
 import datetime
+import time
 import unittest
 import httplib
 from string import digits
@@ -146,6 +155,49 @@ class RequestTracking(SolrConnectionTestCase):
         return self._update[0][2]
 
 
+class PostTracking(SolrConnectionTestCase):
+    """ Mix in request capture for tests which don't need a Solr server.
+
+    Requests are not sent; the selector and body of each request made
+    through ``_post`` or ``_post_chunked`` are appended to ``self.posts``,
+    and the result of ``respond`` (by default, an empty response) is
+    returned.
+
+    """
+
+    def new_connection(self, **kw):
+        conn = super(PostTracking, self).new_connection(**kw)
+        self.posts = []
+
+        def post(selector, body, headers):
+            self.posts.append((selector[len(SOLR_PATH):], body))
+            return self.respond(selector[len(SOLR_PATH):], body)
+
+        def post_chunked(selector, chunks, headers):
+            chunks = list(chunks)
+            self.chunks = len(chunks)
+            return post(selector, u"".join(chunks), headers)
+
+        conn._post = post
+        conn._post_chunked = post_chunked
+        return conn
+
+    def respond(self, selector, body):
+        return EmptyResponse(), EmptyResponse._empty_results
+
+
+class WithConnection(SolrConnectionTestCase):
+    """ Mix in a connection made by ``new_connection`` for each test, as
+    ``self.conn``, with the keyword arguments in ``connection_args``.
+    """
+
+    connection_args = {}
+
+    def setUp(self):
+        super(WithConnection, self).setUp()
+        self.conn = self.new_connection(**self.connection_args)
+
+
 class TestHTTPConnection(SolrConnectionTestCase):
 
     def test_connect(self):
@@ -1547,6 +1599,22 @@ class TestSolrAddingDocuments(SolrBased, RequestTracking, TestAddingDocuments):
         # for a searcher.
         self.assert_("<add>" in self.postbody())
 
+    def test_add_columns(self):
+        """ Add documents given as columns and commit them with the last
+        batch.
+        """
+        doc_count = 5
+        columns = {
+            "id": [get_rand_string() for x in range(doc_count)],
+            "user_id": [get_rand_string() for x in range(doc_count)],
+            "data": [get_rand_string() for x in range(doc_count)],
+            }
+        self.conn.add_columns(columns, batch_size=2, commit=True)
+        self.check_added(docs=[
+            dict(id=columns["id"][x], user_id=columns["user_id"][x],
+                 data=columns["data"][x])
+            for x in range(doc_count)])
+
     def test_add_many_waitflush_without_commit(self):
         docs = [get_rand_userdoc(), get_rand_userdoc()]
         self.assertRaises(
@@ -1752,5 +1820,2203 @@ class TestSolrRetries(SolrBased, TestRetries):
     pass
 
 
+class TestSolrAddColumns(SolrBased, WithConnection, PostTracking):
+
+    def test_add_columns_batches(self):
+        """ Columns are sent as batches of rows, with the commit collapsed
+        into the last request.
+        """
+        ids = [get_rand_string() for x in range(5)]
+        self.conn.add_columns({"id": ids}, batch_size=2, commit=True)
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/update", "/update", "/update?commit=true"])
+        self.assertEqual(self.posts[0][1],
+                         '<add><doc><field name="id">%s</field></doc>'
+                         '<doc><field name="id">%s</field></doc></add>'
+                         % tuple(ids[:2]))
+        self.assertEqual(self.posts[2][1].count("<doc>"), 1)
+
+    def test_add_columns_conversion(self):
+        """ Values are converted per column as for add_many, skipping
+        None values and expanding multi-valued cells.
+        """
+        self.conn.add_columns({
+            "flag": [True, False],
+            "when": [datetime.datetime(2012, 2, 22, tzinfo=solr.core.utc),
+                     None],
+            "count": array.array("i", [1, 2]),
+            "letters": [["a", "<b>"], []],
+            })
+        body = self.posts[0][1]
+        docs = body[len("<add>"):-len("</add>")].split("</doc>")[:-1]
+        self.assertTrue('<field name="flag">true</field>' in docs[0])
+        self.assertTrue('<field name="flag">false</field>' in docs[1])
+        self.assertTrue('<field name="when">2012-02-22T00:00:00Z</field>'
+                        in docs[0])
+        self.assertFalse('name="when"' in docs[1])
+        self.assertTrue('<field name="count">2</field>' in docs[1])
+        self.assertTrue('<field name="letters">a</field>'
+                        '<field name="letters">&lt;b&gt;</field>' in docs[0])
+        self.assertFalse('name="letters"' in docs[1])
+
+    def test_add_columns_mixed_types(self):
+        """ Values of another type than the first in a column are
+        converted and escaped as for add_many.
+        """
+        self.conn.add_columns({"price": [1, "<b>&", True, 2.5]})
+        self.assertEqual(self.posts[0][1],
+                         '<add><doc><field name="price">1</field></doc>'
+                         '<doc><field name="price">&lt;b&gt;&amp;</field></doc>'
+                         '<doc><field name="price">true</field></doc>'
+                         '<doc><field name="price">2.5</field></doc></add>')
+
+    def test_add_columns_unequal_lengths(self):
+        """ Columns of different lengths are rejected before sending
+        anything.
+        """
+        self.assertRaises(ValueError, self.conn.add_columns,
+                          {"id": ["1", "2"], "data": ["x"]})
+        self.assertEqual(self.posts, [])
+
+    def test_add_columns_empty(self):
+        """ No request is made when there are no rows, unless a commit is
+        requested.
+        """
+        self.conn.add_columns({"id": []})
+        self.assertEqual(self.posts, [])
+        self.conn.add_columns({"id": []}, commit=True)
+        self.assertEqual(self.posts, [("/update?commit=true", u"<add></add>")])
+
+    def test_add_columns_mixed_cells(self):
+        """ Single values and lists in one column are each serialized as
+        add_many does.
+        """
+        self.conn.add_columns({"tags": [["a", "b"], "cd", None, 5],
+                               "id": [1, [2, 3], "4", 4]})
+        docs = [{"tags": ["a", "b"], "id": 1}, {"tags": "cd", "id": [2, 3]},
+                {"id": "4"}, {"tags": 5, "id": 4}]
+        self.assertEqual(self.posts[0][1],
+                         solr.core.Updater(self.conn)._add_xml(docs))
+
+
+class ManualTimer(object):
+    """ Timer for CommitScheduler which only fires when told to.
+    """
+
+    def __init__(self, timers, interval, function):
+        self.interval = interval
+        self.function = function
+        self.cancelled = False
+        timers.append(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        if not self.cancelled:
+            self.function()
+
+
+class TestSolrCommitScheduling(SolrBased, PostTracking):
+
+    def scheduled_connection(self, mode):
+        conn = self.new_connection()
+        self.timers = []
+        conn.commits = solr.CommitScheduler(
+            conn, 5, mode, timer=lambda interval, function: ManualTimer(
+                self.timers, interval, function))
+        return conn
+
+    def test_commit_within(self):
+        """ Commits are converted to commitWithin in the default mode.
+        """
+        conn = self.new_connection(commit_interval=2.5)
+        conn.add(get_rand_userdoc(), commit=True)
+        conn.add(get_rand_userdoc(), commit=True)
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/update?commitWithin=2500"] * 2)
+        self.assertEqual(conn.commits.coalesced, 2)
+
+        conn.flush_commits()
+        self.assertEqual(self.posts[-1], ("/update", "<commit />"))
+        self.assertEqual(conn.commits.issued, 1)
+        self.assertEqual(conn.flush_commits(), None)
+
+    def test_coalesced_hard_commits(self):
+        """ Commits requested within an interval are coalesced into a
+        single commit issued by flush_commits.
+        """
+        conn = self.new_connection(commit_interval=3600, commit_mode="hard")
+        for x in range(3):
+            conn.add(get_rand_userdoc(), commit=True)
+        conn.delete(get_rand_string(), commit=True)
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/update"] * 4)
+        self.assertTrue(conn.commits.pending)
+
+        conn.flush_commits()
+        self.assertEqual(self.posts[-1], ("/update", "<commit />"))
+        self.assertEqual(conn.commits.requested, 4)
+        self.assertEqual(conn.commits.coalesced, 3)
+        self.assertFalse(conn.commits.pending)
+
+    def test_timed_soft_commit(self):
+        """ A soft commit is issued in the background after the interval.
+        """
+        conn = self.scheduled_connection("soft")
+        conn.add(get_rand_userdoc(), commit=True)
+        conn.add(get_rand_userdoc(), commit=True)
+        self.assertEqual(len(self.timers), 1)
+        self.timers[0].fire()
+        self.assertEqual(self.posts[-1],
+                         ("/update", '<commit  softCommit="true"/>'))
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(conn.commits.coalesced, 1)
+
+    def test_default_timer(self):
+        """ The default timer calls its function in the background.
+        """
+        called = threading.Event()
+        timer = solr.core._daemon_timer(0.01, called.set)
+        called.wait(10)
+        self.assertTrue(called.isSet())
+        self.assertTrue(timer.isDaemon())
+
+    def test_failed_commit_rescheduled(self):
+        """ A deferred commit which fails is retried after the interval.
+        """
+        conn = self.scheduled_connection("hard")
+        self.fail_commits = 1
+
+        def respond(selector, body):
+            if body.startswith("<commit") and self.fail_commits:
+                self.fail_commits -= 1
+                raise solr.SolrException(503, "unavailable")
+            return PostTracking.respond(self, selector, body)
+        self.respond = respond
+
+        conn.add(get_rand_userdoc(), commit=True)
+        self.assertEqual(len(self.timers), 1)
+        self.timers[0].fire()
+        self.assertTrue(conn.commits.pending)
+        self.assertEqual(conn.commits.issued, 0)
+        self.assertEqual(len(self.timers), 2)
+        self.assertEqual(self.timers[1].interval, 5)
+
+        self.timers[1].fire()
+        self.assertFalse(conn.commits.pending)
+        self.assertEqual(conn.commits.issued, 1)
+        self.assertEqual(self.posts[-1], ("/update", "<commit />"))
+
+    def test_optimize_not_deferred(self):
+        """ Optimize requests are sent immediately.
+        """
+        conn = self.new_connection(commit_interval=3600, commit_mode="hard")
+        conn.add(get_rand_userdoc(), optimize=True)
+        self.assertEqual(self.posts[0][0], "/update?optimize=true")
+        self.assertEqual(conn.commits.requested, 0)
+
+    def test_invalid_mode(self):
+        """ Unknown commit modes are rejected.
+        """
+        self.assertRaises(ValueError, self.new_connection,
+                          commit_interval=1, commit_mode="sometimes")
+
+
+class TestSolrAddManyBisect(SolrBased, WithConnection, PostTracking):
+
+    def respond(self, selector, body):
+        if "bad" in body:
+            raise solr.SolrException(400, "Bad Request")
+        return super(TestSolrAddManyBisect, self).respond(selector, body)
+
+    def make_docs(self, count, bad=()):
+        return [get_rand_userdoc(data=(i in bad and "bad" or None))
+                for i in range(count)]
+
+    def test_bisect_isolates_bad_documents(self):
+        """ Bad documents are isolated by bisection, the rest are added
+        and committed afterwards.
+        """
+        docs = self.make_docs(64, bad=(5, 40))
+        try:
+            self.conn.add_many_bisect(docs, commit=True)
+        except solr.SolrBatchException, e:
+            self.assertEqual([doc for doc, error in e.failures],
+                             [docs[5], docs[40]])
+            self.assertEqual(e.failures[0][1].httpcode, 400)
+        else:
+            self.fail("SolrBatchException not raised")
+
+        added = set()
+        for selector, body in self.posts[1:-1]:
+            if "bad" not in body:
+                added.update(parseString(body.encode("utf-8"))
+                             .getElementsByTagName("doc"))
+        self.assertEqual(len(added), 62)
+        # One request for the whole batch, one for each half, two for
+        # each of the five levels below for each bad document, and the
+        # commit.
+        self.assertEqual(len(self.posts), 1 + 2 + 2 * 5 * 2 + 1)
+        self.assertEqual(self.posts[-1], ("/update", "<commit />"))
+        self.assertEqual(self.posts[0][0], "/update?commit=true")
+        self.assertEqual(self.posts[1][0], "/update")
+
+    def test_bisect_max_depth(self):
+        """ At the maximum depth, the whole failing sub-batch is reported.
+        """
+        docs = self.make_docs(8, bad=(0,))
+        try:
+            self.conn.add_many_bisect(docs, max_depth=1)
+        except solr.SolrBatchException, e:
+            self.assertEqual([doc for doc, error in e.failures], docs[:4])
+        else:
+            self.fail("SolrBatchException not raised")
+        self.assertEqual(len(self.posts), 3)
+
+    def test_bisect_no_failures(self):
+        """ A good batch is sent in a single request.
+        """
+        self.conn.add_many_bisect(self.make_docs(10), commit=True)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.posts[0][0], "/update?commit=true")
+
+    def test_bisect_other_errors(self):
+        """ Errors other than bad requests are not bisected.
+        """
+        def respond(selector, body):
+            raise solr.SolrException(503, "Service Unavailable")
+        self.respond = respond
+        self.assertRaises(solr.SolrException, self.conn.add_many_bisect,
+                          self.make_docs(10))
+        self.assertEqual(len(self.posts), 1)
+
+    def test_add_many_bisect_flag(self):
+        """ add_many bisects a rejected batch when asked to.
+        """
+        docs = self.make_docs(8, bad=(3,))
+        try:
+            self.conn.add_many(docs, bisect=True)
+        except solr.SolrBatchException, e:
+            self.assertEqual([doc for doc, error in e.failures], [docs[3]])
+        else:
+            self.fail("SolrBatchException not raised")
+        # The whole batch, then two requests at each of three levels.
+        self.assertEqual(len(self.posts), 1 + 2 * 3)
+
+    def test_add_many_no_bisect(self):
+        """ Without the flag, add_many raises the error of the request.
+        """
+        docs = self.make_docs(8, bad=(3,))
+        try:
+            self.conn.add_many(docs)
+        except solr.SolrBatchException:
+            self.fail("SolrBatchException raised")
+        except solr.SolrException, e:
+            self.assertEqual(e.httpcode, 400)
+        else:
+            self.fail("SolrException not raised")
+        self.assertEqual(len(self.posts), 1)
+
+    def test_unexpected_arguments(self):
+        """ Unknown keyword arguments are rejected before any request.
+        """
+        self.assertRaises(TypeError, self.conn.add_many_bisect,
+                          self.make_docs(2), commit=True, flush=True)
+        self.assertEqual(self.posts, [])
+
+
+class TestSolrUpdateSpool(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrUpdateSpool, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.failures = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestSolrUpdateSpool, self).tearDown()
+
+    def respond(self, selector, body):
+        if self.failures:
+            self.failures -= 1
+            raise socket.error("Connection refused")
+        return super(TestSolrUpdateSpool, self).respond(selector, body)
+
+    def segments(self):
+        return sorted([name for name in os.listdir(self.directory)
+                       if name.endswith(".seg")])
+
+    def test_spool_delivers_in_order(self):
+        """ Spooled updates are delivered in order by the drainer.
+        """
+        spool = solr.UpdateSpool(self.conn, self.directory)
+        docs = [get_rand_userdoc() for x in range(5)]
+        for doc in docs:
+            spool.add(doc)
+        spool.delete(docs[0]["id"], commit=True)
+        spool.close(drain=True)
+
+        self.assertEqual(len(self.posts), 6)
+        for doc, (selector, body) in zip(docs, self.posts):
+            self.assertTrue(doc["id"] in body)
+        self.assertEqual(self.posts[-1][0], "/update?commit=true")
+        self.assertEqual(spool.delivered, 6)
+
+    def test_spool_retries_outage(self):
+        """ Updates are retried until Solr can be reached.
+        """
+        self.failures = 3
+        spool = solr.UpdateSpool(self.conn, self.directory,
+                                 retry_interval=0.01)
+        spool.add(get_rand_userdoc())
+        self.assertTrue(spool.wait(5))
+        spool.close()
+        self.assertEqual(len(self.posts), 4)
+        self.assertEqual(spool.delivered, 1)
+
+    def test_spool_replay_after_reopen(self):
+        """ Undelivered updates are replayed by a new spool on the same
+        directory, and delivered segments are removed.
+        """
+        spool = solr.UpdateSpool(self.conn, self.directory, segment_size=1,
+                                 start=False)
+        for x in range(3):
+            spool.add(get_rand_userdoc())
+        spool.close()
+        self.assertEqual(len(self.segments()), 3)
+        self.assertEqual(self.posts, [])
+
+        spool = solr.UpdateSpool(self.conn, self.directory)
+        spool.close(drain=True)
+        self.assertEqual(len(self.posts), 3)
+        # Only the (empty) segment for new appends is left.
+        self.assertEqual(len(self.segments()), 1)
+
+        spool = solr.UpdateSpool(self.conn, self.directory)
+        spool.close(drain=True)
+        self.assertEqual(len(self.posts), 3)
+
+    def test_spool_discards_torn_record(self):
+        """ A partially written record at the end of a segment is skipped.
+        """
+        spool = solr.UpdateSpool(self.conn, self.directory, start=False)
+        spool.add(get_rand_userdoc())
+        spool.close()
+        f = open(os.path.join(self.directory, self.segments()[0]), "ab")
+        f.write("\0\0\1\0partial")
+        f.close()
+
+        spool = solr.UpdateSpool(self.conn, self.directory)
+        spool.add(get_rand_userdoc())
+        spool.close(drain=True)
+        self.assertEqual(len(self.posts), 2)
+
+    def test_spool_full(self):
+        """ Appending beyond max_bytes raises SpoolFullError.
+        """
+        spool = solr.UpdateSpool(self.conn, self.directory, max_bytes=300,
+                                 start=False)
+        spool.add(get_rand_userdoc())
+        self.assertRaises(solr.SpoolFullError, spool.add_many,
+                          [get_rand_userdoc() for x in range(5)])
+        spool.close()
+
+    def test_drainer_error(self):
+        """ close(drain=True) raises the error which stopped the drainer
+        instead of waiting for it.
+        """
+        def respond(selector, body):
+            raise ValueError("unexpected")
+        self.respond = respond
+        spool = solr.UpdateSpool(self.conn, self.directory)
+        spool.add(get_rand_userdoc())
+        self.assertFalse(spool.wait())
+        self.assertRaises(ValueError, spool.close, drain=True)
+        self.assertTrue(isinstance(spool.error, ValueError))
+        self.assertEqual(len(self.segments()), 1)
+
+
+class TestSolrAddBatches(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrAddBatches, self).setUp()
+        self.failures = 0
+
+    def respond(self, selector, body):
+        if self.failures:
+            self.failures -= 1
+            raise solr.SolrException(503, "Service Unavailable")
+        return super(TestSolrAddBatches, self).respond(selector, body)
+
+    def test_fixed_batch_size(self):
+        """ Documents from an iterator are sent in fixed-size batches,
+        with the commit in the last request.
+        """
+        docs = (get_rand_userdoc() for x in range(7))
+        self.conn.add_batches(docs, batch_size=3, commit=True)
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/update", "/update", "/update?commit=true"])
+        self.assertEqual([body.count("<doc>") for selector, body in self.posts],
+                         [3, 3, 1])
+
+    def test_adaptive_increase(self):
+        """ Fast requests make batches grow, up to the bounds.
+        """
+        controller = solr.AdaptiveBatchSize(docs=2, docs_step=2, max_docs=5,
+                                            target_latency=60)
+        self.conn.add_batches((get_rand_userdoc() for x in range(20)),
+                              controller)
+        self.assertEqual([body.count("<doc>") for selector, body in self.posts],
+                         [2, 4, 5, 5, 4])
+        self.assertEqual(controller.docs, 5)
+        self.assertEqual(len(controller.decisions), 5)
+        self.assertEqual(controller.decisions[0].action, "increase")
+
+    def test_adaptive_error(self):
+        """ A failed batch halves the batch size and is re-sent in smaller
+        batches.
+        """
+        self.failures = 1
+        controller = solr.AdaptiveBatchSize(docs=8, target_latency=60)
+        self.conn.add_batches([get_rand_userdoc() for x in range(8)],
+                              controller, commit=True)
+        self.assertEqual([body.count("<doc>") for selector, body in self.posts],
+                         [8, 4, 4])
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/update?commit=true", "/update",
+                          "/update?commit=true"])
+        self.assertEqual(controller.decisions[0].action, "decrease")
+        self.assertEqual(controller.error_rate, 1.0 / 3)
+
+    def test_adaptive_error_limit(self):
+        """ Errors are raised after max_retries failures in a row.
+        """
+        self.failures = 10
+        self.assertRaises(solr.SolrException, self.conn.add_batches,
+                          [get_rand_userdoc() for x in range(8)])
+        self.assertEqual(len(self.posts), 4)
+
+    def test_size_in_bytes(self):
+        """ Batch sizes are measured in encoded bytes.
+        """
+        doc = {"id": u"\u00e9" * 50}
+        part = u'<doc><field name="id">%s</field></doc>' % doc["id"]
+        controller = solr.AdaptiveBatchSize(
+            docs=10, size=len(part.encode("utf-8")), min_size=1,
+            target_latency=60, size_step=0)
+        self.conn.add_batches([doc, doc], controller)
+        self.assertEqual([body.count("<doc>") for selector, body in self.posts],
+                         [1, 1])
+        self.assertEqual(controller.decisions[0].size,
+                         len(part.encode("utf-8")))
+
+    def test_connection_errors_not_retried(self):
+        """ Connection errors, retried by the connection, are raised.
+        """
+        def respond(selector, body):
+            raise socket.error("Connection refused")
+        self.respond = respond
+        controller = solr.AdaptiveBatchSize(docs=8, target_latency=60)
+        self.assertRaises(socket.error, self.conn.add_batches,
+                          [get_rand_userdoc() for x in range(8)], controller)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(controller.error_rate, 1.0)
+
+    def test_bisect(self):
+        """ Rejected batches are bisected when asked to.
+        """
+        def respond(selector, body):
+            if "bad" in body:
+                raise solr.SolrException(400, "Bad Request")
+            return TestSolrAddBatches.respond(self, selector, body)
+        self.respond = respond
+        docs = [get_rand_userdoc(data=(i == 5 and "bad" or None))
+                for i in range(8)]
+        try:
+            self.conn.add_batches(docs, batch_size=4, bisect=True)
+        except solr.SolrBatchException, e:
+            self.assertEqual([doc for doc, error in e.failures], [docs[5]])
+        else:
+            self.fail("SolrBatchException not raised")
+        # The first batch, then the second and two levels of halves.
+        self.assertEqual(len(self.posts), 1 + 1 + 2 * 2)
+
+    def test_controller_bounds(self):
+        """ The controller keeps its limits within the bounds.
+        """
+        controller = solr.AdaptiveBatchSize(
+            docs=10, min_docs=4, size=1000, min_size=600, max_size=1100,
+            size_step=500, target_latency=1.0)
+        controller.observe(10, 1000, 2.0)
+        self.assertEqual((controller.docs, controller.size), (5, 600))
+        controller.observe(5, 600, 0.1, error=True)
+        self.assertEqual((controller.docs, controller.size), (4, 600))
+        controller.observe(4, 600, 0.1)
+        self.assertEqual((controller.docs, controller.size), (14, 1100))
+
+
+class RecordingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Request handler recording the path, headers and body (decoding
+    chunked bodies) of each request, for testing uploads without a Solr
+    server.
+    """
+
+    def do_POST(self):
+        if self.headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        else:
+            chunks = [self.rfile.read(int(self.headers["content-length"]))]
+        self.server.requests.append((self.path, self.headers, chunks))
+        content_type, body = getattr(
+            self.server, "response",
+            ("text/xml; charset=UTF-8", EmptyResponse._empty_results))
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingServer(SolrConnectionTestCase):
+    """ Mix in a local HTTP server recording requests in
+    ``self.server.requests``.  The server answers with an empty response,
+    or with ``self.server.response`` (a (content type, body) pair) if set.
+    """
+
+    def setUp(self):
+        super(RecordingServer, self).setUp()
+        self.server = BaseHTTPServer.HTTPServer(("localhost", 0),
+                                                RecordingHandler)
+        self.server.requests = []
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,))
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server_thread.join()
+        self.server.server_close()
+        super(RecordingServer, self).tearDown()
+
+    def new_server_connection(self, **kw):
+        conn = self.connection_factory(
+            "http://localhost:%d%s" % (self.server.server_port, SOLR_PATH),
+            **kw)
+        self._connections.append(conn)
+        return conn
+
+
+class TestSolrAddStream(SolrBased, WithConnection, PostTracking,
+                        RecordingServer):
+
+    def test_add_stream(self):
+        """ Documents from an iterator are sent as one request in several
+        chunks.
+        """
+        docs = [get_rand_userdoc() for x in range(10)]
+        self.conn.add_stream(iter(docs), chunk_size=100, commit=True)
+        self.assertEqual(len(self.posts), 1)
+        selector, body = self.posts[0]
+        self.assertEqual(selector, "/update?commit=true")
+        self.assertEqual(body, solr.core.Updater(self.conn)._add_xml(docs))
+        self.assertTrue(self.chunks > 1)
+
+    def test_chunked_transfer_encoding(self):
+        """ Chunks are sent on the wire with chunked transfer encoding.
+        """
+        conn = self.new_server_connection()
+        docs = [get_rand_userdoc() for x in range(10)]
+        conn.add_stream(docs, chunk_size=100)
+        path, headers, chunks = self.server.requests[0]
+        self.assertEqual(headers["transfer-encoding"], "chunked")
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual("".join(chunks),
+                         solr.core.Updater(conn)._add_xml(docs))
+
+    def test_chunked_body_error(self):
+        """ A failing chunk source closes the connection, which can be
+        used again.
+        """
+        conn = self.new_server_connection()
+
+        def chunks():
+            yield u"<add>"
+            raise ValueError("no more documents")
+
+        self.assertRaises(ValueError, conn._post_chunked,
+                          SOLR_PATH + "/update", chunks(), conn.xmlheaders)
+        self.assertEqual(conn.conn.sock, None)
+        conn.add({"id": "1"})
+        self.assertEqual(self.server.requests[-1][2],
+                         ['<add><doc><field name="id">1</field></doc></add>'])
+
+    def test_stale_connection(self):
+        """ An idle connection closed by the server is reopened before a
+        chunked request is sent.
+        """
+        conn = self.new_server_connection()
+        stale, peer = socket.socketpair()
+        peer.close()
+        conn.conn.sock = stale
+        conn.add_stream([{"id": "1"}])
+        self.assertEqual(conn.reconnects, 1)
+        self.assertEqual("".join(self.server.requests[0][2]),
+                         '<add><doc><field name="id">1</field></doc></add>')
+
+    def test_body_writer(self):
+        """ _post sends the body written by a callable.
+        """
+        conn = self.new_server_connection()
+        headers = dict(conn.xmlheaders, **{"Content-Length": "6"})
+        conn._post(SOLR_PATH + "/update", lambda http: http.send("<add/>"),
+                   headers)
+        path, headers, chunks = self.server.requests[0]
+        self.assertEqual((path, chunks), (SOLR_PATH + "/update", ["<add/>"]))
+
+
+class TestSolrPostFile(SolrBased, RecordingServer):
+
+    def setUp(self):
+        super(TestSolrPostFile, self).setUp()
+        self.conn = self.new_server_connection()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        super(TestSolrPostFile, self).tearDown()
+
+    def write(self, data):
+        f = open(self.path, "wb")
+        f.write(data)
+        f.close()
+
+    def requests(self):
+        return [(path[len(SOLR_PATH):], headers["content-type"],
+                 "".join(chunks))
+                for path, headers, chunks in self.server.requests]
+
+    def test_post_file(self):
+        """ A whole file is posted as the request body.
+        """
+        data = '{"add": {"doc": {"id": "1"}}}'
+        self.write(data)
+        self.conn.post_file(self.path, "application/json", commit=True)
+        self.assertEqual(self.requests(),
+                         [("/update?commit=true", "application/json", data)])
+
+    def test_post_xml_file_split(self):
+        """ XML files are split at document boundaries.
+        """
+        docs = ['<doc><field name="id">%d</field></doc>\n' % i
+                for i in range(5)]
+        self.write('<?xml version="1.0"?>\n<add>\n%s</add>\n'
+                   % "".join(docs))
+        self.conn.post_file(self.path, "text/xml", split_every=2,
+                            commit=True)
+        prefix = '<?xml version="1.0"?>\n<add>\n'
+        self.assertEqual(self.requests(), [
+            ("/update", "text/xml", prefix + "".join(docs[0:2]) + "</add>\n"),
+            ("/update", "text/xml", prefix + "".join(docs[2:4]) + "</add>\n"),
+            ("/update?commit=true", "text/xml",
+             prefix + docs[4] + "</add>\n"),
+            ])
+
+    def test_post_csv_file_split(self):
+        """ CSV files are split at line ends, repeating the header.
+        """
+        self.write("id,data\n1,a\n2,b\n3,c")
+        self.conn.post_file(self.path, "text/csv", split_every=2)
+        self.assertEqual(self.requests(), [
+            ("/update/csv", "text/csv", "id,data\n1,a\n2,b\n"),
+            ("/update/csv", "text/csv", "id,data\n3,c"),
+            ])
+
+    def test_post_csv_header_only(self):
+        """ A CSV file without rows is still posted, with the commit.
+        """
+        self.write("id,data\n")
+        self.conn.post_file(self.path, "text/csv", split_every=2,
+                            commit=True)
+        self.assertEqual(self.requests(), [
+            ("/update/csv?commit=true", "text/csv", "id,data\n"),
+            ])
+
+    def test_post_empty_file(self):
+        """ An empty file isn't posted, but the commit is issued.
+        """
+        self.conn.post_file(self.path, "text/csv", commit=True)
+        self.assertEqual(self.requests(), [
+            ("/update?commit=true", "text/xml; charset=utf-8",
+             "<add></add>"),
+            ])
+        self.conn.post_file(self.path, "text/csv")
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_json_file_split(self):
+        """ JSON files can't be split.
+        """
+        self.write("[]")
+        self.assertRaises(ValueError, self.conn.post_file, self.path,
+                          "application/json", split_every=10)
+        self.assertEqual(self.server.requests, [])
+
+
+class TestSolrUpdateBuffer(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrUpdateBuffer, self).setUp()
+        self.buffer = solr.UpdateBuffer(self.conn)
+
+    def docs(self, body):
+        result = []
+        for doc in parseString(body).getElementsByTagName("doc"):
+            fields = []
+            for field in doc.getElementsByTagName("field"):
+                fields.append((field.getAttribute("name"),
+                               field.getAttribute("update") or None,
+                               field.firstChild.nodeValue))
+            result.append(sorted(fields))
+        return result
+
+    def test_last_add_wins(self):
+        """ Only the last version of a document added repeatedly is sent.
+        """
+        self.buffer.add({"id": "1", "data": "a"})
+        self.buffer.add({"id": "2", "data": "b"})
+        self.buffer.add({"id": "1", "data": "c"})
+        self.buffer.flush(commit=True)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.posts[0][0], "/update?commit=true")
+        self.assertEqual(self.docs(self.posts[0][1]), [
+            [("data", None, "c"), ("id", None, "1")],
+            [("data", None, "b"), ("id", None, "2")],
+            ])
+        self.assertEqual(self.buffer.coalesced, 1)
+
+    def test_merge_atomic_updates(self):
+        """ Consecutive atomic updates are merged.
+        """
+        ops = solr.UpdateOps
+        self.buffer.updater(views=ops.INC, tags=ops.ADD).add(
+            {"id": "1", "views": 1, "tags": "a"})
+        self.buffer.updater(views=ops.INC, price=ops.SET).add(
+            {"id": "1", "views": 2, "price": 5})
+        self.buffer.updater(price=ops.SET, tags=ops.ADD).add(
+            {"id": "1", "price": 7, "tags": ["b", "c"]})
+        self.buffer.flush()
+        self.assertEqual(self.docs(self.posts[0][1]), [[
+            ("id", None, "1"), ("price", "set", "7"), ("tags", "add", "a"),
+            ("tags", "add", "b"), ("tags", "add", "c"),
+            ("views", "inc", "3"),
+            ]])
+        self.assertEqual(self.buffer.coalesced, 2)
+
+    def test_merge_update_into_add(self):
+        """ Atomic updates of a pending full document are applied to it.
+        """
+        self.buffer.add({"id": "1", "views": 10, "data": "a"})
+        self.buffer.updater(views=solr.UpdateOps.INC).add(
+            {"id": "1", "views": 5})
+        self.buffer.flush()
+        self.assertEqual(self.docs(self.posts[0][1]), [[
+            ("data", None, "a"), ("id", None, "1"), ("views", None, "15"),
+            ]])
+
+    def test_unmergeable_updates(self):
+        """ Updates which can't be combined are sent in order.
+        """
+        ops = solr.UpdateOps
+        self.buffer.updater(tags=ops.ADD).add({"id": "1", "tags": "a"})
+        self.buffer.updater(tags=ops.INC).add({"id": "1", "tags": 1})
+        self.buffer.flush()
+        self.assertEqual(self.docs(self.posts[0][1]), [
+            [("id", None, "1"), ("tags", "add", "a")],
+            [("id", None, "1"), ("tags", "inc", "1")],
+            ])
+
+    def test_delete_cancels_add(self):
+        """ A delete cancels pending changes, and deletes are sent first.
+        """
+        self.buffer.add({"id": "1", "data": "a"})
+        self.buffer.delete("1")
+        self.buffer.delete("2")
+        self.buffer.add({"id": "2", "data": "b"})
+        self.buffer.flush(commit=True)
+        self.assertEqual(self.posts, [
+            ("/update", u"<delete>\n<id>1</id>\n</delete>"),
+            ("/update?commit=true",
+             u'<add><doc><field name="data">b</field>'
+             u'<field name="id">2</field></doc></add>'),
+            ])
+        self.assertEqual(self.buffer.coalesced, 2)
+
+    def test_max_docs(self):
+        """ The buffer is flushed when max_docs documents are pending.
+        """
+        buf = solr.UpdateBuffer(self.conn, max_docs=2)
+        buf.add({"id": "1"})
+        buf.add({"id": "1"})
+        self.assertEqual(self.posts, [])
+        buf.add({"id": "2"})
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(len(buf), 0)
+
+    def test_failed_flush_kept(self):
+        """ Changes whose requests fail stay in the buffer, and changes
+        buffered since are applied on top of them.
+        """
+        buf = solr.UpdateBuffer(self.conn, max_docs=3)
+
+        def update(*args):
+            raise socket.error("Connection reset by peer")
+        self.conn._update = update
+        buf.add({"id": "1", "views": 1})
+        buf.delete("2")
+        self.assertRaises(socket.error, buf.add, {"id": "3"})
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(self.posts, [])
+        del self.conn._update
+        buf.updater(views=solr.UpdateOps.INC).add({"id": "1", "views": 2})
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(self.posts[0],
+                         ("/update", u"<delete>\n<id>2</id>\n</delete>"))
+        self.assertEqual(self.docs(self.posts[1][1]), [
+            [("id", None, "1"), ("views", None, "3")],
+            [("id", None, "3")],
+            ])
+
+
+class TestSolrFingerprints(SolrBased, PostTracking):
+
+    def setUp(self):
+        super(TestSolrFingerprints, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.store = solr.FingerprintStore(
+            os.path.join(self.directory, "fingerprints.db"))
+        self.conn = self.new_connection(fingerprints=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+        super(TestSolrFingerprints, self).tearDown()
+
+    def test_unchanged_documents_skipped(self):
+        """ Documents which haven't changed since they were sent are skipped.
+        """
+        docs = [{"id": "1", "data": "a"}, {"id": "2", "data": "b"}]
+        self.conn.add_many(docs)
+        self.assertEqual(len(self.posts), 1)
+        self.conn.add_many([{"data": "a", "id": "1"},
+                            {"id": "2", "data": "c"}])
+        self.assertEqual(len(self.posts), 2)
+        self.assertEqual(self.posts[1][1],
+                         u'<add><doc><field name="data">c</field>'
+                         u'<field name="id">2</field></doc></add>')
+        self.conn.add_many(docs[:1])
+        self.assertEqual(len(self.posts), 2)
+        self.assertEqual((self.store.sent, self.store.skipped), (3, 2))
+
+    def test_failed_add_not_recorded(self):
+        """ Documents are only recorded once Solr has accepted them.
+        """
+        def respond(selector, body):
+            raise solr.SolrException(503, "Unavailable")
+        self.respond = respond
+        self.assertRaises(solr.SolrException, self.conn.add, {"id": "1"})
+        del self.respond
+        self.conn.add({"id": "1"})
+        self.assertEqual(len(self.posts), 2)
+
+    def test_commit_sent_when_nothing_changed(self):
+        """ A requested commit is sent even if every document is skipped.
+        """
+        self.conn.add({"id": "1"})
+        self.conn.add({"id": "1"}, commit=True)
+        self.assertEqual(self.posts[-1], ("/update?commit=true", u"<add></add>"))
+
+    def test_delete_forgets(self):
+        """ Deleted documents are re-sent when added again.
+        """
+        self.conn.add_many([{"id": "1"}, {"id": "2"}])
+        self.conn.delete(id="1")
+        self.conn.add_many([{"id": "1"}, {"id": "2"}])
+        self.assertEqual(self.posts[-1][1],
+                         u'<add><doc><field name="id">1</field></doc></add>')
+        self.conn.delete_query("*:*")
+        self.assertEqual(len(self.store), 0)
+
+    def test_batches_and_columns_skip_unchanged(self):
+        """ add_batches and add_columns check the fingerprints too.
+        """
+        self.conn.add_many([{"id": "1", "data": "a"}, {"id": "2"}])
+        self.conn.add_batches([{"id": "1", "data": "a"}, {"id": "3"}],
+                              batch_size=10)
+        self.assertEqual(self.posts[-1][1],
+                         u'<add><doc><field name="id">3</field></doc></add>')
+        self.conn.add_columns({"id": ["1", "2", "3"], "data": ["a", None, "b"]})
+        self.assertEqual(len(self.posts), 3)
+        self.assertTrue(u'<field name="id">3</field>' in self.posts[-1][1])
+        self.assertEqual(self.posts[-1][1].count("<doc>"), 1)
+
+    def test_atomic_updates_not_skipped(self):
+        """ Atomic updates are always sent.
+        """
+        updater = self.conn.updater(count=solr.UpdateOps.INC)
+        updater.add({"id": "1", "count": 1})
+        updater.add({"id": "1", "count": 1})
+        self.assertEqual(len(self.posts), 2)
+
+    def test_delete_missing(self):
+        """ Documents not seen since begin() are deleted.
+        """
+        self.conn.add_many([{"id": "1"}, {"id": "2"}, {"id": "3"}])
+        self.store.begin()
+        self.conn.add_many([{"id": "1"}, {"id": "3", "data": "x"}])
+        self.assertEqual(self.conn.delete_missing(commit=True), [u"2"])
+        self.assertEqual(self.posts[-1],
+                         ("/update?commit=true",
+                          u"<delete>\n<id>2</id>\n</delete>"))
+        self.assertEqual(self.store.missing(), [])
+
+    def test_failed_add_not_missing(self):
+        """ A changed document whose add fails isn't deleted as missing,
+        and is sent again.
+        """
+        self.conn.add_many([{"id": "1"}, {"id": "2"}])
+        self.store.begin()
+
+        def respond(selector, body):
+            raise solr.SolrException(503, "Unavailable")
+        self.respond = respond
+        self.assertRaises(solr.SolrException, self.conn.add_many,
+                          [{"id": "1"}, {"id": "2", "data": "x"}])
+        del self.respond
+        self.assertEqual(self.conn.delete_missing(), [])
+        self.conn.add_many([{"id": "1"}, {"id": "2", "data": "x"}])
+        self.assertEqual(self.posts[-1][1],
+                         u'<add><doc><field name="data">x</field>'
+                         u'<field name="id">2</field></doc></add>')
+
+    def test_store_persists(self):
+        """ Fingerprints survive reopening the store.
+        """
+        self.conn.add({"id": "1"})
+        self.store.begin()
+        self.store.close()
+        self.store = solr.FingerprintStore(
+            os.path.join(self.directory, "fingerprints.db"))
+        conn = self.new_connection(fingerprints=self.store)
+        conn.add({"id": "1"})
+        self.assertEqual(self.posts, [])
+        self.assertEqual(self.store.run, 1)
+
+
+class TestSolrDeleteMany(SolrBased, WithConnection, PostTracking):
+
+    connection_args = {"pool_size": 3}
+
+    def deleted(self, body):
+        return [node.firstChild.nodeValue
+                for node in parseString(body).getElementsByTagName("id")]
+
+    def test_chunks_deduplicated(self):
+        """ Ids are deduplicated and sent in bounded chunks.
+        """
+        counts = []
+        ids = (str(i % 25) for i in xrange(50))
+        self.conn.delete_many(ids, chunk_size=10, progress=counts.append,
+                              commit=True)
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(
+            sorted([len(self.deleted(body)) for selector, body in self.posts]),
+            [5, 10, 10])
+        deleted = []
+        for selector, body in self.posts:
+            deleted.extend(self.deleted(body))
+        self.assertEqual(sorted(deleted), sorted([str(i) for i in range(25)]))
+        self.assertEqual(counts[-1], 25)
+        self.assertEqual(self.posts[-1][0], "/update?commit=true")
+        self.assertEqual(self.deleted(self.posts[-1][1]),
+                         [str(i) for i in range(20, 25)])
+
+    def test_no_ids(self):
+        """ No request is sent if there are no ids.
+        """
+        self.assertEqual(self.conn.delete_many(iter([]), commit=True), None)
+        self.assertEqual(self.posts, [])
+
+    def test_failure_raised(self):
+        """ A failed request is reported to the caller.
+        """
+        def respond(selector, body):
+            raise solr.SolrException(400, "Bad Request")
+        self.respond = respond
+        self.assertRaises(solr.SolrException, self.conn.delete_many,
+                          range(100), chunk_size=10)
+
+    def test_ids_not_modified(self):
+        """ The caller's list of ids is left unchanged.
+        """
+        ids = ["b", "c"]
+        self.conn.delete(id="a", ids=ids)
+        self.assertEqual(ids, ["b", "c"])
+        self.assertEqual(self.deleted(self.posts[0][1]), ["a", "b", "c"])
+
+    def test_pool_map(self):
+        """ The pool returns results in order, using separate connections.
+        """
+        seen = set()
+        busy = []
+        all_busy = threading.Event()
+
+        def call(conn, item):
+            seen.add(id(conn.conn))
+            # Hold on to the connection until every worker has one.
+            busy.append(item)
+            if len(busy) == 3:
+                all_busy.set()
+            all_busy.wait(10)
+            return item * 2
+        self.assertEqual(self.conn.pool.map(call, xrange(10)),
+                         [i * 2 for i in range(10)])
+        self.assertEqual(len(seen), 3)
+        self.assert_(id(self.conn.conn) not in seen)
+
+    def test_nested_pool_map(self):
+        """ A function run by the pool can use its connection's pool.
+        """
+        def inner(conn, item):
+            return item + 1
+
+        def outer(conn, item):
+            return sum(conn.pool.map(inner, range(item)))
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self.conn.pool.map(outer, range(6))))
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(10)
+        self.assertEqual(results, [[0, 1, 3, 6, 10, 15]])
+
+    def test_parallel_map_threads(self):
+        """ No more threads are started than there are items.
+        """
+        started = []
+        original = threading.Thread
+
+        class Thread(original):
+            def start(self):
+                started.append(self)
+                original.start(self)
+        threading.Thread = Thread
+        try:
+            self.assertEqual(solr.core._parallel_map(abs, [], 4), [])
+            self.assertEqual(solr.core._parallel_map(abs, [-1, -2], 4), [1, 2])
+            self.assertEqual(len(started), 2)
+            self.assertEqual(solr.core._parallel_map(abs, iter([-1]), 4), [1])
+            self.assertEqual(len(started), 6)
+        finally:
+            threading.Thread = original
+
+
+class TestShardedSolr(unittest.TestCase):
+
+    def setUp(self):
+        self.index = self.new_index()
+
+    def new_index(self, **kw):
+        index = solr.ShardedSolr(
+            [SOLR_HTTP + "/shard%d" % i for i in range(3)], **kw)
+        self.posts = []
+        for i, shard in enumerate(index.shards):
+            shard._post = self.tracker(i)
+        return index
+
+    def tracker(self, shard):
+        def post(selector, body, headers):
+            self.posts.append((shard, selector.split("/", 3)[3], body))
+            return EmptyResponse(), EmptyResponse._empty_results
+        return post
+
+    def ids(self, body):
+        return [node.firstChild.nodeValue
+                for node in parseString(body).getElementsByTagName(
+                    "field" in body and "field" or "id")]
+
+    def test_routing(self):
+        """ Documents are sent to the shard their id hashes to.
+        """
+        docs = [{"id": str(i)} for i in range(30)]
+        self.index.add_many(docs)
+        self.assertEqual(len(self.posts), 3)
+        for shard, selector, body in self.posts:
+            self.assertEqual(selector, "update")
+            for id in self.ids(body):
+                self.assertEqual(solr.sharding.crc32_hash(id) % 3, shard)
+        self.assertEqual(self.index.dirty, [0, 1, 2])
+
+    def test_batches(self):
+        """ Each shard receives its documents in bounded batches.
+        """
+        index = self.new_index(hash_function=lambda value: 0)
+        index.add_many([{"id": str(i)} for i in range(5)], batch_size=2,
+                       commit=True)
+        self.assertEqual([(shard, selector) for shard, selector, body
+                          in self.posts],
+                         [(0, "update"), (0, "update"),
+                          (0, "update?commit=true")])
+        self.assertEqual([len(self.ids(body))
+                          for shard, selector, body in self.posts], [2, 2, 1])
+
+    def test_commit_only_written_shards(self):
+        """ Commits go only to shards with uncommitted writes.
+        """
+        index = self.new_index(route_field="group",
+                               hash_function=lambda value: value)
+        index.add({"id": "a", "group": 1})
+        index.add({"id": "b", "group": 2}, commit=True)
+        self.assertEqual(sorted([(shard, selector) for shard, selector, body
+                                 in self.posts[1:]]),
+                         [(1, "update"), (2, "update?commit=true")])
+        self.assertEqual(index.dirty, [])
+        del self.posts[:]
+        index.commit()
+        self.assertEqual(self.posts, [])
+
+    def test_commit_with_scheduler(self):
+        """ Requested commits aren't deferred by the shards' schedulers.
+        """
+        index = self.new_index(route_field="group",
+                               hash_function=lambda value: value,
+                               commit_interval=60)
+        index.add({"id": "a", "group": 1})
+        index.add({"id": "b", "group": 2}, commit=True)
+        self.assertEqual(sorted([(shard, selector, body)
+                                 for shard, selector, body in self.posts
+                                 if "<commit" in body]),
+                         [(1, "update", "<commit />"),
+                          (2, "update", "<commit />")])
+        self.assertEqual([selector for shard, selector, body in self.posts
+                          if "<commit" not in body], ["update", "update"])
+        self.assertFalse([shard for shard in index.shards
+                          if shard.commits.pending])
+        del self.posts[:]
+        index.add({"id": "c", "group": 0})
+        index.commit()
+        self.assertEqual(self.posts[1:], [(0, "update", "<commit />")])
+
+    def test_delete_routing(self):
+        """ Deletes by id are routed; deletes by query go to every shard.
+        """
+        index = self.new_index(hash_function=lambda value: int(value))
+        index.delete(ids=["1", "4", "2"])
+        self.assertEqual(sorted([(shard, self.ids(body))
+                                 for shard, selector, body in self.posts]),
+                         [(1, ["1", "4"]), (2, ["2"])])
+        del self.posts[:]
+        index.delete_query("*:*", commit=True)
+        self.assertEqual(sorted([(shard, selector) for shard, selector, body
+                                 in self.posts]),
+                         [(0, "update?commit=true"), (1, "update?commit=true"),
+                          (2, "update?commit=true")])
+
+    def test_unexpected_argument(self):
+        """ Invalid commit-control arguments are rejected before sending.
+        """
+        self.assertRaises(TypeError, self.index.add, {"id": "1"}, comit=True)
+        self.assertRaises(TypeError, self.index.add, {"id": "1"},
+                          wait_flush=False)
+        self.assertEqual(self.posts, [])
+
+
+class TestShardedSearch(unittest.TestCase):
+
+    # Documents on each of three shards: (id, score, price).
+    shard_docs = [
+        [("a", 9.0, 5), ("b", 4.0, 1), ("c", 1.0, None)],
+        [("d", 8.0, 3), ("e", 7.0, 2)],
+        [("f", 6.0, 4), ("g", 5.0, 6), ("h", 0.5, 7)],
+        ]
+
+    def setUp(self):
+        self.index = solr.ShardedSolr(
+            [SOLR_HTTP + "/shard%d" % i for i in range(3)])
+        self.queries = []
+        for i, shard in enumerate(self.index.shards):
+            shard._post = self.responder(i)
+
+    def responder(self, shard):
+        def post(selector, body, headers):
+            params = dict(cgi.parse_qsl(body))
+            self.queries.append((shard, params))
+            docs = self.shard_docs[shard]
+            if "sort" in params:
+                docs = sorted(docs, key=lambda d: (d[2] is None, d[2]))
+            rows = int(params["rows"])
+            xml = ['<response><lst name="responseHeader">'
+                   '<int name="status">0</int><int name="QTime">%d</int>'
+                   '</lst><result name="response" numFound="%d" start="0"'
+                   ' maxScore="%s">' % (shard, len(docs), docs[0][1])]
+            for id, score, price in docs[:rows]:
+                xml.append('<doc><str name="id">%s</str>' % id)
+                if "score" in params["fl"]:
+                    xml.append('<float name="score">%s</float>' % score)
+                if price is not None:
+                    xml.append('<int name="price">%d</int>' % price)
+                xml.append('</doc>')
+            xml.append('</result><lst name="facet_counts">'
+                       '<lst name="facet_queries"/><lst name="facet_fields">'
+                       '<lst name="cat"><int name="x">%d</int>'
+                       '<int name="s%d">1</int></lst></lst></lst>'
+                       '</response>' % (len(docs), shard))
+            return None, "".join(xml)
+        return post
+
+    def ids(self, response):
+        return [doc["id"] for doc in response.results]
+
+    def test_merge_by_score(self):
+        """ Results are merged by score and totals are summed.
+        """
+        response = self.index.select("*:*", rows=4)
+        self.assertEqual(self.ids(response), ["a", "d", "e", "f"])
+        self.assertEqual(response.numFound, 8)
+        self.assertEqual(response.maxScore, 9.0)
+        self.assertEqual(response.header["QTime"], 2)
+        self.assertEqual([params["rows"] for shard, params in self.queries],
+                         ["4", "4", "4"])
+
+    def test_window(self):
+        """ start and rows select a window of the merged results.
+        """
+        response = self.index.select("*:*", start=3, rows=3)
+        self.assertEqual(self.ids(response), ["f", "g", "b"])
+        self.assertEqual(response.results.start, 3)
+        self.assertEqual([params["start"] for shard, params in self.queries],
+                         ["0", "0", "0"])
+        self.assertEqual(self.ids(response.next_batch()), ["c", "h"])
+
+    def test_merge_by_sort(self):
+        """ Results are merged by the sort fields, missing values last.
+        """
+        response = self.index.select("*:*", fields="id", score=False,
+                                     sort="price", rows=10)
+        self.assertEqual(self.ids(response),
+                         ["b", "e", "d", "f", "a", "g", "h", "c"])
+        self.assertEqual(self.queries[0][1]["fl"], "id,price")
+        self.assertEqual(response.results[0], {"id": "b"})
+
+    def test_merge_facets(self):
+        """ Facet field counts are summed across shards.
+        """
+        response = self.index.select("*:*")
+        cat = response.facet_counts["facet_fields"]["cat"]
+        self.assertEqual(dict(cat.items()),
+                         {"x": 8, "s0": 1, "s1": 1, "s2": 1})
+
+
+class CursorSource(object):
+    """ Mix in a source connection serving documents through cursors.
+
+    ``self.source`` answers queries from ``self.source_docs`` (a list of
+    documents sorted by id) in pages of ``rows``, using the index of the
+    next document as the cursor mark.
+
+    """
+
+    def new_source(self):
+        conn = solr.Solr(SOLR_HTTP + "/source")
+        self.source_queries = []
+
+        def post(selector, body, headers):
+            params = dict(cgi.parse_qsl(body))
+            self.source_queries.append(params)
+            mark = params.get("cursorMark", "*")
+            start = mark != "*" and int(mark) or 0
+            end = start + int(params.get("rows", 10))
+            docs = self.source_docs[start:end]
+            xml = ['<response><lst name="responseHeader">'
+                   '<int name="status">0</int></lst>'
+                   '<result name="response" numFound="%d" start="0">'
+                   % len(self.source_docs)]
+            for doc in docs:
+                xml.append("<doc>")
+                for name, value in sorted(doc.items()):
+                    xml.append('<str name="%s">%s</str>' % (name, value))
+                xml.append("</doc>")
+            xml.append('</result><str name="nextCursorMark">%d</str>'
+                       '</response>' % min(end, len(self.source_docs)))
+            return None, "".join(xml)
+
+        conn._post = post
+        return conn
+
+
+class TestSolrReindex(SolrBased, WithConnection, PostTracking, CursorSource):
+
+    connection_args = {"pool_size": 2}
+
+    def setUp(self):
+        super(TestSolrReindex, self).setUp()
+        self.source = self.new_source()
+        self.source_docs = [{"id": "%02d" % i, "data": "d%d" % i,
+                             "_version_": "1"} for i in range(10)]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestSolrReindex, self).tearDown()
+
+    def added(self):
+        docs = []
+        for selector, body in self.posts:
+            for doc in parseString(body).getElementsByTagName("doc"):
+                docs.append(dict([(field.getAttribute("name"),
+                                   field.firstChild.nodeValue)
+                                  for field in doc.getElementsByTagName("field")]))
+        return sorted(docs, key=lambda doc: doc["id"])
+
+    def test_cursor(self):
+        """ A cursor pages through all matches until the mark stops changing.
+        """
+        pages = list(self.source.select.cursor("*:*", sort="id asc", rows=4))
+        self.assertEqual([len(page.results) for page in pages], [4, 4, 2, 0])
+        self.assertEqual([q["cursorMark"] for q in self.source_queries],
+                         ["*", "4", "8", "10"])
+        self.assertRaises(ValueError, self.source.select.cursor("*:*").next)
+
+    def test_reindex(self):
+        """ Documents are copied, transformed, and committed.
+        """
+        def transform(doc):
+            if doc["id"] == "03":
+                return None
+            doc["data"] = doc["data"].upper()
+            return doc
+        reports = []
+        result = solr.Reindexer(self.source, self.conn, rows=3,
+                                transform=transform,
+                                progress=reports.append).run()
+        added = self.added()
+        self.assertEqual([doc["id"] for doc in added],
+                         ["%02d" % i for i in range(10) if i != 3])
+        self.assertEqual(added[0], {"id": "00", "data": "D0"})
+        self.assertEqual(self.posts[-1][0], "/update")
+        self.assertEqual(self.posts[-1][1],
+                         u'<commit />')
+        self.assertEqual((result.read, result.written, result.batches),
+                         (10, 9, 5))
+        self.assertEqual(len(reports), 5)
+        self.assertEqual(reports[-1].cursor_mark, "10")
+
+    def test_resume(self):
+        """ Reindexing resumes from the checkpointed cursor mark.
+        """
+        checkpoint = os.path.join(self.directory, "cursor")
+        failures = []
+
+        def respond(selector, body):
+            if "<field name=\"id\">06</field>" in body and not failures:
+                failures.append(body)
+                raise solr.SolrException(503, "Unavailable")
+            return EmptyResponse(), EmptyResponse._empty_results
+        self.respond = respond
+        reindexer = solr.Reindexer(self.source, self.conn, rows=3,
+                                   workers=1, checkpoint=checkpoint)
+        self.assertRaises(solr.SolrException, reindexer.run)
+        self.assertEqual(open(checkpoint).read(), "6\n")
+        del self.posts[:]
+        reindexer.run()
+        self.assertEqual([doc["id"] for doc in self.added()],
+                         ["06", "07", "08", "09"])
+        self.assert_(not os.path.exists(checkpoint))
+
+    def test_swap_cores(self):
+        """ Cores are swapped through the CoreAdmin API.
+        """
+        solr.swap_cores(self.conn, "live", "rebuild")
+        selector, body = self.posts[0]
+        self.assertEqual(selector, "/admin/cores")
+        self.assertEqual(dict(cgi.parse_qsl(body)),
+                         {"action": "SWAP", "core": "live",
+                          "other": "rebuild", "wt": "standard"})
+
+
+class TestSolrPartitionedScan(SolrBased, WithConnection, PostTracking):
+
+    connection_args = {"pool_size": 3}
+
+    def setUp(self):
+        super(TestSolrPartitionedScan, self).setUp()
+        self.docs = [{"id": "doc%03d" % i, "n": i * 7 % 200}
+                     for i in range(200)]
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        docs = self.docs
+        for fq in params.get("fq", []):
+            field, lower, upper, inclusive = re.match(
+                r'(\w+):\[(.+) TO (.+)([}\]])$', fq).groups()
+            parse = field == "n" and int or (lambda v: v.strip('"'))
+            if lower != "*":
+                docs = [d for d in docs if d[field] >= parse(lower)]
+            if upper != "*":
+                upper = parse(upper)
+                if inclusive == "]":
+                    docs = [d for d in docs if d[field] <= upper]
+                else:
+                    docs = [d for d in docs if d[field] < upper]
+        field, order = params.get("sort", ["id asc"])[0].split()
+        docs = sorted(docs, key=lambda d: d[field], reverse=order == "desc")
+        mark = params.get("cursorMark", ["*"])[0]
+        start = mark != "*" and int(mark) or 0
+        end = start + int(params["rows"][0])
+        xml = ['<response><lst name="responseHeader">'
+               '<int name="status">0</int></lst>'
+               '<result name="response" numFound="%d" start="0">' % len(docs)]
+        for doc in docs[start:end]:
+            xml.append('<doc><str name="id">%s</str><int name="n">%d</int>'
+                       '</doc>' % (doc["id"], doc["n"]))
+        xml.append('</result><str name="nextCursorMark">%d</str></response>'
+                   % min(end, len(docs)))
+        return None, "".join(xml)
+
+    def test_split_ranges(self):
+        """ Ranges cover all documents in balanced partitions.
+        """
+        for field in ("id", "n"):
+            ranges = solr.split_ranges(self.conn, field, 4)
+            self.assertEqual(len(ranges), 4)
+            self.assert_(ranges[0].startswith(field + ":[* TO "))
+            self.assert_(ranges[-1].endswith(" TO *]"))
+            sizes = [self.conn.select("*:*", rows=0, fq=fq).numFound
+                     for fq in ranges]
+            self.assertEqual(sum(sizes), 200)
+            self.assert_(min(sizes) >= 40, (field, sizes))
+
+    def test_scan(self):
+        """ Every document is read exactly once.
+        """
+        docs = list(solr.partitioned_scan(self.conn, partitions=4, rows=15,
+                                          fq="n:[* TO *]"))
+        self.assertEqual(sorted([doc["id"] for doc in docs]),
+                         sorted([doc["id"] for doc in self.docs]))
+
+    def test_scan_stopped_early(self):
+        """ Abandoning a scan stops the readers.
+        """
+        scan = solr.partitioned_scan(self.conn, partitions=3, rows=5)
+        self.assertEqual(len([scan.next() for i in range(7)]), 7)
+        requests = len(self.posts)
+        scan.close()
+        for thread in threading.enumerate():
+            if thread.getName() == "solrpy-scan":
+                thread.join(10)
+        self.assert_(len(self.posts) <= requests + 3)
+
+
+class TestSolrStreamingHandlers(SolrBased, RecordingServer):
+
+    export = ('{"responseHeader": {"status": 0},\n'
+              ' "response": {"numFound": 3, "docs": [\n'
+              '  {"id": "a", "price": 10, "tags": ["x", "y"]},\n'
+              '  {"id": "b\\u00e9", "price": 2.5},\n'
+              '  {"id": "c", "price": 12345678901234}]}}\n')
+
+    def setUp(self):
+        super(TestSolrStreamingHandlers, self).setUp()
+        self.server.response = ("application/json", self.export)
+        self.conn = self.new_server_connection()
+
+    def test_reader_small_blocks(self):
+        """ Tuples are parsed from blocks split at any position.
+        """
+        for size in (1, 2, 3, 7):
+            blocks = [self.export[i:i + size]
+                      for i in range(0, len(self.export), size)]
+            stream = solr.TupleStream(iter(blocks), ("response", "docs"))
+            self.assertEqual([doc["price"] for doc in stream],
+                             [10, 2.5, 12345678901234])
+            self.assertEqual(stream.meta["numFound"], 3)
+
+    def test_export(self):
+        """ Rows are records of the requested fields.
+        """
+        export = solr.ExportHandler(self.conn)
+        rows = list(export("*:*", fields="id,price,tags", sort="id asc"))
+        self.assertEqual(rows[0].tags, ["x", "y"])
+        self.assertEqual(rows[1], (u"b\xe9", 2.5, None))
+        self.assertEqual(len(rows), 3)
+        path, headers, chunks = self.server.requests[0]
+        self.assertEqual(path, SOLR_PATH + "/export")
+        params = cgi.parse_qs(chunks[0])
+        self.assertEqual((params["fl"], params["sort"], params["wt"]),
+                         (["id,price,tags"], ["id asc"], ["json"]))
+
+    def test_export_tuples(self):
+        """ Rows may be plain tuples; the connection remains usable.
+        """
+        export = solr.ExportHandler(self.conn)
+        rows = export(fields=["price"], sort="id asc", tuples=True)
+        self.assertEqual(rows.next(), (10,))
+        rows.close()
+        self.conn.add({"id": "d"})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_export_interleaved(self):
+        """ The connection can be used, from this thread or others, while
+        an export is being read.
+        """
+        rows = solr.ExportHandler(self.conn)(fields="id", sort="id asc",
+                                             tuples=True)
+        self.assertEqual(rows.next(), ("a",))
+        self.conn.add({"id": "d"})
+        thread = threading.Thread(target=self.conn.add, args=({"id": "e"},))
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(list(rows), [(u"b\xe9",), ("c",)])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_export_exception(self):
+        """ An exception reported in the stream is raised.
+        """
+        self.server.response = ("application/json",
+            '{"responseHeader": {"status": 0}, "response": {"numFound": 2, '
+            '"docs": [{"id": "a"}, {"EXCEPTION": "field x lacks docValues"}]}}')
+        rows = solr.ExportHandler(self.conn)(fields="id", sort="id asc")
+        self.assertEqual(rows.next().id, "a")
+        self.assertRaises(solr.SolrException, rows.next)
+
+    def test_stream_expression(self):
+        """ Streaming expression tuples are yielded up to the EOF tuple.
+        """
+        self.server.response = ("application/json",
+            '{"result-set": {"docs": [\n'
+            '{"region": "east", "sum(amount)": 10.5},\n'
+            '{"region": "west", "sum(amount)": 3.0},\n'
+            '{"EOF": true, "RESPONSE_TIME": 42}]}}')
+        stream = solr.StreamHandler(self.conn)
+        rows = stream('rollup(search(sales), over="region", sum(amount))')
+        self.assertEqual(rows.response_time, None)
+        self.assertEqual([row["region"] for row in rows], ["east", "west"])
+        self.assertEqual(rows.response_time, 42)
+        path, headers, chunks = self.server.requests[0]
+        self.assertEqual(path, SOLR_PATH + "/stream")
+        self.assertEqual(cgi.parse_qs(chunks[0])["expr"],
+                         ['rollup(search(sales), over="region", sum(amount))'])
+
+    def test_sql_exception(self):
+        """ An EXCEPTION tuple from the SQL handler is raised.
+        """
+        self.server.response = ("application/json",
+            '{"result-set": {"docs": [{"EXCEPTION": "No such table", '
+            '"EOF": true, "RESPONSE_TIME": 3}]}}')
+        rows = solr.SQLHandler(self.conn)("SELECT a FROM missing")
+        self.assertRaises(solr.SolrException, list, rows)
+        path, headers, chunks = self.server.requests[0]
+        self.assertEqual(path, SOLR_PATH + "/sql")
+        self.assertEqual(cgi.parse_qs(chunks[0])["stmt"],
+                         ["SELECT a FROM missing"])
+
+    def test_export_requires_fields(self):
+        """ Export requires fields and a sort.
+        """
+        export = solr.ExportHandler(self.conn)
+        self.assertRaises(ValueError, export, "*:*", sort="id asc")
+
+
+class TestSolrRealTimeGet(SolrBased, WithConnection, PostTracking):
+
+    connection_args = {"pool_size": 3}
+
+    def setUp(self):
+        super(TestSolrRealTimeGet, self).setUp()
+        self.stored = dict([("doc%d" % i, i) for i in range(20)])
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        docs = ['<doc><str name="id">%s</str><int name="n">%d</int></doc>'
+                % (id, self.stored[id]) for id in params["id"]
+                if id in self.stored]
+        if len(params["id"]) == 1:
+            return None, ("<response>%s</response>"
+                          % (docs and docs[0].replace("<doc>", '<doc name="doc">')
+                             or '<null name="doc"/>'))
+        return None, ('<response><result name="response" numFound="%d" '
+                      'start="0">%s</result></response>'
+                      % (len(docs), "".join(docs)))
+
+    def test_get(self):
+        """ Documents are returned in input order, with missing ids listed.
+        """
+        get = solr.RealTimeGetHandler(self.conn, chunk_size=4)
+        ids = ["doc%d" % i for i in (7, 3, 99, 15, 3, 1, 0, 50, 12, 4, 18)]
+        docs = get(iter(ids), fields="n", fq="n:[* TO *]")
+        self.assertEqual(docs.keys(), ["doc7", "doc3", "doc15", "doc1",
+                                       "doc0", "doc12", "doc4", "doc18"])
+        self.assertEqual(docs["doc15"], {"id": "doc15", "n": 15})
+        self.assertEqual(docs.missing, ["doc99", "doc50"])
+        self.assertEqual(len(self.posts), 3)
+        for selector, body in self.posts:
+            params = cgi.parse_qs(body)
+            self.assertEqual(selector, "/get")
+            self.assertEqual(params["fl"], ["n,id"])
+            self.assertEqual(params["fq"], ["n:[* TO *]"])
+            self.assert_(len(params["id"]) <= 4)
+
+    def test_get_single(self):
+        """ A single id is answered with a single document.
+        """
+        get = solr.RealTimeGetHandler(self.conn)
+        self.assertEqual(get(["doc2"]).items(),
+                         [("doc2", {"id": "doc2", "n": 2})])
+        self.assertEqual(get(["nope"]).missing, ["nope"])
+
+
+class TestSolrCachingSearch(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrCachingSearch, self).setUp()
+        self.versions = {"a": 1, "b": 1, "c": 1}
+        self.cache = solr.DocumentCache(max_docs=2)
+        self.search = solr.CachingSearchHandler(self.conn, self.cache)
+
+    def doc(self, id, score=None):
+        xml = ['<doc><str name="id">%s</str><long name="_version_">%d</long>'
+               % (id, self.versions[id])]
+        if score is not None:
+            xml.append('<float name="score">%s</float>' % score)
+        else:
+            xml.append('<str name="body">%s v%d</str>'
+                       % (id, self.versions[id]))
+        xml.append('</doc>')
+        return "".join(xml)
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        if selector == "/get":
+            ids = [id for id in params["id"] if id in self.versions]
+            docs = "".join([self.doc(id) for id in ids])
+            if len(params["id"]) == 1:
+                return None, ("<response>%s</response>"
+                              % docs.replace("<doc>", '<doc name="doc">'))
+            return None, ('<response><result name="response" numFound="%d" '
+                          'start="0">%s</result></response>' % (len(ids), docs))
+        self.assertEqual(params["fl"], ["id,_version_,score"])
+        ids = ["c", "a", "b"]
+        return None, ('<response><result name="response" numFound="3" '
+                      'start="0">%s</result></response>'
+                      % "".join([self.doc(id, 3 - i)
+                                 for i, id in enumerate(ids)]))
+
+    def test_two_phase(self):
+        """ Misses are fetched with /get; hits come from the cache.
+        """
+        response = self.search("*:*", fields="id,body")
+        self.assertEqual([doc["body"] for doc in response.results],
+                         ["c v1", "a v1", "b v1"])
+        self.assertEqual(response.results[0]["score"], 3.0)
+        self.assertEqual(response.numFound, 3)
+        self.assertEqual([selector for selector, body in self.posts],
+                         ["/select", "/get"])
+        self.assertEqual(cgi.parse_qs(self.posts[1][1])["fl"],
+                         ["id,body,_version_"])
+
+        del self.posts[:]
+        self.versions["b"] = 2
+        response = self.search("*:*", fields="id,body")
+        self.assertEqual([doc["body"] for doc in response.results],
+                         ["c v1", "a v1", "b v2"])
+        # "c" was evicted to make room for "b"; "b" has a new version.
+        self.assertEqual(cgi.parse_qs(self.posts[1][1])["id"], ["c", "b"])
+        self.assertEqual((self.cache.hits, len(self.cache)), (1, 2))
+
+    def test_deleted_between_phases(self):
+        """ Documents missing from /get are left out.
+        """
+        search = solr.CachingSearchHandler(self.conn)
+        original = search.get
+
+        def get(ids, **kw):
+            return original([id for id in ids if id != "a"], **kw)
+        search.get = get
+        response = search("*:*", fields="id,body")
+        self.assertEqual([doc["id"] for doc in response.results], ["c", "b"])
+
+    def test_version_not_leaked(self):
+        """ _version_ is only returned if requested; the caller's fields
+        and the cached documents are left unchanged.
+        """
+        fields = ["id", "body"]
+        response = self.search("*:*", fields=fields)
+        self.assertEqual(fields, ["id", "body"])
+        self.assertEqual(sorted(response.results[0].keys()),
+                         ["body", "id", "score"])
+        response.results[0]["body"] = "changed"
+        response = self.search("*:*", fields=fields)
+        self.assertEqual(response.results[1]["body"], "a v1")
+        self.assertEqual(response._params["fields"], ["id", "body"])
+        response = self.search("*:*", fields="id,_version_")
+        self.assertEqual(response.results[0]["_version_"], 1)
+
+
+class TestSolrPreparedQuery(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrPreparedQuery, self).setUp()
+        self.search = self.conn.select.prepare(
+            fields="id,title", sort="date desc", fq=["type:book", "lang:en"],
+            hl_simple_pre="<b>", rows=2)
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        start = int(params.get("start", ["0"])[0])
+        docs = ['<doc><str name="id">%d</str></doc>' % i
+                for i in range(start, min(start + 2, 5))]
+        return None, ('<response><result name="response" numFound="5" '
+                      'start="%d">%s</result></response>'
+                      % (start, "".join(docs)))
+
+    def test_same_request(self):
+        """ A prepared query sends the same parameters as the handler.
+        """
+        self.search(u"title:caf\xe9", start=2)
+        self.conn.select(u"title:caf\xe9", fields="id,title", sort="date desc",
+                         fq=["type:book", "lang:en"], hl_simple_pre="<b>",
+                         rows=2, start=2)
+        prepared, direct = [cgi.parse_qs(body) for selector, body in self.posts]
+        self.assertEqual(prepared, direct)
+        self.assertEqual(prepared["fl"], ["id,title,score"])
+        self.assertEqual(prepared["hl.simple.pre"], ["<b>"])
+
+    def test_only_call_parameters_encoded(self):
+        """ The static part of the request is encoded once.
+        """
+        static = self.search._static
+        self.search("a")
+        self.search("b", start=2)
+        self.assertEqual(self.posts[0][1], "q=a&" + static)
+        self.assertTrue(self.posts[1][1].endswith("&" + static))
+
+    def test_override(self):
+        """ Call parameters replace prepared ones.
+        """
+        self.search("a", rows=10, hl_simple_pre="<em>")
+        params = cgi.parse_qs(self.posts[0][1])
+        self.assertEqual(params["rows"], ["10"])
+        self.assertEqual(params["hl.simple.pre"], ["<em>"])
+        self.assertEqual(params["fq"], ["type:book", "lang:en"])
+
+    def test_next_batch(self):
+        """ Following pages are fetched with the prepared query.
+        """
+        response = self.search("a")
+        response = response.next_batch()
+        self.assertEqual([doc["id"] for doc in response], ["2", "3"])
+        self.assertEqual(self.posts[1][1],
+                         "q=a&start=2&" + self.search._static)
+
+
+class TestSolrPrefetch(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrPrefetch, self).setUp()
+        self.total = 23
+        self.fail_at = None
+        self.requested = threading.Semaphore(0)
+        self.release = threading.Semaphore(0)
+        self.gated = False
+        # The documents read by the test, and how many had been read
+        # when each page was requested.
+        self.read = []
+        self.read_before = {}
+
+    def read_all(self, results):
+        for doc in results:
+            self.read.append(doc["n"])
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        start = int(params.get("start", ["0"])[0])
+        rows = int(params["rows"][0])
+        self.read_before[start] = len(self.read)
+        if start and self.gated:
+            self.requested.release()
+            self.release.acquire()
+        if start == self.fail_at:
+            raise solr.SolrException(500, "failed")
+        docs = ['<doc><int name="n">%d</int></doc>' % i
+                for i in range(start, min(start + rows, self.total))]
+        return None, ('<response><result name="response" numFound="%d" '
+                      'start="%d">%s</result></response>'
+                      % (self.total, start, "".join(docs)))
+
+    def test_all_in_order(self):
+        """ Every document is returned once, in order.
+        """
+        response = self.conn.select("*:*", rows=5)
+        docs = list(solr.prefetch_results(response, depth=2))
+        self.assertEqual([doc["n"] for doc in docs], range(23))
+        self.assertEqual(len(self.posts), 5)
+
+    def test_pages_fetched_ahead(self):
+        """ Pages are requested before the caller reaches them.
+        """
+        response = self.conn.select("*:*", rows=5)
+        self.gated = True
+        results = solr.prefetch_results(response, depth=2)
+        self.read.append(results.next()["n"])
+        for i in range(2):
+            self.requested.acquire()
+            self.release.release()
+        self.assertEqual(sorted(self.read_before), [0, 5, 10])
+        self.gated = False
+        self.read_all(results)
+        self.assertEqual(self.read, range(23))
+        # Each page waits until the caller reads the page two before it.
+        for start, read in self.read_before.items():
+            self.assertTrue(read >= start - 10, (start, read))
+
+    def test_memory_cap(self):
+        """ No more pages are fetched while max_docs are waiting.
+        """
+        response = self.conn.select("*:*", rows=5)
+        self.read_all(solr.prefetch_results(response, depth=4, max_docs=6))
+        self.assertEqual(self.read, range(23))
+        # Each page waits until the one before it is being read.
+        for start, read in self.read_before.items():
+            self.assertTrue(read >= start - 5, (start, read))
+
+    def test_error(self):
+        """ Errors are raised once the pages before them are read.
+        """
+        self.fail_at = 10
+        response = self.conn.select("*:*", rows=5)
+        seen = []
+        try:
+            for doc in solr.prefetch_results(response):
+                seen.append(doc["n"])
+        except solr.SolrException:
+            pass
+        else:
+            self.fail("no exception raised")
+        self.assertEqual(seen, range(10))
+
+
+class TestPaginatorCache(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestPaginatorCache, self).setUp()
+        self.total = 35
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        start = int(params.get("start", ["0"])[0])
+        rows = int(params["rows"][0])
+        docs = ['<doc><int name="n">%d</int></doc>' % i
+                for i in range(start, min(start + rows, self.total))]
+        return None, ('<response><lst name="responseHeader"><lst name="params">'
+                      '<str name="rows">%d</str></lst></lst>'
+                      '<result name="response" numFound="%d" start="%d">%s'
+                      '</result></response>'
+                      % (rows, self.total, start, "".join(docs)))
+
+    def starts(self):
+        return sorted([int(cgi.parse_qs(body).get("start", ["0"])[0])
+                       for selector, body in self.posts])
+
+    def test_original_page_reused(self):
+        """ The page the paginator was created from isn't fetched again.
+        """
+        paginator = solr.SolrPaginator(self.conn.select("*:*", rows=10),
+                                       prefetch=False)
+        page = paginator.page(1)
+        self.assertEqual(page.object_list[0]["n"], 0)
+        self.assertEqual(len(self.posts), 1)
+
+    def test_cache_and_prefetch(self):
+        """ Pages are cached, and the next one is fetched ahead.
+        """
+        paginator = solr.SolrPaginator(self.conn.select("*:*", rows=10),
+                                       cache_pages=2, prefetch=True)
+        page = paginator.page(2)
+        self.assertEqual([doc["n"] for doc in page.object_list], range(10, 20))
+        page = paginator.page(3)
+        self.assertEqual(page.object_list[0]["n"], 20)
+        page = paginator.page(4)
+        self.assertEqual(page.end_index(), 34)
+        self.assertEqual(page.has_next(), False)
+        self.assertEqual(self.starts(), [0, 10, 20, 30])
+
+    def test_cache_size(self):
+        """ Only the most recently used pages are kept.
+        """
+        paginator = solr.SolrPaginator(self.conn.select("*:*", rows=10),
+                                       cache_pages=2, prefetch=False)
+        for page_num in (2, 3, 1, 3):
+            page = paginator.page(page_num)
+            self.assertEqual(page.start_index(), (page_num - 1) * 10)
+        self.assertEqual(self.starts(), [0, 0, 10, 20])
+
+    def test_invalid_page(self):
+        """ Invalid page numbers raise exceptions.
+        """
+        paginator = solr.SolrPaginator(self.conn.select("*:*", rows=10))
+        self.assertRaises(solr.PageNotAnInteger, paginator.page, "x")
+        self.assertRaises(solr.EmptyPage, paginator.page, 5)
+        self.assertRaises(solr.InvalidPage, paginator.page, 0)
+
+    def test_lazy_page_range(self):
+        """ The page range of a large result isn't built as a list.
+        """
+        self.total = 10 ** 7
+        paginator = solr.SolrPaginator(self.conn.select("*:*", rows=10))
+        pages = paginator.page_range
+        self.assertEqual(len(pages), 10 ** 6)
+        self.assertTrue(10 ** 6 in pages)
+        self.assertFalse(10 ** 6 + 1 in pages)
+        self.assertEqual((pages[0], pages[-1]), (1, 10 ** 6))
+        self.assertEqual(list(solr.PageRange(3)), [1, 2, 3])
+
+
+class TestCursorPaginator(SolrBased, PostTracking, CursorSource):
+
+    def setUp(self):
+        super(TestCursorPaginator, self).setUp()
+        self.source = self.new_source()
+        self.source_docs = [{"id": "doc%02d" % i} for i in range(23)]
+        self.paginator = solr.CursorPaginator(
+            self.source.select, "*:*", sort="id asc", page_size=10)
+
+    def ids(self, page):
+        return [doc["id"] for doc in page.object_list]
+
+    def test_pages(self):
+        """ Pages are read with cursors, with the SolrPage interface.
+        """
+        page = self.paginator.page(1)
+        self.assertEqual(self.ids(page)[0], "doc00")
+        self.assertEqual((page.has_next(), page.has_previous()), (True, False))
+        self.assertEqual(self.paginator.num_pages, 3)
+        page = self.paginator.page(3)
+        self.assertEqual(self.ids(page), ["doc20", "doc21", "doc22"])
+        self.assertEqual((page.start_index(), page.end_index()), (20, 22))
+        self.assertEqual(page.has_next(), False)
+        self.assertEqual(page.next_bookmark, None)
+        self.assertEqual([q["cursorMark"] for q in self.source_queries],
+                         ["*", "10", "20"])
+
+    def test_cached_cursors(self):
+        """ Pages already reached are fetched directly.
+        """
+        self.paginator.page(3)
+        del self.source_queries[:]
+        self.assertEqual(self.ids(self.paginator.page(2))[0], "doc10")
+        self.assertEqual([q["cursorMark"] for q in self.source_queries],
+                         ["10"])
+
+    def test_bookmarks(self):
+        """ Bookmarks lead to the same page from another paginator.
+        """
+        page = self.paginator.page(2)
+        bookmark = page.next_bookmark
+        self.assertEqual(re.match("^[A-Za-z0-9_-]+$", bookmark) is not None,
+                         True)
+        self.assertEqual(page.previous_bookmark, self.paginator.bookmark(1))
+        del self.source_queries[:]
+        other = solr.CursorPaginator(
+            self.source.select, "*:*", sort="id asc", page_size=10)
+        page = other.page_from_bookmark(bookmark)
+        self.assertEqual((page.number, self.ids(page)[0]), (3, "doc20"))
+        self.assertEqual(page.bookmark, bookmark)
+        self.assertEqual(len(self.source_queries), 1)
+        self.assertRaises(solr.InvalidPage, other.page_from_bookmark, "x!")
+        self.assertRaises(solr.EmptyPage, other.page, 4)
+
+
+class TestSolrCount(SolrBased, WithConnection, PostTracking):
+
+    def setUp(self):
+        super(TestSolrCount, self).setUp()
+        self.found = 42
+
+    def respond(self, selector, body):
+        # Anything after the result element would fail to parse.
+        return None, ('<response><lst name="responseHeader">'
+                      '<int name="status">0</int></lst>'
+                      '<result name="response" numFound="%d" start="0">'
+                      '<doc><broken' % self.found)
+
+    def test_count(self):
+        """ Only the count is requested and read.
+        """
+        self.assertEqual(self.conn.select.count("a", fq=["b", "c"]), 42)
+        params = cgi.parse_qs(self.posts[0][1])
+        self.assertEqual(params["rows"], ["0"])
+        self.assertEqual(params["fq"], ["b", "c"])
+        self.assertFalse("fl" in params)
+
+    def test_exists(self):
+        """ exists() is true only if there are matches.
+        """
+        self.assertEqual(self.conn.select.exists("a"), True)
+        self.found = 0
+        self.assertEqual(self.conn.select.exists("a"), False)
+
+    def test_cache(self):
+        """ Cached counts are reused until they expire.
+        """
+        now = [1000.0]
+        cache = solr.CountCache(ttl=0.2, clock=lambda: now[0])
+        self.conn.select.count("a", cache=cache, fq="b")
+        self.found = 7
+        self.assertEqual(self.conn.select.count("a", cache=cache, fq="b"), 42)
+        self.assertEqual(self.conn.select.count("a", cache=cache, fq="c"), 7)
+        self.assertEqual(len(self.posts), 2)
+        now[0] += 0.3
+        self.assertEqual(self.conn.select.count("a", cache=cache, fq="b"), 7)
+        self.assertEqual(len(self.posts), 3)
+
+
+class TestSolrExistingIds(SolrBased, WithConnection, PostTracking):
+
+    connection_args = {"pool_size": 3}
+
+    def setUp(self):
+        super(TestSolrExistingIds, self).setUp()
+        self.stored = set(["doc%d" % i for i in range(0, 100, 3)])
+        self.stored.add("a,b")
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        terms = [fq for fq in params["fq"] if fq.startswith("{!terms")][0]
+        match = re.match(r'{!terms f=id(?: separator="(.)")?}(.*)$', terms)
+        ids = match.group(2).split(match.group(1) or ",")
+        self.assertEqual(params["rows"], [str(len(ids))])
+        self.assertEqual(params["fl"], ["id"])
+        docs = ['<doc><str name="id">%s</str></doc>' % id
+                for id in ids if id in self.stored]
+        return None, ('<response><result name="response" numFound="%d" '
+                      'start="0">%s</result></response>'
+                      % (len(docs), "".join(docs)))
+
+    def test_existing(self):
+        """ Present ids are found with chunked terms queries.
+        """
+        ids = ["doc%d" % i for i in range(50)] + ["doc3", "a,b"]
+        present = solr.existing_ids(self.conn, ids, chunk_size=10,
+                                    fq="type:x")
+        self.assertEqual(present,
+                         set(["doc%d" % i for i in range(0, 50, 3)] + ["a,b"]))
+        self.assertEqual(len(self.posts), 6)
+        self.assertTrue("type:x" in cgi.parse_qs(self.posts[0][1])["fq"])
+
+    def test_bloom_filter(self):
+        """ Ids missing from the Bloom filter aren't looked up.
+        """
+        bloom = solr.BloomFilter(len(self.stored), error_rate=0.001)
+        bloom.update(self.stored)
+        for id in self.stored:
+            self.assertTrue(id in bloom)
+        ids = ["doc%d" % i for i in range(100)]
+        present = solr.existing_ids(self.conn, ids, chunk_size=100,
+                                    bloom=bloom)
+        self.assertEqual(present, self.stored - set(["a,b"]))
+        looked_up = cgi.parse_qs(self.posts[0][1])["rows"][0]
+        self.assertTrue(int(looked_up) < 40)
+
+
+class TestSolrLazyHighlight(SolrBased, WithConnection, PostTracking):
+
+    def respond(self, selector, body):
+        params = cgi.parse_qs(body)
+        start = int(params.get("start", ["0"])[0])
+        terms = [fq for fq in params.get("fq", []) if fq.startswith("{!terms")]
+        if terms:
+            ids = terms[0].split("}", 1)[1].split(",")
+        else:
+            ids = ["doc%d" % i for i in range(start, start + 2)]
+        docs = "".join(['<doc><str name="id">%s</str></doc>' % id
+                        for id in ids])
+        xml = ['<response><result name="response" numFound="4" start="%d">'
+               '%s</result>' % (start, docs)]
+        if "hl" in params:
+            xml.append('<lst name="highlighting">')
+            for id in ids:
+                xml.append('<lst name="%s"><arr name="title"><str>%s%s</str>'
+                           '</arr></lst>'
+                           % (id, params["hl.simple.pre"][0], id))
+            xml.append('</lst>')
+        xml.append('</response>')
+        return None, "".join(xml)
+
+    def test_lazy(self):
+        """ Highlighting is fetched for the page on first access.
+        """
+        response = self.conn.select("title:x", fields="title",
+                                    highlight=True, lazy_highlight=True,
+                                    hl_simple_pre="*", facet="true",
+                                    fq="type:a", rows=2)
+        params = cgi.parse_qs(self.posts[0][1])
+        self.assertFalse("hl" in params or "hl.simple.pre" in params)
+        self.assertEqual(params["fl"], ["title,id,score"])
+        self.assertEqual(len(self.posts), 1)
+
+        self.assertEqual(response.highlighting["doc1"]["title"], ["*doc1"])
+        self.assertEqual(len(self.posts), 2)
+        params = cgi.parse_qs(self.posts[1][1])
+        self.assertEqual(params["fq"], ["type:a", "{!terms f=id}doc0,doc1"])
+        self.assertEqual(params["hl.fl"], ["title"])
+        self.assertEqual((params["rows"], params["fl"]), (["2"], ["id"]))
+        self.assertFalse("facet" in params)
+        self.assertEqual(response.highlighting.keys(), ["doc0", "doc1"])
+        self.assertEqual(len(self.posts), 2)
+
+        response = response.next_batch()
+        self.assertEqual(len(self.posts), 3)
+        self.assertEqual(response.highlighting["doc2"]["title"], ["*doc2"])
+        self.assertEqual(len(self.posts), 4)
+
+    def test_next_batch_parameters(self):
+        """ The following page is queried with the same fields and score
+        setting, and highlighted lazily.
+        """
+        response = self.conn.select("title:x", fields="title", score=False,
+                                    highlight=True, lazy_highlight=True,
+                                    hl_simple_pre="*", rows=2)
+        response = response.next_batch()
+        params = cgi.parse_qs(self.posts[1][1])
+        self.assertEqual(params["fl"], ["title,id"])
+        self.assertEqual((params["start"], params["rows"]), (["2"], ["2"]))
+        self.assertFalse("hl" in params)
+        self.assertEqual(response.highlighting["doc3"]["title"], ["*doc3"])
+        params = cgi.parse_qs(self.posts[2][1])
+        self.assertEqual(params["hl.simple.pre"], ["*"])
+        self.assertEqual(params["fq"], ["{!terms f=id}doc2,doc3"])
+
+    def test_not_lazy(self):
+        """ Without lazy_highlight, highlighting is in the response.
+        """
+        response = self.conn.select("title:x", fields="title",
+                                    highlight=True, hl_simple_pre="*")
+        self.assertEqual(response.highlighting["doc0"]["title"], ["*doc0"])
+        self.assertEqual(len(self.posts), 1)
+        response = self.conn.select("title:x", fields="title")
+        self.assertFalse(hasattr(response, "highlighting"))
+
+
 if __name__ == "__main__":
     unittest.main()